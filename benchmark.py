@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+"""
+USB Scanner benchmark
+Runs the scanner end to end against synthetic devices: generated file trees,
+fake udev events and a stand-in scan engine, no hardware or ClamAV needed
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+from pathlib import Path
+
+import usb_scanner
+from usbscanner.engine import ClamdEngine, VerdictCache, format_bytes
+from usbscanner.exchange import VerdictServer
+from usbscanner.mounts import MountWatcher
+from usbscanner.scheduler import EngineSlots
+from tests.fakes import EICAR, FakeClamd, FakeDevice, FakeMonitor, FakeMountTable, FakeTopology, SimulatedEngine
+
+
+# File size distributions: name -> (kind, parameters)
+SIZE_PROFILES = {
+    'small': ('uniform', 1024, 16 * 1024),
+    'mixed': ('lognormal', 11.0, 2.0, 64 * 1024 * 1024),     # median ~60 KB, long tail
+    'large': ('uniform', 1024 * 1024, 32 * 1024 * 1024),
+}
+
+# Extension mix, so triage has something to reorder
+FILE_TYPES = [
+    ('.txt', b''), ('.jpg', b'\xff\xd8\xff\xe0'), ('.pdf', b'%PDF-1.7'),
+    ('.exe', b'MZ\x90\x00'), ('.docx', b'PK\x03\x04'), ('.mp4', b'\x00\x00\x00\x18ftypmp42'),
+]
+
+SCENARIOS = {
+    'small-stick': {'files': 2000, 'sizes': 'small', 'depth': 4, 'eicar': 5},
+    'mixed-stick': {'files': 5000, 'sizes': 'mixed', 'depth': 8, 'eicar': 10},
+    'deep-tree': {'files': 2000, 'sizes': 'small', 'depth': 48, 'eicar': 2},
+    'four-sticks': {'files': 1500, 'sizes': 'small', 'depth': 4, 'eicar': 3, 'devices': 4},
+    'reinsert': {'files': 3000, 'sizes': 'small', 'depth': 4, 'eicar': 3, 'passes': 2, 'cache': True},
+    'portable-hdd': {'files': 2000, 'sizes': 'small', 'depth': 6, 'eicar': 3, 'disk': 'hdd'},
+    # Unplugged halfway through the first pass, then plugged back in
+    'unplugged': {'files': 3000, 'sizes': 'small', 'depth': 4, 'eicar': 3, 'passes': 2, 'interrupt': 0.5},
+    # The same stick at two kiosks sharing a verdict exchange; each pass is a fresh station
+    'kiosks': {'files': 3000, 'sizes': 'small', 'depth': 4, 'eicar': 3, 'passes': 2, 'stations': True},
+}
+
+# Simulated media: seek penalty for the engine and the sysfs profile the scanner sees
+DISKS = {
+    'hdd': {'seek': 0.008,
+            'profile': {'disk': 'sdb', 'speed_mbps': 5000.0, 'rotational': True, 'read_ahead_kb': 128}},
+}
+
+# Metric -> True if higher is better
+COMPARED_METRICS = {
+    'event_to_first_verdict_p50': False,
+    'event_to_complete_max': False,
+    'files_per_second': True,
+    'mb_per_second': True,
+    'peak_rss_mb': False,
+}
+
+BASELINE_PATH = usb_scanner.DATA_DIR / 'benchmark-baseline.json'
+
+
+# Synthetic devices
+
+def file_size(rng, profile):
+    kind, *params = SIZE_PROFILES[profile]
+    if kind == 'uniform':
+        return rng.randint(params[0], params[1])
+    mu, sigma, cap = params
+    return min(int(rng.lognormvariate(mu, sigma)), cap)
+
+
+def generate_tree(root, files, sizes='small', depth=4, eicar=0, seed=0):
+    """Create `files` files under root; returns (bytes written, EICAR paths)"""
+    rng = random.Random(seed)
+    filler = rng.randbytes(1024 * 1024) if hasattr(rng, 'randbytes') else os.urandom(1024 * 1024)
+    infected = set(rng.sample(range(files), min(eicar, files)))
+    total = 0
+    eicar_paths = []
+    for i in range(files):
+        directory = Path(root, *(f"dir{rng.randrange(8)}" for _ in range(rng.randint(0, depth))))
+        directory.mkdir(parents=True, exist_ok=True)
+        extension, magic = rng.choice(FILE_TYPES)
+        path = directory / f"file{i}{extension}"
+        with open(path, 'wb') as f:
+            if i in infected:
+                f.write(EICAR)
+                eicar_paths.append(str(path))
+                total += len(EICAR)
+                continue
+            size = file_size(rng, sizes)
+            f.write(magic[:size])
+            remaining = size - min(len(magic), size)
+            while remaining > 0:
+                chunk = filler[:remaining]
+                f.write(chunk)
+                remaining -= len(chunk)
+            total += size
+    return total, eicar_paths
+
+
+# Running a scenario
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+class Station:
+    """A headless scanner running its real event loop (USBScanner._main) on a thread.
+
+    udev events come from a fake netlink monitor and mounts from a fake
+    mountinfo file, so events take the same path as in the daemon: intake,
+    per-disk dispatch, mount wait and scheduling. Only the engine and the
+    sysfs io profile are stand-ins.
+    """
+
+    def __init__(self, config, args, disk, data_dir, mount_table):
+        # Keep manifests, caches and history out of the real data directory
+        usb_scanner.DATA_DIR = Path(data_dir)
+        scanner = usb_scanner.USBScanner(headless=True, config=config)
+        if args.engine in ('clamd', 'fake-clamd'):
+            scanner.engine = ClamdEngine(args.clamd_socket, pool_size=args.workers)
+        else:
+            scanner.engine = SimulatedEngine(args.latency, args.engine_mbps * 1024 * 1024, capacity=args.workers,
+                                             seek=disk['seek'] if disk else 0.0)
+        scanner.topology = FakeTopology(disk['profile'] if disk else None)
+        scanner.engine_slots = EngineSlots(scanner.engine.capacity)
+        scanner.refresh_signature_version()
+        # The kernel flags mountinfo changes at once; poll the fake file about as fast
+        scanner.mount_watcher = MountWatcher(mount_table.path, poll_interval=0.005)
+        scanner.monitor = FakeMonitor()
+        self.scanner = scanner
+        self.thread = threading.Thread(target=scanner._run_core, name='scanner-core', daemon=True)
+        self.thread.start()
+
+    def plug(self, devname, **properties):
+        self.scanner.monitor.push(FakeDevice('add', devname, **properties))
+
+    def unplug(self, devname):
+        self.scanner.monitor.push(FakeDevice('remove', devname))
+
+    def stop(self):
+        # Scans are over by now, so the loop is past its startup
+        self.scanner.request_stop()
+        self.thread.join(30)
+        self.scanner.monitor.close()
+
+
+def run_scenario(name, settings, args, workdir):
+    """Run one scenario in this process; returns its result dict"""
+    devices = settings.get('devices', 1)
+    passes = settings.get('passes', 1)
+    stations = settings.get('stations', False)
+
+    trees = []
+    for i in range(devices):
+        root = Path(workdir) / f"stick{i}"
+        size, infected = generate_tree(root, settings['files'], settings['sizes'], settings['depth'],
+                                       settings['eicar'], seed=args.seed + i)
+        trees.append((root, size, infected))
+    # Freshly written files have no extents until writeback allocates them
+    os.sync()
+
+    disk = DISKS.get(settings.get('disk'))
+    config = {
+        'physical_order': args.physical_order,
+        'scan_mode': args.scan_mode,
+        'scan_workers': args.workers,
+        'verdict_cache': settings.get('cache', False),
+        'incremental_scans': settings.get('cache', False),
+        'resume_window': 0 if args.no_resume else usb_scanner.DEFAULT_CONFIG['resume_window'],
+        'max_concurrent_scans': max(2, devices),
+        'report_files': False,
+        'log_file': Path(workdir) / 'scanner.log',
+        # Synthetic sticks have one partition each; sysfs would report them complete at once
+        'event_debounce': 0.0,
+    }
+    # The whole clamd client path (sessions, pooling, protocol) against a stand-in daemon
+    fake_clamd = None
+    if args.engine == 'fake-clamd':
+        fake_clamd = FakeClamd(Path(workdir) / 'clamd.sock', args.latency,
+                               args.engine_mbps * 1024 * 1024).start()
+        args.clamd_socket = fake_clamd.path
+
+    # Stations keep their own caches and share verdicts through a local stand-in exchange
+    exchange = None
+    if stations:
+        config['verdict_cache'] = True
+        if not args.no_exchange:
+            exchange = VerdictServer(VerdictCache(Path(workdir) / 'exchange.db'), 0)
+            exchange.start()
+            config['verdict_exchange'] = f"http://127.0.0.1:{exchange.port}"
+    mount_table = FakeMountTable(Path(workdir) / 'mountinfo')
+    station = Station(config, args, disk, Path(workdir) / 'data', mount_table)
+    scanner = station.scanner
+
+    results = []
+    for run in range(passes):
+        if stations and run:
+            station.stop()
+            station = Station(config, args, disk, Path(workdir) / f"data-{run}", mount_table)
+            scanner = station.scanner
+        started = time.time()
+        for i, (root, _, _) in enumerate(trees):
+            devname = f"/dev/sd{chr(ord('b') + i)}1"
+            station.plug(devname, ID_FS_TYPE='vfat', ID_FS_UUID=f"BENCH-{i:04d}", ID_SERIAL=f"bench-serial-{i}",
+                         ID_VENDOR='Bench', ID_MODEL='Synthetic', ID_FS_LABEL=f"STICK{i}")
+            # The desktop automounter mounts the stick shortly after udev announces it
+            threading.Timer(args.mount_delay, mount_table.mount, (devname, root)).start()
+        interrupted = bool(settings.get('interrupt')) and run == 0
+        if interrupted:
+            unplug_at = settings['interrupt'] * settings['files']
+            while len(scanner.history.scans(since=started)) < devices:
+                jobs = list(scanner.scheduler.jobs.values())
+                if jobs and all(job.progress and job.progress.files >= unplug_at for job in jobs):
+                    for job in jobs:
+                        mount_table.unmount(job.device_path)
+                        station.unplug(job.device_path)
+                    break
+                time.sleep(0.005)
+
+        # Each finished scan lands in the history store
+        while len(scanner.history.scans(since=started)) < devices or scanner.scheduler.jobs:
+            time.sleep(0.01)
+        elapsed = time.time() - started
+        reports = [scanner.history.get(scan['id']) for scan in scanner.history.scans(since=started)]
+
+        first_verdict = [sum(r['timings'].get(k, 0) for k in ('detect_to_mount', 'queue_wait', 'first_verdict'))
+                         for r in reports]
+        complete = [r['timings']['total'] for r in reports]
+        files = sum(r.get('files_scanned', 0) for r in reports)
+        scanned = sum(r.get('bytes_scanned', 0) for r in reports)
+        results.append({
+            'pass': run + 1,
+            'devices': devices,
+            'files': files,
+            'bytes': scanned,
+            'threats': sum(r['threats_found'] for r in reports),
+            'expected_threats': sum(len(infected) for _, _, infected in trees),
+            'cache_hits': sum(r.get('cache_hits', 0) for r in reports),
+            'exchange_hits': sum(r.get('exchange_hits', 0) for r in reports),
+            'elapsed': round(elapsed, 3),
+            'event_to_first_verdict_p50': round(percentile(first_verdict, 0.5), 4),
+            'event_to_first_verdict_max': round(max(first_verdict), 4),
+            'event_to_complete_p50': round(percentile(complete, 0.5), 3),
+            'event_to_complete_max': round(max(complete), 3),
+            'files_per_second': round(files / elapsed, 1),
+            'mb_per_second': round(scanned / elapsed / (1024 * 1024), 2),
+            'seeks': getattr(scanner.engine, 'seeks', 0),
+            'interrupted': interrupted,
+            'resumed_files': sum(r.get('resume', {}).get('resumed_files', 0) for r in reports),
+        })
+        if hasattr(scanner.engine, 'seeks'):
+            scanner.engine.seeks = 0
+
+        # Unplug the sticks, so the next pass is a fresh insertion
+        for i in range(devices):
+            devname = f"/dev/sd{chr(ord('b') + i)}1"
+            mount_table.unmount(devname)
+            station.unplug(devname)
+
+        # Quarantined EICAR files are removed from the tree; put them back for the next pass
+        for _, _, infected in trees:
+            for path in infected:
+                with open(path, 'wb') as f:
+                    f.write(EICAR)
+
+    station.stop()
+    if exchange:
+        exchange.stop()
+    if fake_clamd:
+        fake_clamd.stop()
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    for result in results:
+        result['peak_rss_mb'] = round(peak_rss_mb, 1)
+    return {'scenario': name, 'settings': settings, 'passes': results}
+
+
+def run_isolated(name, args):
+    """Run a scenario in a fresh interpreter so peak RSS is its own"""
+    with tempfile.TemporaryDirectory(prefix='usb-scanner-bench-') as workdir:
+        result_file = os.path.join(workdir, 'result.json')
+        command = [sys.executable, os.path.abspath(__file__), '--child', name, '--result-file', result_file]
+        command += child_arguments(args)
+        output = None if args.verbose else subprocess.DEVNULL
+        subprocess.run(command, check=True, stdout=output, stderr=output)
+        with open(result_file) as f:
+            return json.load(f)
+
+
+def child_arguments(args):
+    return ['--engine', args.engine, '--clamd-socket', args.clamd_socket, '--latency', str(args.latency),
+            '--engine-mbps', str(args.engine_mbps), '--workers', str(args.workers),
+            '--scan-mode', args.scan_mode, '--physical-order', args.physical_order, '--mount-delay', str(args.mount_delay), '--seed', str(args.seed),
+            '--scenario-json', json.dumps(scenario_settings(args))] + (['--no-resume'] if args.no_resume else []) \
+        + (['--no-exchange'] if args.no_exchange else [])
+
+
+def scenario_settings(args):
+    """Built-in scenarios with command-line overrides applied"""
+    scenarios = {}
+    for name, settings in SCENARIOS.items():
+        settings = dict(settings)
+        for key in ('files', 'sizes', 'depth', 'eicar', 'devices'):
+            value = getattr(args, key)
+            if value is not None:
+                settings[key] = value
+        scenarios[name] = settings
+    return scenarios
+
+
+# Reporting
+
+def compare(result, baseline, tolerance):
+    """Lines describing changes against the baseline; returns (lines, regressed)"""
+    lines, regressed = [], False
+    previous = {p['pass']: p for p in baseline.get('passes', [])}
+    for current in result['passes']:
+        old = previous.get(current['pass'])
+        if not old:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            if not old.get(metric) or current.get(metric) is None:
+                continue
+            change = (current[metric] - old[metric]) / old[metric]
+            worse = -change if higher_is_better else change
+            flag = ""
+            if worse > tolerance:
+                flag = "  ⚠ REGRESSION"
+                regressed = True
+            elif worse < -tolerance:
+                flag = "  ✓ improved"
+            lines.append(f"    pass {current['pass']} {metric}: {old[metric]} → {current[metric]} "
+                         f"({change:+.0%}){flag}")
+    return lines, regressed
+
+
+def print_result(result):
+    print(f"{result['scenario']}: {result['settings']}")
+    for p in result['passes']:
+        missed = 0 if p.get('interrupted') else p['expected_threats'] - p['threats']
+        print(f"  pass {p['pass']}: {p['devices']} device(s), {p['files']:,} files, "
+              f"{format_bytes(p['bytes'])} in {p['elapsed']:.2f}s"
+              + (" (unplugged)" if p.get('interrupted') else ""))
+        if p.get('resumed_files'):
+            print(f"    resumed: {p['resumed_files']:,} files carried over from the interrupted scan")
+        print(f"    event → first verdict: p50 {p['event_to_first_verdict_p50'] * 1000:.1f} ms, "
+              f"max {p['event_to_first_verdict_max'] * 1000:.1f} ms")
+        print(f"    event → complete: p50 {p['event_to_complete_p50']:.2f}s, max {p['event_to_complete_max']:.2f}s")
+        print(f"    throughput: {p['files_per_second']:,.0f} files/s, {p['mb_per_second']:.1f} MB/s, "
+              f"peak RSS {p['peak_rss_mb']:.0f} MB")
+        print(f"    threats: {p['threats']}/{p['expected_threats']}"
+              + (f" ({missed} MISSED)" if missed else "")
+              + (f", cache hits {p['cache_hits']:,}" if p['cache_hits'] else "")
+              + (f", exchange hits {p['exchange_hits']:,}" if p.get('exchange_hits') else ""))
+        if p.get('seeks'):
+            print(f"    simulated seeks: {p['seeks']:,}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='USB Scanner end-to-end benchmark (no hardware needed)')
+    parser.add_argument('scenarios', nargs='*', help=f"Scenarios to run (default: all of {', '.join(SCENARIOS)})")
+    parser.add_argument('--engine', choices=['simulated', 'fake-clamd', 'clamd'], default='simulated',
+                        help='Stand-in engine, ClamdEngine against a stand-in clamd socket, or a running clamd')
+    parser.add_argument('--clamd-socket', default=usb_scanner.DEFAULT_CONFIG['clamd_socket'])
+    parser.add_argument('--latency', type=float, default=0.002, help='Simulated per-file latency (seconds)')
+    parser.add_argument('--engine-mbps', type=float, default=200, help='Simulated engine throughput (MB/s)')
+    parser.add_argument('--workers', type=int, default=usb_scanner.DEFAULT_CONFIG['scan_workers'])
+    parser.add_argument('--scan-mode', choices=['sharded', 'tree'], default='sharded')
+    parser.add_argument('--physical-order', choices=['auto', 'always', 'never'], default='auto',
+                        help='Scanner physical_order setting (compare portable-hdd with --scan-mode tree)')
+    parser.add_argument('--mount-delay', type=float, default=0.0, help='Simulated event-to-mount delay')
+    parser.add_argument('--no-resume', action='store_true', help='Restart interrupted scans from scratch')
+    parser.add_argument('--no-exchange', action='store_true',
+                        help="Stations don't share verdicts (compare kiosks with and without)")
+    parser.add_argument('--files', type=int, help='Override file count')
+    parser.add_argument('--sizes', choices=list(SIZE_PROFILES), help='Override size distribution')
+    parser.add_argument('--depth', type=int, help='Override maximum nesting depth')
+    parser.add_argument('--eicar', type=int, help='Override number of EICAR files')
+    parser.add_argument('--devices', type=int, help='Override number of simultaneous devices')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--baseline', default=str(BASELINE_PATH), help='Baseline file to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='Store these results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help='Relative change treated as a regression (default 15%%)')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    parser.add_argument('--verbose', action='store_true', help="Show the scanner's own output")
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    parser.add_argument('--scenario-json', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        settings = json.loads(args.scenario_json)[args.child]
+        with tempfile.TemporaryDirectory(prefix='usb-scanner-bench-') as workdir:
+            result = run_scenario(args.child, settings, args, workdir)
+        with open(args.result_file, 'w') as f:
+            json.dump(result, f)
+        # Scanner threads may still be parked on their queues
+        os._exit(0)
+
+    names = args.scenarios or list(SCENARIOS)
+    unknown = [n for n in names if n not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    except (OSError, ValueError):
+        baseline = {}
+
+    results = {}
+    regressed = False
+    for name in names:
+        result = run_isolated(name, args)
+        results[name] = result
+        if args.json:
+            continue
+        print_result(result)
+        if name in baseline:
+            lines, worse = compare(result, baseline[name], args.tolerance)
+            regressed |= worse
+            if lines:
+                print("  vs baseline:")
+                print("\n".join(lines))
+        print()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+    if args.save_baseline:
+        Path(args.baseline).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(dict(baseline, **results), f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == "__main__":
+    main()
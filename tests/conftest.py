@@ -0,0 +1,28 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# Tests import the scanner modules from the checkout
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture
+def scanner(tmp_path, monkeypatch):
+    """A headless scanner with its data directory under tmp_path and the stand-in engine"""
+    import usb_scanner
+    from tests.fakes import SimulatedEngine
+    from usbscanner.scheduler import EngineSlots
+
+    monkeypatch.setattr(usb_scanner, 'DATA_DIR', tmp_path / 'data')
+    scanner = usb_scanner.USBScanner(headless=True, config={'log_file': tmp_path / 'scanner.log',
+                                                            'report_files': False, 'adaptive_io': False})
+
+    def check_dependencies(monitoring=True):
+        scanner.engine = SimulatedEngine(latency=0.0)
+        scanner.engine_slots = EngineSlots(scanner.engine.capacity)
+        return True
+
+    monkeypatch.setattr(scanner, 'check_dependencies', check_dependencies)
+    yield scanner
+    scanner.log_writer.close()
@@ -0,0 +1,325 @@
+"""Test doubles shared by the test suite and benchmark.py: no hardware, udev or ClamAV needed"""
+
+import os
+import time
+import socket
+import struct
+import threading
+import socketserver
+from collections import deque
+
+from usbscanner.engine import ScanEngine, ScanResult, iter_files
+from usbscanner.ordering import PhysicalOrder
+
+
+EICAR = rb'X5O!P%@AP[4\PZX54(P^)7CC)7}$EICAR-STANDARD-ANTIVIRUS-TEST-FILE!$H+H*'
+
+
+class FakeDevice:
+    """Just enough of a pyudev.Device for the scanner's udev event handling"""
+
+    def __init__(self, action, devname, **properties):
+        self.action = action
+        self.device_node = devname
+        self.sys_name = os.path.basename(devname)
+        self.properties = dict(properties, DEVNAME=devname)
+
+    def get(self, key, default=None):
+        return self.properties.get(key, default)
+
+
+class FakeMonitor:
+    """Stand-in for a pyudev netlink Monitor: devices pushed from any thread wake the event loop.
+
+    Like the netlink socket, fileno() turns readable while events are
+    waiting and poll(timeout=0) hands them out one at a time.
+    """
+
+    def __init__(self):
+        self.events = deque()
+        self.lock = threading.Lock()
+        self._read_fd, self._write_fd = os.pipe()
+        os.set_blocking(self._read_fd, False)
+
+    def fileno(self):
+        return self._read_fd
+
+    def push(self, device):
+        with self.lock:
+            self.events.append(device)
+            os.write(self._write_fd, b'\0')
+
+    def poll(self, timeout=None):
+        with self.lock:
+            if self.events:
+                return self.events.popleft()
+            try:
+                while os.read(self._read_fd, 4096):
+                    pass
+            except BlockingIOError:
+                pass
+        return None
+
+    def close(self):
+        os.close(self._read_fd)
+        os.close(self._write_fd)
+
+
+class FakeMountTable:
+    """A mountinfo file for MountWatcher; every mount() and unmount() rewrites it with a new mtime"""
+
+    BASE = "22 1 8:2 / / rw,relatime shared:1 - ext4 /dev/sda2 rw\n"
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.mounts = {}        # source -> mount point
+        self.version = 0
+        self.lock = threading.Lock()
+        self._write()
+
+    def mount(self, source, mount_point):
+        with self.lock:
+            self.mounts[source] = str(mount_point)
+            self._write()
+
+    def unmount(self, source):
+        with self.lock:
+            self.mounts.pop(source, None)
+            self._write()
+
+    def _write(self):
+        lines = [self.BASE]
+        for n, (source, mount_point) in enumerate(sorted(self.mounts.items())):
+            mount_point = mount_point.replace(' ', r'\040')
+            lines.append(f"{40 + n} 22 0:{900 + n} / {mount_point} rw - vfat {source} rw\n")
+        with open(self.path, 'w') as f:
+            f.write(''.join(lines))
+        # Rewrites within one timestamp tick must still look changed
+        self.version += 1
+        os.utime(self.path, ns=(self.version * 10 ** 9, self.version * 10 ** 9))
+
+
+class FakeTopology:
+    """Knows no devices, and reports every device with the same sysfs io profile (if any)"""
+
+    def __init__(self, profile=None):
+        self.profile = profile
+
+    def refresh(self):
+        pass
+
+    def update(self, device):
+        pass
+
+    def get(self, name):
+        return None
+
+    def usb_filesystems(self):
+        return []
+
+    def io_profile(self, name):
+        return dict(self.profile) if self.profile else None
+
+    def set_read_ahead(self, disk, kb):
+        return False
+
+
+class SimulatedEngine(ScanEngine):
+    """Stand-in engine: sleeps per file and flags files that start with the EICAR string.
+
+    With `seek` set it also models a single disk head: a file that does not
+    follow the previous one on disk (by the scanner's own FIEMAP/inode
+    location) costs a seek.
+    """
+
+    name = 'simulated'
+
+    SEQUENTIAL_GAP = {'fiemap': 1024 * 1024, 'inode': 64}
+
+    def __init__(self, latency=0.002, bytes_per_second=200 * 1024 * 1024, capacity=4, seek=0.0):
+        self.latency = latency
+        self.bytes_per_second = bytes_per_second
+        self.capacity = capacity
+        self.seek = seek
+        self.seeks = 0
+        self.locator = PhysicalOrder()
+        self.head = None
+        self.head_lock = threading.Lock()
+
+    def _seek_time(self, path, size):
+        location = self.locator.location(path)
+        with self.head_lock:
+            sequential = self.head is not None and \
+                0 <= location - self.head <= self.SEQUENTIAL_GAP[self.locator.method]
+            self.head = location + (size if self.locator.method == 'fiemap' else 1)
+            if sequential:
+                return 0.0
+            self.seeks += 1
+            return self.seek
+
+    def available(self):
+        return True
+
+    def version(self):
+        return 'simulated/1'
+
+    def _scan(self, path):
+        try:
+            size = os.path.getsize(path)
+            with open(path, 'rb') as f:
+                head = f.read(len(EICAR))
+        except OSError as e:
+            return ScanResult(path, 'ERROR', e.strerror)
+        seek = self._seek_time(path, size) if self.seek else 0.0
+        time.sleep(self.latency + seek + size / self.bytes_per_second)
+        if head == EICAR:
+            return ScanResult(path, 'FOUND', 'Eicar-Test-Signature')
+        return ScanResult(path, 'OK', None)
+
+    def scan_files(self, paths):
+        for path in paths:
+            yield self._scan(path)
+
+    def scan_tree(self, path):
+        yield from self.scan_files(iter_files(path))
+
+
+class FakeClamd:
+    """Stand-in clamd on a UNIX socket, for ClamdEngine without the real daemon.
+
+    Speaks the z-prefixed protocol: IDSESSION/END, PING, VERSION, RELOAD,
+    SCAN, INSTREAM and (outside sessions) MULTISCAN. Files that start with
+    the EICAR string are infected. SCAN of a path in `denied` fails with an
+    access error, as for a clamd running as another user, and
+    `drop_sessions()` closes open sessions the way clamd's idle timeout does.
+    """
+
+    VERSION = 'ClamAV 1.0.0/27000/Thu Jan  1 00:00:00 2026'
+
+    def __init__(self, path, latency=0.0, bytes_per_second=None):
+        self.path = str(path)
+        self.latency = latency
+        self.bytes_per_second = bytes_per_second
+        self.denied = set()
+        self.sessions = 0       # IDSESSIONs opened
+        self.commands = []      # every command received, in order
+        self.lock = threading.Lock()
+        self.connections = set()
+        fake = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                with fake.lock:
+                    fake.connections.add(self.request)
+                try:
+                    fake._serve(self.request)
+                except OSError:
+                    pass
+                finally:
+                    with fake.lock:
+                        fake.connections.discard(self.request)
+
+        self.server = socketserver.ThreadingUnixStreamServer(self.path, Handler)
+        self.server.daemon_threads = True
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name='fake-clamd', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.drop_sessions()
+        os.unlink(self.path)
+
+    def drop_sessions(self):
+        with self.lock:
+            connections = list(self.connections)
+        for conn in connections:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def _serve(self, conn):
+        buffer = b''
+
+        def read(size=None):
+            """`size` bytes, or up to the next NUL; None at EOF"""
+            nonlocal buffer
+            while (len(buffer) < size) if size else (b'\0' not in buffer):
+                data = conn.recv(65536)
+                if not data:
+                    return None
+                buffer += data
+            if size:
+                data, buffer = buffer[:size], buffer[size:]
+            else:
+                data, buffer = buffer.split(b'\0', 1)
+            return data
+
+        session, request_id = False, 0
+        while True:
+            command = read()
+            if not command:
+                return
+            command = command.decode()[1:]
+            if command == 'IDSESSION':
+                session = True
+                with self.lock:
+                    self.sessions += 1
+                continue
+            if command == 'END':
+                return
+            with self.lock:
+                self.commands.append(command)
+            data = None
+            if command == 'INSTREAM':
+                chunks = []
+                while True:
+                    header = read(4)
+                    if header is None:
+                        return
+                    length = struct.unpack('!L', header)[0]
+                    if not length:
+                        break
+                    chunks.append(read(length))
+                data = b''.join(chunks)
+            request_id += 1
+            for reply in self._answer(command, data):
+                if session:
+                    reply = f"{request_id}: {reply}"
+                conn.sendall(reply.encode() + b'\0')
+            if not session:
+                return
+
+    def _verdict(self, data):
+        time.sleep(self.latency + (len(data) / self.bytes_per_second if self.bytes_per_second else 0))
+        return 'Eicar-Test-Signature FOUND' if data.startswith(EICAR) else 'OK'
+
+    def _scan(self, path):
+        if path in self.denied:
+            return f"{path}: Access denied. ERROR"
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError as e:
+            return f"{path}: lstat() failed: {e.strerror}. ERROR"
+        return f"{path}: {self._verdict(data)}"
+
+    def _answer(self, command, data):
+        verb, _, argument = command.partition(' ')
+        if verb == 'PING':
+            return ['PONG']
+        if verb == 'VERSION':
+            return [self.VERSION]
+        if verb == 'RELOAD':
+            return ['RELOADING']
+        if verb == 'SCAN':
+            return [self._scan(argument)]
+        if verb == 'INSTREAM':
+            return [f"stream: {self._verdict(data)}"]
+        if verb == 'MULTISCAN':
+            found = [reply for reply in map(self._scan, iter_files(argument)) if not reply.endswith(' OK')]
+            return found or [f"{argument}: OK"]
+        return ['UNKNOWN COMMAND']
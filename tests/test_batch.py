@@ -0,0 +1,42 @@
+"""USBScanner.scan_batch with the stand-in engine"""
+
+from tests.fakes import EICAR
+from usb_scanner import directory_device_info
+
+
+class FakeMount:
+    def __init__(self):
+        self.unmounted = 0
+
+    def unmount(self):
+        self.unmounted += 1
+
+
+def make_tree(root, infected=0):
+    root.mkdir()
+    for i in range(5):
+        (root / f"file{i}.txt").write_text(f"clean {i}")
+    for i in range(infected):
+        (root / f"eicar{i}.com").write_bytes(EICAR)
+    return str(root)
+
+
+def test_directories(scanner, tmp_path):
+    clean = make_tree(tmp_path / 'clean')
+    dirty = make_tree(tmp_path / 'dirty', infected=2)
+    rows = {row['target']: row for row in scanner.scan_batch([clean, dirty, str(tmp_path / 'missing')])}
+    assert rows[clean]['result'] == 'clean' and rows[clean]['files'] == 5
+    assert rows[dirty]['result'] == '2 threats' and rows[dirty]['threats'] == 2
+    assert rows[str(tmp_path / 'missing')]['result'] == 'failed'
+
+
+def test_source_that_cannot_be_queued(scanner, tmp_path, monkeypatch):
+    tree = make_tree(tmp_path / 'tree')
+    first, second = FakeMount(), FakeMount()
+    # Two volumes reported under one device path: the second cannot be queued
+    monkeypatch.setattr(scanner, '_batch_sources', lambda path: [
+        (directory_device_info(tree), tree, 'image', first),
+        (directory_device_info(tree), tree, 'image', second)])
+    rows = scanner.scan_batch([tree])
+    assert sorted(row['result'] for row in rows) == ['clean', 'failed']
+    assert second.unmounted and first.unmounted
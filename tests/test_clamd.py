@@ -0,0 +1,119 @@
+"""ClamdEngine against the stand-in clamd from tests/fakes.py"""
+
+import pytest
+
+from tests.fakes import EICAR, FakeClamd
+from usbscanner.engine import ClamdEngine, ScanResult, parse_clam_line
+
+
+@pytest.fixture
+def clamd(tmp_path):
+    fake = FakeClamd(tmp_path / 'clamd.sock').start()
+    yield fake
+    fake.stop()
+
+
+@pytest.fixture
+def files(tmp_path):
+    clean = tmp_path / 'clean.txt'
+    clean.write_bytes(b'nothing to see here')
+    infected = tmp_path / 'eicar.com'
+    infected.write_bytes(EICAR)
+    return str(clean), str(infected)
+
+
+@pytest.mark.parametrize('line, expected', [
+    ('/media/a.txt: OK', ScanResult('/media/a.txt', 'OK', None)),
+    ('/media/b.exe: Win.Trojan.Agent-1 FOUND\n', ScanResult('/media/b.exe', 'FOUND', 'Win.Trojan.Agent-1')),
+    ('/media/c: Access denied. ERROR', ScanResult('/media/c', 'ERROR', 'Access denied.')),
+    ('/media/c: lstat() failed: No such file or directory. ERROR',
+     ScanResult('/media/c', 'ERROR', 'lstat() failed: No such file or directory.')),
+    ('/media/d: e: f.txt: OK', ScanResult('/media/d: e: f.txt', 'OK', None)),
+    ('stream: Eicar-Test-Signature FOUND', ScanResult('stream', 'FOUND', 'Eicar-Test-Signature')),
+    ('PONG', None),
+    ('/media/e: something else', None),
+])
+def test_parse_clam_line(line, expected):
+    assert parse_clam_line(line) == expected
+
+
+def test_parse_error_line_for_path_with_colon(tmp_path):
+    path = tmp_path / 'notes: draft.txt'
+    path.write_text('x')
+    line = f"{path}: lstat() failed: Permission denied. ERROR"
+    expected = ScanResult(str(path), 'ERROR', 'lstat() failed: Permission denied.')
+    assert parse_clam_line(line) == expected
+    assert parse_clam_line(line, str(path)) == expected
+
+
+def test_verdicts(clamd, files, tmp_path):
+    clean, infected = files
+    missing = str(tmp_path / 'missing')
+    engine = ClamdEngine(clamd.path, pool_size=1)
+    results = {r.path: r for r in engine.scan_files([clean, infected, missing])}
+    assert results[clean] == ScanResult(clean, 'OK', None)
+    assert results[infected] == ScanResult(infected, 'FOUND', 'Eicar-Test-Signature')
+    assert results[missing].status == 'ERROR' and 'No such file' in results[missing].detection
+    assert engine.available()
+    assert engine.version() == FakeClamd.VERSION
+    engine.close()
+
+
+def test_access_denied_falls_back_to_instream(clamd, files):
+    clean, infected = files
+    clamd.denied.update(files)
+    engine = ClamdEngine(clamd.path, pool_size=1)
+    assert engine.scan_file(infected) == ScanResult(infected, 'FOUND', 'Eicar-Test-Signature')
+    assert engine.scan_file(clean) == ScanResult(clean, 'OK', None)
+    assert clamd.commands == [f'SCAN {infected}', 'INSTREAM', f'SCAN {clean}', 'INSTREAM']
+    engine.close()
+
+
+def test_sessions_are_reused(clamd, files):
+    engine = ClamdEngine(clamd.path, pool_size=2)
+    for _ in range(5):
+        list(engine.scan_files(files))
+    assert clamd.sessions == 1
+    assert len(clamd.commands) == 10
+    engine.close()
+
+
+def test_dropped_session_is_retried_once(clamd, files):
+    clean, _ = files
+    engine = ClamdEngine(clamd.path, pool_size=2)
+    # Two idle sessions, both dropped by the daemon
+    with engine.session() as first, engine.session() as second:
+        first.command('PING')
+        second.command('PING')
+    clamd.drop_sessions()
+    assert engine.scan_file(clean) == ScanResult(clean, 'OK', None)
+    assert clamd.sessions == 3
+    engine.close()
+
+
+def test_unreadable_file_is_not_retried(clamd, files, tmp_path):
+    clean, _ = files
+    unreadable = tmp_path / 'folder.txt'
+    unreadable.mkdir()
+    clamd.denied.add(str(unreadable))
+    engine = ClamdEngine(clamd.path, pool_size=2)
+    with engine.session() as first, engine.session() as second:
+        first.command('PING')
+        second.command('PING')
+    [result] = engine.scan_files([str(unreadable)])
+    assert result.status == 'ERROR' and 'directory' in result.detection
+    # Neither resent nor taken for a dropped session: the other idle session is still used
+    assert clamd.commands == ['PING', 'PING', f'SCAN {unreadable}', 'INSTREAM']
+    assert engine.scan_file(clean) == ScanResult(clean, 'OK', None)
+    assert clamd.sessions == 2
+    engine.close()
+
+
+def test_unreachable_clamd_is_an_error_verdict(clamd, files):
+    clean, _ = files
+    engine = ClamdEngine(clamd.path, pool_size=1)
+    clamd.stop()
+    [result] = engine.scan_files([clean])
+    assert result.status == 'ERROR'
+    assert not engine.available()
+    clamd.start = clamd.stop = lambda: None
@@ -0,0 +1,130 @@
+"""ControlServer: JSON commands over the UNIX socket, its permissions and single-instance check"""
+
+import asyncio
+import errno
+import json
+import os
+import socket
+import stat
+import threading
+from contextlib import closing, contextmanager
+
+import pytest
+
+from usbscanner.client import control_request, control_stream
+from usbscanner.control import ControlServer
+
+
+@contextmanager
+def serving(scanner, path):
+    """Run a ControlServer on its own event loop thread, as the daemon does"""
+    loop = asyncio.new_event_loop()
+    server = ControlServer(scanner, path)
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    async def stop():
+        await server.stop()
+        # Subscribers whose client already hung up
+        clients = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in clients:
+            task.cancel()
+        await asyncio.gather(*clients, return_exceptions=True)
+
+    try:
+        asyncio.run_coroutine_threadsafe(server.start(), loop).result(5)
+        yield server
+    finally:
+        asyncio.run_coroutine_threadsafe(stop(), loop).result(5)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(5)
+        loop.close()
+
+
+@pytest.fixture
+def control(scanner, tmp_path):
+    scanner.check_dependencies()
+    path = tmp_path / 'control.sock'
+    with serving(scanner, path):
+        yield path
+
+
+def raw_request(path, line):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(2)
+        sock.connect(str(path))
+        sock.sendall(line)
+        with sock.makefile('rb') as replies:
+            return json.loads(replies.readline())
+
+
+def test_status_and_jobs(control):
+    status = control_request(control, {'cmd': 'status'})
+    assert status['ok'] and status['pid'] == os.getpid() and status['engine'] == 'simulated'
+    assert control_request(control, {'cmd': 'jobs'}) == {'jobs': [], 'ok': True}
+
+
+def test_bad_requests(control):
+    assert control_request(control, {'cmd': 'reboot'}) == {'ok': False, 'error': "unknown command: 'reboot'"}
+    assert raw_request(control, b'not json\n') == {'ok': False, 'error': 'unknown command: None'}
+    assert raw_request(control, b'["status"]\n')['ok'] is False
+
+
+def test_scan_and_cancel(control, tmp_path):
+    stick = tmp_path / 'stick'
+    stick.mkdir()
+    reply = control_request(control, {'cmd': 'scan', 'path': str(stick)})
+    assert reply['ok'] and reply['job']['state'] == 'queued' and reply['job']['mount_point'] == str(stick)
+    job_id = reply['job']['id']
+    assert [job['id'] for job in control_request(control, {'cmd': 'jobs'})['jobs']] == [job_id]
+    # The same directory is not queued twice
+    assert control_request(control, {'cmd': 'scan', 'path': str(stick)})['ok'] is False
+    assert control_request(control, {'cmd': 'scan', 'path': str(tmp_path / 'missing')}) == {
+        'ok': False, 'error': f"not a directory: {tmp_path / 'missing'}"}
+
+    assert control_request(control, {'cmd': 'cancel', 'job': job_id}) == {'cancelled': [job_id], 'ok': True}
+    assert control_request(control, {'cmd': 'cancel', 'device': '/dev/sdz'})['ok'] is False
+
+
+def test_cache(control, scanner, monkeypatch):
+    scanner.verdict_cache.put('a' * 64, 'v1', 'OK')
+    scanner.verdict_cache.flush()
+    assert control_request(control, {'cmd': 'cache'})['cache'] == {'entries': 1, 'hits': 0, 'misses': 0}
+    monkeypatch.setattr(scanner, 'verdict_cache', None)
+    assert control_request(control, {'cmd': 'cache'}) == {'ok': False, 'error': 'verdict cache disabled'}
+
+
+def test_subscribe_streams_events(control, tmp_path):
+    stick = tmp_path / 'stick'
+    stick.mkdir()
+    control_request(control, {'cmd': 'scan', 'path': str(stick)})
+    with closing(control_stream(control, {'cmd': 'subscribe', 'interval': 0.1})) as events:
+        job, progress, again = next(events), next(events), next(events)
+    assert job['event'] == 'job' and job['job']['state'] == 'queued'
+    assert progress['event'] == 'progress' and progress['jobs'] == []
+    # Unchanged jobs are not repeated
+    assert again['event'] == 'progress'
+
+
+def test_socket_is_private(control):
+    assert stat.S_IMODE(os.stat(control).st_mode) == 0o600
+
+
+def test_second_scanner_refused(control, scanner):
+    with pytest.raises(OSError) as error:
+        with serving(scanner, control):
+            pass
+    assert error.value.errno == errno.EADDRINUSE
+    # The running scanner keeps its socket
+    assert control_request(control, {'cmd': 'jobs'})['ok']
+
+
+def test_stale_socket_replaced(scanner, tmp_path):
+    scanner.check_dependencies()
+    path = tmp_path / 'control.sock'
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(str(path))
+    stale.close()
+    with serving(scanner, path):
+        assert control_request(path, {'cmd': 'jobs'})['ok']
+    assert not path.exists()
@@ -0,0 +1,53 @@
+"""DefinitionsManager updates from a local mirror directory"""
+
+import asyncio
+
+import pytest
+
+from usbscanner.engine import DefinitionsManager
+
+
+def write_cvd(path, version):
+    header = f"ClamAV-VDB:01 Jan 2026 00-00 +0000:{version}:1000:90:sig:builder:1767225600".encode()
+    path.write_bytes(header.ljust(512, b' ') + b'signatures')
+
+
+@pytest.fixture
+def manager(tmp_path):
+    (tmp_path / 'mirror').mkdir()
+    return DefinitionsManager(tmp_path / 'store', tmp_path / 'state.json', mirror=tmp_path / 'mirror',
+                              verify=False)
+
+
+def test_empty_mirror_without_databases_fails(manager):
+    assert asyncio.run(manager.update()) == 'failed'
+    assert not manager.active_dir.exists()
+    assert manager.versions() == {}
+    assert 'last_update' not in manager.state()
+    # Checked again soon rather than after the full interval
+    assert manager.seconds_until_due() <= DefinitionsManager.MISSING_RETRY
+
+
+def test_mirror_updates(manager):
+    write_cvd(manager.mirror / 'main.cvd', 62)
+    write_cvd(manager.mirror / 'daily.cvd', 27000)
+    assert asyncio.run(manager.update()) == 'updated'
+    assert manager.versions() == {'main': 62, 'daily': 27000}
+    state = manager.state()
+    assert state['versions'] == {'main': 62, 'daily': 27000} and state['last_update'] >= state['last_check']
+    assert manager.seconds_until_due() > DefinitionsManager.MISSING_RETRY
+
+    assert asyncio.run(manager.update()) == 'current'
+
+    write_cvd(manager.mirror / 'daily.cvd', 27001)
+    assert asyncio.run(manager.update()) == 'updated'
+    assert manager.versions() == {'main': 62, 'daily': 27001}
+    assert len(list(manager.store.glob('db-*'))) == DefinitionsManager.KEEP
+
+
+def test_emptied_mirror_keeps_installed_databases(manager):
+    write_cvd(manager.mirror / 'daily.cvd', 27000)
+    assert asyncio.run(manager.update()) == 'updated'
+    (manager.mirror / 'daily.cvd').unlink()
+    assert asyncio.run(manager.update()) == 'current'
+    assert manager.versions() == {'daily': 27000}
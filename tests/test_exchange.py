@@ -0,0 +1,153 @@
+"""VerdictExchange against a VerdictServer on a free local port"""
+
+import time
+import hashlib
+import urllib.error
+
+import pytest
+
+from usbscanner.engine import VerdictCache
+from usbscanner.exchange import VerdictExchange, VerdictServer
+
+VERSION = 'daily:27000'
+
+
+def digest(n):
+    return hashlib.sha256(str(n).encode()).hexdigest()
+
+
+@pytest.fixture
+def server(tmp_path):
+    cache = VerdictCache(tmp_path / 'exchange.db')
+    server = VerdictServer(cache, 0, token='secret')
+    server.start()
+    yield server
+    server.stop()
+    cache.close()
+
+
+def client_for(server, **options):
+    options.setdefault('token', 'secret')
+    return VerdictExchange(f"http://127.0.0.1:{server.port}", **options)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_lookup_hits_and_misses(server):
+    server.cache.merge([(digest(1), VERSION, 'OK', None), (digest(2), VERSION, 'FOUND', 'Eicar-Test-Signature')])
+    client = client_for(server)
+    found = client.lookup([digest(1), digest(2), digest(3)], VERSION)
+    assert found == {digest(1): ('OK', None), digest(2): ('FOUND', 'Eicar-Test-Signature')}
+    # Verdicts only hold for the signature version they were made under
+    assert client.lookup([digest(1)], 'daily:27001') == {}
+    stats = client.stats()
+    assert (stats['hits'], stats['misses'], stats['last_error']) == (2, 2, None)
+    client.close()
+
+
+def test_publish_batches_and_flush(server):
+    client = client_for(server)
+    client.BATCH = 4
+    for n in range(3):
+        client.publish(digest(n), VERSION, 'OK')
+    time.sleep(0.1)
+    assert server.stats()['stored'] == 0 and client.stats()['queued'] == 3
+
+    # A full batch goes out from the sender thread
+    client.publish(digest(3), VERSION, 'FOUND', 'Eicar-Test-Signature')
+    assert wait_for(lambda: server.stats()['stored'] == 4)
+
+    client.publish(digest(4), VERSION, 'OK')
+    client.flush()
+    assert server.stats()['stored'] == 5 and client.stats()['sent'] == 5
+    assert client.lookup([digest(3)], VERSION) == {digest(3): ('FOUND', 'Eicar-Test-Signature')}
+    client.close()
+    assert not client.sender.is_alive()
+
+
+def test_backlog_while_server_down(tmp_path):
+    cache = VerdictCache(tmp_path / 'exchange.db')
+    server = VerdictServer(cache, 0)
+    port = server.port
+    server.stop()
+    client = VerdictExchange(f"http://127.0.0.1:{port}", retry_after=0.3)
+    try:
+        client.publish(digest(1), VERSION, 'OK')
+        client.flush()
+        assert not client.available and client.stats()['queued'] == 1 and client.failures == 1
+        # Within retry_after nothing is attempted
+        assert client.lookup([digest(1)], VERSION) == {}
+        client.flush()
+        assert client.failures == 1
+
+        server = VerdictServer(cache, port)
+        server.start()
+        assert wait_for(lambda: client.available)
+        client.flush()
+        assert client.stats()['queued'] == 0 and client.stats()['sent'] == 1
+        assert client.lookup([digest(1)], VERSION) == {digest(1): ('OK', None)}
+        assert client.last_error is None
+    finally:
+        client.close()
+        server.stop()
+        cache.close()
+
+
+def test_backlog_bounded(server, monkeypatch):
+    monkeypatch.setattr(VerdictExchange, 'BACKLOG', 3)
+    client = client_for(server)
+    client.down_until = time.monotonic() + 60
+    for n in range(5):
+        client.publish(digest(n), VERSION, 'OK')
+    # Oldest records are dropped
+    assert [record[0] for record in client.outbox] == [digest(2), digest(3), digest(4)]
+    client.close()
+
+
+def test_wrong_token(server):
+    client = client_for(server, token='wrong')
+    assert client.lookup([digest(1)], VERSION) == {}
+    assert '401' in client.last_error and not client.available
+    client.down_until = 0
+    client.publish(digest(1), VERSION, 'OK')
+    client.flush()
+    assert server.stats()['stored'] == 0 and client.stats()['queued'] == 1
+    client.close()
+
+
+def test_malformed_records_rejected(server):
+    client = client_for(server)
+    good = [digest(1), VERSION, 'OK', None]
+    reply = client._request('/v1/verdicts', {'verdicts': [
+        good,
+        [digest(2), VERSION, 'CLEAN', None],                # unknown status
+        ['not-a-hash', VERSION, 'OK', None],
+        [digest(3).upper(), VERSION, 'OK', None],
+        [digest(4), '', 'OK', None],                        # no signature version
+        [digest(5), VERSION, 'FOUND', 'x' * 1000],          # detection too long
+        [digest(6), VERSION, 'OK'],
+        'garbage',
+    ]})
+    assert reply == {'stored': 1, 'rejected': 7}
+    assert server.stats()['rejected'] == 7
+    with pytest.raises(urllib.error.HTTPError) as error:
+        client._request('/v1/verdicts', ['not', 'an', 'object'])
+    assert error.value.code == 400
+    with pytest.raises(urllib.error.HTTPError) as error:
+        client._request('/v1/lookup', {'signature_version': VERSION, 'hashes': 'nope'})
+    assert error.value.code == 400
+    client.close()
+
+
+def test_token_required_off_loopback(tmp_path):
+    cache = VerdictCache(tmp_path / 'exchange.db')
+    try:
+        with pytest.raises(ValueError):
+            VerdictServer(cache, 0, host='0.0.0.0')
+    finally:
+        cache.close()
@@ -0,0 +1,108 @@
+"""ScanHistory recording and aggregation, and parse_since"""
+
+import json
+from datetime import datetime
+
+import pytest
+
+from usbscanner.reporting import ScanHistory, parse_since
+
+STICK = {'vendor': 'SanDisk', 'model': 'Cruzer', 'label': 'WORK', 'serial': 'SN1', 'uuid': '1234-ABCD'}
+OTHER = {'vendor': 'Kingston', 'model': 'DataTraveler', 'label': 'No Label', 'serial': 'SN2', 'uuid': '5678-EF01'}
+
+
+def report(timestamp, device, mount_point='/media/user/WORK', infected=(), duration=2.0, **extra):
+    return dict({
+        'timestamp': timestamp,
+        'mount_point': mount_point,
+        'device': device,
+        'duration_seconds': duration,
+        'files_scanned': 10,
+        'bytes_scanned': 1000,
+        'infected_files': [f"{path}: {name} FOUND" for path, name in infected],
+        'threats_found': len(infected),
+        'scan_errors': 0,
+    }, **extra)
+
+
+@pytest.fixture
+def history(tmp_path):
+    history = ScanHistory(tmp_path / 'history.db')
+    yield history
+    history.close()
+
+
+def test_append_and_query(history):
+    first = history.append(report('2026-03-01T10:00:00', STICK))
+    second = history.append(report('2026-03-02T10:00:00', STICK, infected=[('/media/user/WORK/a.exe', 'Win.Trojan.X')]))
+    third = history.append(report('2026-03-03T10:00:00', OTHER, mount_point='/media/user/KT', duration=None,
+                                  scan_duration='0:01:30.500000', cancelled=True))
+    # The same report twice is recorded once
+    assert history.append(report('2026-03-01T10:00:00', STICK)) is None
+
+    scans = history.scans()
+    assert [scan['id'] for scan in scans] == [third, second, first]
+    assert scans[0]['device'] == 'Kingston DataTraveler' and scans[0]['duration'] == 90.5 and scans[0]['cancelled']
+    assert scans[1]['device'] == 'SanDisk Cruzer WORK' and scans[1]['device_id'] == 'SN1-1234-ABCD'
+    assert history.get(second)['infected_files'] == ['/media/user/WORK/a.exe: Win.Trojan.X FOUND']
+    assert history.get(999) is None
+
+    assert [s['id'] for s in history.scans(device='kingston')] == [third]
+    assert [s['id'] for s in history.scans(detection='trojan')] == [second]
+    assert [s['id'] for s in history.scans(threats_only=True)] == [second]
+    since = datetime.fromisoformat('2026-03-02T00:00:00').timestamp()
+    assert [s['id'] for s in history.scans(since=since)] == [third, second]
+    assert [s['id'] for s in history.scans(until=since)] == [first]
+    assert [s['id'] for s in history.scans(limit=1)] == [third]
+
+
+def test_aggregate(history):
+    history.append(report('2026-03-01T10:00:00', STICK, duration=2.0))
+    history.append(report('2026-03-01T11:00:00', STICK, duration=4.0,
+                          infected=[('/media/user/WORK/a.exe', 'Win.Trojan.X'), ('/media/user/WORK/b.exe', 'Eicar')]))
+    history.append(report('2026-04-02T10:00:00', OTHER, mount_point='/media/user/KT',
+                          infected=[('/media/user/KT/c.com', 'Eicar')]))
+
+    [total] = history.aggregate()
+    assert (total['scans'], total['threats'], total['infected_scans'], total['devices']) == (3, 3, 2, 2)
+    assert total['files'] == 30 and total['avg_duration'] == pytest.approx(8 / 3)
+
+    by_month = {row['key']: row['scans'] for row in history.aggregate('month')}
+    assert by_month == {'2026-03': 2, '2026-04': 1}
+    by_device = {row['key']: (row['scans'], row['name']) for row in history.aggregate('device')}
+    assert by_device == {'SN1-1234-ABCD': (2, 'SanDisk Cruzer WORK'), 'SN2-5678-EF01': (1, 'Kingston DataTraveler')}
+
+    by_detection = {row['key']: (row['scans'], row['threats'], row['devices'])
+                    for row in history.aggregate('detection')}
+    assert by_detection == {'Eicar': (2, 2, 2), 'Win.Trojan.X': (1, 1, 1)}
+    assert [row['key'] for row in history.aggregate('detection', device='kingston')] == ['Eicar']
+
+
+def test_import_reports(history, tmp_path):
+    good = tmp_path / 'scan_report_1.json'
+    good.write_text(json.dumps(report('2026-03-01T10:00:00', STICK)))
+    broken = tmp_path / 'scan_report_2.json'
+    broken.write_text('{not json')
+    incomplete = tmp_path / 'scan_report_3.json'
+    incomplete.write_text(json.dumps({'mount_point': '/media/x'}))
+    assert history.import_reports([good, broken, incomplete, tmp_path / 'missing.json']) == 1
+    assert history.import_reports([good]) == 0
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('12h', 1_000_000 - 12 * 3600),
+    ('7d', 1_000_000 - 7 * 86400),
+    ('2w', 1_000_000 - 14 * 86400),
+    (' 3d ', 1_000_000 - 3 * 86400),
+])
+def test_parse_since_relative(value, expected):
+    assert parse_since(value, now=1_000_000) == expected
+
+
+def test_parse_since_absolute():
+    assert parse_since('2026-03-01') == datetime(2026, 3, 1).timestamp()
+    assert parse_since('2026-03-01T12:30') == datetime(2026, 3, 1, 12, 30).timestamp()
+    with pytest.raises(ValueError):
+        parse_since('yesterday')
+    with pytest.raises(ValueError):
+        parse_since('5y')
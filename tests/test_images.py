@@ -0,0 +1,60 @@
+"""ImageMount through udisksctl, against scripted replies"""
+
+import pytest
+
+from usbscanner import images
+from usbscanner.images import ImageMount, Volume
+
+VOLUME = Volume(1, 1048576, 4194304, 'vfat', '1234-ABCD', 'STICK')
+
+
+class Udisks:
+    """Scripted udisksctl: a reply string is printed, an OSError raised"""
+
+    def __init__(self):
+        self.replies = {'loop-setup': "Mapped file disk.img as /dev/loop7.\n"}
+        self.calls = []
+
+    def run(self, args, timeout=60):
+        self.calls.append(args[1])
+        reply = self.replies.get(args[1], '')
+        if isinstance(reply, OSError):
+            raise reply
+        return reply
+
+
+@pytest.fixture
+def udisks(monkeypatch):
+    fake = Udisks()
+    monkeypatch.setattr(images, '_run', fake.run)
+    return fake
+
+
+def test_mount(udisks):
+    udisks.replies['mount'] = "Mounted /dev/loop7 at /media/user/STICK.\n"
+    mount = ImageMount('disk.img', VOLUME)
+    mount._mount_udisks()
+    assert (mount.loop, mount.path) == ('/dev/loop7', '/media/user/STICK')
+
+
+def test_already_mounted(udisks):
+    udisks.replies['mount'] = OSError("udisksctl mount: Error mounting /dev/loop7: "
+                                      "GDBus.Error: Device /dev/loop7 is already mounted at `/media/user/STICK'.")
+    mount = ImageMount('disk.img', VOLUME)
+    mount._mount_udisks()
+    assert mount.path == '/media/user/STICK'
+
+
+@pytest.mark.parametrize('command, reply', [
+    ('loop-setup', "Object /org/freedesktop/UDisks2/block_devices/loop7 set up\n"),
+    ('mount', "Mounted somewhere else entirely\n"),
+])
+def test_unexpected_reply(udisks, command, reply):
+    udisks.replies[command] = reply
+    mount = ImageMount('disk.img', VOLUME)
+    with pytest.raises(OSError) as error:
+        mount._mount_udisks()
+    assert reply.strip() in str(error.value)
+    if command == 'mount':
+        # The loop device is not left behind
+        assert udisks.calls[-1] == 'loop-delete' and mount.loop is None
@@ -0,0 +1,121 @@
+"""Mount-waiting and scanning a disk's partitions, and partitions going away meanwhile"""
+
+import time
+import asyncio
+
+import pytest
+
+from usb_scanner import directory_device_info
+from usbscanner.mounts import MountWatcher
+
+BASE = "22 1 8:2 / / rw,relatime shared:1 - ext4 /dev/sda2 rw\n"
+
+
+class Disk:
+    """A two-partition disk whose partitions mount when mount() rewrites a fake mountinfo"""
+
+    def __init__(self, scanner, tmp_path):
+        self.scanner = scanner
+        self.mountinfo = tmp_path / 'mountinfo'
+        self.mountinfo.write_text(BASE)
+        self.roots = {}
+        self.mounted = {}
+        self.group = []
+        for number in (1, 2):
+            root = tmp_path / f"part{number}"
+            root.mkdir()
+            (root / 'file.txt').write_text(f"partition {number}")
+            path = f"/dev/sdx{number}"
+            self.roots[number] = str(root)
+            scanner.intake.add('/dev/sdx', path, None, time.time())
+            self.group.append((dict(directory_device_info(str(root)), path=path), time.time()))
+        scanner.mount_watcher = MountWatcher(str(self.mountinfo), poll_interval=0.01)
+
+    def mount(self, number):
+        self.mounted[f"/dev/sdx{number}"] = self.roots[number]
+        lines = [f"{40 + n} 22 0:{900 + n} / {root} rw - vfat {path} rw\n"
+                 for n, (path, root) in enumerate(sorted(self.mounted.items()))]
+        self.mountinfo.write_text(BASE + ''.join(lines))
+        self.scanner.mount_watcher.refresh()
+
+
+@pytest.fixture
+def disk(scanner, tmp_path):
+    scanner.check_dependencies()
+    scanner.scheduler.start()
+    yield Disk(scanner, tmp_path)
+    scanner.scheduler.stop()
+
+
+def scanned(scanner):
+    return [scan['mount_point'] for scan in reversed(scanner.history.scans())]
+
+
+def test_task_scans_partitions_as_they_mount(scanner, disk):
+    async def main():
+        scanner.loop = asyncio.get_running_loop()
+        scanner.mount_watcher.attach(scanner.loop)
+        try:
+            task = scanner.loop.create_task(scanner._disk_task('/dev/sdx', disk.group))
+            scanner.device_tasks['/dev/sdx'] = task
+            # The second partition mounts first and does not wait for the first
+            disk.mount(2)
+            for _ in range(500):
+                if scanned(scanner):
+                    break
+                await asyncio.sleep(0.01)
+            assert scanned(scanner) == [disk.roots[2]] and not task.done()
+            disk.mount(1)
+            await asyncio.wait_for(task, 5)
+        finally:
+            scanner.mount_watcher.detach()
+
+    asyncio.run(main())
+    assert scanned(scanner) == [disk.roots[2], disk.roots[1]]
+    assert not scanner.mount_waits
+
+
+def test_task_survives_partition_removal(scanner, disk):
+    async def main():
+        scanner.loop = asyncio.get_running_loop()
+        scanner.mount_watcher.attach(scanner.loop)
+        try:
+            task = scanner.loop.create_task(scanner._disk_task('/dev/sdx', disk.group))
+            scanner.device_tasks['/dev/sdx'] = task
+            await asyncio.sleep(0.05)
+            scanner._device_removed('/dev/sdx1')
+            assert not task.done() and '/dev/sdx' in scanner.device_tasks
+            disk.mount(2)
+            await asyncio.wait_for(task, 5)
+        finally:
+            scanner.mount_watcher.detach()
+
+    asyncio.run(main())
+    assert scanned(scanner) == [disk.roots[2]]
+    assert not scanner.mount_waits
+
+
+def test_disk_removal_cancels_task(scanner, disk):
+    async def main():
+        scanner.loop = asyncio.get_running_loop()
+        scanner.mount_watcher.attach(scanner.loop)
+        try:
+            task = scanner.loop.create_task(scanner._disk_task('/dev/sdx', disk.group))
+            scanner.device_tasks['/dev/sdx'] = task
+            task.add_done_callback(lambda t: scanner._disk_task_done('/dev/sdx', t))
+            await asyncio.sleep(0.05)
+            scanner._device_removed('/dev/sdx')
+
+            # Plugged straight back in: the disk stays busy until the old task has unwound
+            info, detected_at = disk.group[0]
+            scanner.intake.add('/dev/sdx', '/dev/sdx1', info, detected_at, expected=['/dev/sdx1'])
+            assert '/dev/sdx' in scanner.device_tasks
+            assert scanner.intake.ready(busy=scanner.device_tasks) == []
+            await asyncio.gather(task, return_exceptions=True)
+            assert not scanner.device_tasks and not scanner.mount_waits
+            assert scanner.intake.ready(busy=scanner.device_tasks) == [('/dev/sdx', [(info, detected_at)])]
+            return task.cancelled()
+        finally:
+            scanner.mount_watcher.detach()
+
+    assert asyncio.run(main())
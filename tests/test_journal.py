@@ -0,0 +1,126 @@
+"""ScanJournal: checkpointing an interrupted scan and resuming it"""
+
+import os
+import time
+
+import pytest
+
+from usbscanner.engine import ScanJournal, ScanResult
+
+VERSION = 'daily:27000'
+
+
+@pytest.fixture
+def stick(tmp_path):
+    root = tmp_path / 'stick'
+    root.mkdir()
+    for n in range(6):
+        (root / f"file{n}.txt").write_text(f"clean {n}")
+    return root
+
+
+def journal_for(tmp_path, stick, version=VERSION, window=3600):
+    return ScanJournal(tmp_path / 'checkpoints', 'stick-1234', str(stick), version, window=window)
+
+
+def paths(stick):
+    return sorted(str(path) for path in stick.iterdir())
+
+
+def interrupted_run(tmp_path, stick, verdicts):
+    """A first run that judged `verdicts` ({name: (status, detection)}) and then stopped"""
+    journal = journal_for(tmp_path, stick)
+    journal.open()
+    for path in journal.pending(paths(stick)):
+        name = os.path.basename(path)
+        if name in verdicts:
+            journal.record(ScanResult(path, *verdicts[name]))
+    journal.close(complete=False)
+    return journal
+
+
+def test_resume_skips_judged_files(tmp_path, stick):
+    interrupted_run(tmp_path, stick, {'file0.txt': ('OK', None), 'file1.txt': ('FOUND', 'Eicar'),
+                                      'file2.txt': ('ERROR', 'Access denied')})
+    journal = journal_for(tmp_path, stick)
+    assert journal.previous is not None
+    pending = list(journal.pending(paths(stick)))
+    # Errors are retried
+    assert [os.path.basename(path) for path in pending] == ['file2.txt', 'file3.txt', 'file4.txt', 'file5.txt']
+    assert journal.resumed_clean == [str(stick / 'file0.txt')]
+    assert journal.previous_threats() == [f"{stick / 'file1.txt'}: Eicar FOUND"]
+    journal.open()
+    summary = journal.summary()
+    assert (summary['runs'], summary['resumed_files'], summary['previous_threats']) == (2, 2, 1)
+    assert summary['resumed_bytes'] == len('clean 0') + len('clean 1')
+    journal.close(complete=True)
+    assert not journal.path.exists()
+
+
+def test_changed_files_are_rescanned(tmp_path, stick):
+    interrupted_run(tmp_path, stick, {'file0.txt': ('OK', None), 'file1.txt': ('FOUND', 'Eicar')})
+    (stick / 'file1.txt').write_text('cleaned up since')
+    journal = journal_for(tmp_path, stick)
+    assert str(stick / 'file1.txt') in list(journal.pending(paths(stick)))
+    # A detection in a file that changed is no longer carried over
+    assert journal.previous_threats() == []
+
+
+@pytest.mark.parametrize('version, window', [('daily:27001', 3600), (VERSION, -1)])
+def test_stale_journal_starts_over(tmp_path, stick, version, window):
+    interrupted_run(tmp_path, stick, {'file0.txt': ('OK', None)})
+    journal = journal_for(tmp_path, stick, version, window)
+    assert journal.previous is None and journal.completed == {}
+    assert len(list(journal.pending(paths(stick)))) == 6
+    # The journal is rewritten for this run, without the earlier verdicts
+    journal.open()
+    journal.close(complete=False)
+    reopened = journal_for(tmp_path, stick, version)
+    assert reopened.runs == 2 and reopened.completed == {}
+
+
+def test_several_interruptions(tmp_path, stick):
+    interrupted_run(tmp_path, stick, {'file0.txt': ('OK', None)})
+    interrupted_run(tmp_path, stick, {'file1.txt': ('OK', None)})
+    journal = journal_for(tmp_path, stick)
+    assert journal.runs == 3
+    assert len(list(journal.pending(paths(stick)))) == 4
+
+
+def test_torn_last_line_ignored(tmp_path, stick):
+    interrupted_run(tmp_path, stick, {'file0.txt': ('OK', None), 'file1.txt': ('OK', None)})
+    journal = journal_for(tmp_path, stick)
+    with open(journal.path, 'a') as f:
+        f.write('["file2.txt", "OK", nu')
+    journal = journal_for(tmp_path, stick)
+    assert sorted(journal.completed) == ['file0.txt', 'file1.txt']
+
+
+def test_records_are_flushed_in_batches(tmp_path, stick, monkeypatch):
+    monkeypatch.setattr(ScanJournal, 'FLUSH_RECORDS', 4)
+    monkeypatch.setattr(ScanJournal, 'FLUSH_SECONDS', 3600)
+    journal = journal_for(tmp_path, stick)
+    journal.open()
+    pending = list(journal.pending(paths(stick)))
+    for path in pending[:3]:
+        journal.record(ScanResult(path, 'OK', None))
+    assert len(journal.path.read_text().splitlines()) == 1      # just the header
+    journal.record(ScanResult(pending[3], 'OK', None))
+    assert len(journal.path.read_text().splitlines()) == 5
+    # A crash now loses at most the unflushed tail
+    journal.record(ScanResult(pending[4], 'OK', None))
+    assert len(journal_for(tmp_path, stick).completed) == 4
+    journal.close(complete=False)
+    assert len(journal_for(tmp_path, stick).completed) == 5
+
+
+def test_flushed_after_a_quiet_interval(tmp_path, stick, monkeypatch):
+    monkeypatch.setattr(ScanJournal, 'FLUSH_SECONDS', 0.05)
+    journal = journal_for(tmp_path, stick)
+    journal.open()
+    first, second = list(journal.pending(paths(stick)))[:2]
+    journal.record(ScanResult(first, 'OK', None))
+    time.sleep(0.06)
+    journal.record(ScanResult(second, 'OK', None))
+    assert len(journal.path.read_text().splitlines()) == 3
+    journal.close(complete=False)
@@ -0,0 +1,47 @@
+"""LogWriter: batching to the text and JSON logs, write errors and writes after close"""
+
+import json
+import time
+
+from usbscanner.logwriter import LogWriter
+
+
+def test_records_written(tmp_path):
+    writer = LogWriter(tmp_path / 'scanner.log', tmp_path / 'scanner.jsonl')
+    assert writer.write('INFO', "first")
+    assert writer.write('SUCCESS', "second")
+    writer.close()
+    lines = (tmp_path / 'scanner.log').read_text().splitlines()
+    assert [line.split(' - ', 1)[1] for line in lines] == ['INFO - first', 'INFO - second']
+    records = [json.loads(line) for line in (tmp_path / 'scanner.jsonl').read_text().splitlines()]
+    assert [(r['level'], r['message']) for r in records] == [('INFO', 'first'), ('SUCCESS', 'second')]
+
+
+def test_write_errors_counted_and_reported_once(tmp_path, capsys):
+    writer = LogWriter(tmp_path / 'scanner.log')
+
+    def disk_full(data):
+        raise OSError(28, "No space left on device")
+
+    writer.text.write = disk_full
+    for i in range(3):
+        writer.write('INFO', f"record {i}")
+        # One batch per record
+        deadline = time.time() + 5
+        while writer.failed <= i and time.time() < deadline:
+            time.sleep(0.01)
+    writer.close()
+    assert writer.failed == 3
+    err = capsys.readouterr().err.splitlines()
+    assert len(err) == 2
+    assert 'No space left on device' in err[0]
+    assert err[1].startswith('3 log records could not be written')
+
+
+def test_write_after_close_rejected(tmp_path):
+    writer = LogWriter(tmp_path / 'scanner.log')
+    writer.write('INFO', "before")
+    writer.close()
+    assert not writer.write('ERROR', "after")
+    assert not writer.records
+    assert 'after' not in (tmp_path / 'scanner.log').read_text()
@@ -0,0 +1,104 @@
+"""ManifestStore persistence and ManifestTracker incremental planning"""
+
+import os
+import time
+
+from usbscanner.engine import ManifestStore, ManifestTracker, ScanResult
+
+VERSION = 'daily:27000'
+HOUR_AGO_NS = time.time_ns() - 3600 * 10**9
+
+
+def make_tree(root, count=10):
+    root.mkdir()
+    for n in range(count):
+        write(root / f"file{n}.txt", f"clean {n}")
+    return root
+
+
+def write(path, text, mtime_ns=HOUR_AGO_NS):
+    path.write_text(text)
+    # Well outside the racy window, as for files that sat on the stick
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def full_scan(root, previous=None, version=VERSION):
+    tracker = ManifestTracker(str(root), previous, version, 'vfat')
+    paths = list(tracker.paths())
+    for path in paths:
+        tracker.record(ScanResult(path, 'OK', None))
+    return tracker, paths
+
+
+def test_store_round_trip(tmp_path):
+    store = ManifestStore(tmp_path / 'manifests')
+    assert store.load('stick') is None
+    store.save('stick', {'complete': True, 'files': {'a.txt': [1, 2, 0]}})
+    assert store.load('stick') == {'complete': True, 'files': {'a.txt': [1, 2, 0]}}
+    (tmp_path / 'manifests' / 'broken.json.gz').write_bytes(b'not gzip')
+    assert store.load('broken') is None
+
+
+def test_first_scan_is_full(tmp_path):
+    root = make_tree(tmp_path / 'stick')
+    tracker, paths = full_scan(root)
+    assert len(paths) == 10
+    assert tracker.summary() == {'mode': 'full', 'reason': 'no previous manifest', 'unchanged_skipped': 0}
+    assert len(tracker.manifest()['files']) == 10
+
+
+def test_rescan_only_changed_files(tmp_path):
+    root = make_tree(tmp_path / 'stick')
+    first, _ = full_scan(root)
+    write(root / 'file3.txt', 'changed contents')
+    write(root / 'new.txt', 'new')
+    os.remove(root / 'file7.txt')
+
+    tracker, paths = full_scan(root, first.manifest())
+    assert sorted(paths) == [str(root / 'file3.txt'), str(root / 'new.txt')]
+    assert tracker.summary() == {'mode': 'incremental', 'reason': None, 'unchanged_skipped': 8}
+    files = tracker.manifest()['files']
+    assert len(files) == 10 and 'file7.txt' not in files
+
+
+def test_detections_are_not_remembered(tmp_path):
+    root = make_tree(tmp_path / 'stick', count=2)
+    tracker = ManifestTracker(str(root), None, VERSION, 'vfat')
+    for path in tracker.paths():
+        if path.endswith('file0.txt'):
+            tracker.record(ScanResult(path, 'FOUND', 'Eicar-Test-Signature'))
+        else:
+            tracker.record(ScanResult(path, 'OK', None))
+    assert list(tracker.manifest()['files']) == ['file1.txt']
+
+
+def test_recently_modified_files_are_not_remembered(tmp_path):
+    root = make_tree(tmp_path / 'stick', count=2)
+    write(root / 'file1.txt', 'just written', mtime_ns=time.time_ns())
+    tracker, _ = full_scan(root)
+    assert list(tracker.manifest()['files']) == ['file0.txt']
+
+
+def test_falls_back_to_a_full_scan(tmp_path):
+    root = make_tree(tmp_path / 'stick')
+    first, _ = full_scan(root)
+    manifest = first.manifest()
+
+    tracker, paths = full_scan(root, manifest, version='daily:27001')
+    assert (tracker.mode, tracker.reason, len(paths)) == ('full', 'definitions changed', 10)
+
+    tracker, paths = full_scan(root, dict(manifest, complete=False))
+    assert (tracker.mode, tracker.reason, len(paths)) == ('full', 'previous scan incomplete', 10)
+
+    for n in range(6):
+        write(root / f"file{n}.txt", f"changed {n}")
+    tracker, paths = full_scan(root, manifest)
+    assert (tracker.mode, tracker.reason, len(paths)) == ('full', '60% of files changed', 10)
+
+
+def test_clock_skew_forces_a_full_scan(tmp_path):
+    root = make_tree(tmp_path / 'stick')
+    first, _ = full_scan(root)
+    # Unchanged files claiming to be newer than the manifest itself: the clock cannot be trusted
+    tracker, paths = full_scan(root, dict(first.manifest(), created_ns=HOUR_AGO_NS - 10**9))
+    assert (tracker.mode, tracker.reason, len(paths)) == ('full', 'timestamps newer than the manifest', 10)
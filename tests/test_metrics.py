@@ -0,0 +1,71 @@
+"""Metrics rendering in the Prometheus text format, and the textfile writer"""
+
+import os
+
+from usbscanner.reporting import Metrics
+
+
+def test_counters_and_gauges():
+    metrics = Metrics()
+    metrics.describe('scans_total', 'counter', 'Scans finished')
+    metrics.describe('queue_depth', 'gauge', 'Jobs waiting')
+    metrics.inc('scans_total', result='clean')
+    metrics.inc('scans_total', 2, result='clean')
+    metrics.inc('scans_total', result='infected')
+    metrics.set('queue_depth', 3)
+    assert metrics.render().splitlines() == [
+        '# HELP usb_scanner_scans_total Scans finished',
+        '# TYPE usb_scanner_scans_total counter',
+        'usb_scanner_scans_total{result="clean"} 3',
+        'usb_scanner_scans_total{result="infected"} 1',
+        '# HELP usb_scanner_queue_depth Jobs waiting',
+        '# TYPE usb_scanner_queue_depth gauge',
+        'usb_scanner_queue_depth 3',
+    ]
+
+
+def test_label_values_are_escaped():
+    metrics = Metrics()
+    metrics.describe('threats_total', 'counter', 'Detections')
+    metrics.inc('threats_total', device='C:\\stick "A"\nB', detection='Eicar')
+    [sample] = [line for line in metrics.render().splitlines() if not line.startswith('#')]
+    assert sample == 'usb_scanner_threats_total{detection="Eicar",device="C:\\\\stick \\"A\\"\\nB"} 1'
+
+
+def test_histogram_buckets_are_cumulative():
+    metrics = Metrics()
+    metrics.describe('scan_seconds', 'histogram', 'Scan duration')
+    for value in (0.01, 0.3, 0.3, 7, 5000):
+        metrics.observe('scan_seconds', value, mode='sharded')
+    samples = dict(line.rsplit(' ', 1) for line in metrics.render().splitlines() if not line.startswith('#'))
+    bucket = 'usb_scanner_scan_seconds_bucket{{mode="sharded",le="{}"}}'.format
+    assert samples[bucket(0.05)] == '1'
+    assert samples[bucket(0.25)] == '1'
+    assert samples[bucket(0.5)] == '3'
+    assert samples[bucket(10)] == '4'
+    assert samples[bucket(3600)] == '4'
+    assert samples[bucket('+Inf')] == '5'
+    assert float(samples['usb_scanner_scan_seconds_sum{mode="sharded"}']) == 5007.61
+    assert samples['usb_scanner_scan_seconds_count{mode="sharded"}'] == '5'
+    assert len([key for key in samples if '_bucket' in key]) == len(Metrics.BUCKETS) + 1
+
+
+def test_collectors_run_before_rendering():
+    metrics = Metrics(prefix='kiosk')
+    metrics.describe('running', 'gauge', 'Scans running')
+    renders = iter(range(1, 10))
+    metrics.collect_with(lambda m: m.set('running', next(renders)))
+    metrics.collect_with(lambda m: 1 / 0)      # a broken collector does not break the page
+    assert 'kiosk_running 1' in metrics.render()
+    assert 'kiosk_running 2' in metrics.render()
+
+
+def test_write_textfile(tmp_path):
+    metrics = Metrics()
+    metrics.describe('up', 'gauge', 'Scanner running')
+    metrics.set('up', 1)
+    path = tmp_path / 'usb_scanner.prom'
+    metrics.write_textfile(path)
+    assert 'usb_scanner_up 1' in path.read_text()
+    assert oct(os.stat(path).st_mode & 0o777) == oct(0o644)
+    assert os.listdir(tmp_path) == ['usb_scanner.prom']
@@ -0,0 +1,98 @@
+"""MountWatcher against a fake mountinfo file"""
+
+import os
+import asyncio
+import threading
+
+import pytest
+
+from usbscanner.mounts import MountWatcher, parse_mountinfo
+
+BASE = ("22 1 8:2 / / rw,relatime shared:1 - ext4 /dev/sda2 rw\n"
+        "23 22 0:22 / /proc rw,relatime - proc proc rw\n")
+STICK = "40 22 8:17 / /media/user/MY\\040STICK rw,nosuid,nodev shared:30 - vfat /dev/sdb1 rw,fmask=0022\n"
+BIND = "41 22 8:17 /photos /home/user/photos rw,relatime - vfat /dev/sdb1 rw\n"
+
+
+class FakeMountinfo:
+    """A mountinfo file whose every rewrite gets a new mtime"""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.version = 0
+        self.write(BASE)
+
+    def write(self, text):
+        with open(self.path, 'w') as f:
+            f.write(text)
+        # Rewrites within one timestamp tick must still look changed
+        self.version += 1
+        os.utime(self.path, ns=(self.version * 10 ** 9, self.version * 10 ** 9))
+
+    def write_later(self, text, delay=0.1):
+        timer = threading.Timer(delay, self.write, (text,))
+        timer.start()
+        return timer
+
+
+@pytest.fixture
+def mountinfo(tmp_path):
+    return FakeMountinfo(tmp_path / 'mountinfo')
+
+
+def test_parse_mountinfo():
+    mounts = parse_mountinfo(BASE + STICK + "garbage line\n")
+    assert len(mounts) == 3
+    stick = mounts[2]
+    assert stick['dev'] == '8:17'
+    assert stick['mount_point'] == '/media/user/MY STICK'    # optional fields and \040 handled
+    assert stick['fs_type'] == 'vfat'
+    assert stick['source'] == '/dev/sdb1'
+    assert stick['options'] == 'rw,nosuid,nodev'
+
+
+def test_lookup_prefers_filesystem_root(mountinfo):
+    mountinfo.write(BASE + BIND + STICK)
+    watcher = MountWatcher(mountinfo.path)
+    assert not watcher.event_driven
+    assert watcher.lookup('/dev/sdb1') == '/media/user/MY STICK'
+    assert watcher.lookup('/dev/sdc1') is None
+
+
+def test_mount_and_unmount_detected(mountinfo):
+    watcher = MountWatcher(mountinfo.path, poll_interval=0.01)
+
+    async def main():
+        watcher.attach(asyncio.get_running_loop())
+        try:
+            assert watcher.lookup('/dev/sdb1') is None
+            mountinfo.write_later(BASE + STICK)
+            assert await watcher.wait_for_async('/dev/sdb1', timeout=5) == '/media/user/MY STICK'
+
+            mountinfo.write(BASE)
+            for _ in range(500):
+                if watcher.lookup('/dev/sdb1') is None:
+                    return True
+                await asyncio.sleep(0.01)
+            return False
+        finally:
+            watcher.detach()
+
+    assert asyncio.run(main())
+
+
+def test_wait_for_async(mountinfo):
+    watcher = MountWatcher(mountinfo.path, poll_interval=0.01)
+
+    async def main():
+        watcher.attach(asyncio.get_running_loop())
+        try:
+            mountinfo.write_later(BASE + STICK)
+            mounted = await watcher.wait_for_async('/dev/sdb1', timeout=5)
+            missing = await watcher.wait_for_async('/dev/sdc1', timeout=0.1)
+            return mounted, missing
+        finally:
+            watcher.detach()
+
+    assert asyncio.run(main()) == ('/media/user/MY STICK', None)
+
@@ -0,0 +1,80 @@
+"""PhysicalOrder: windowed on-disk ordering, the inode fallback and read-ahead"""
+
+import errno
+import sys
+
+import usbscanner.ordering
+from usbscanner.ordering import PhysicalOrder
+
+
+def located(locations, **options):
+    """PhysicalOrder that takes locations from a dict and records prefetches"""
+    ordering = PhysicalOrder(**options)
+    ordering.location = locations.__getitem__
+    ordering.prefetched_paths = []
+    ordering.prefetch = ordering.prefetched_paths.append
+    return ordering
+
+
+def test_windows_sorted_and_growing(monkeypatch):
+    monkeypatch.setattr(PhysicalOrder, 'FIRST_WINDOW', 2)
+    locations = {f"f{n}": location for n, location in enumerate([9, 3, 8, 1, 7, 5, 0, 6, 2, 4])}
+    ordering = located(locations, max_window=4)
+    # Windows of 2, 4, then 4 (the cap)
+    assert list(ordering.order(list(locations))) == ['f1', 'f0', 'f3', 'f5', 'f4', 'f2', 'f6', 'f8', 'f9', 'f7']
+    assert ordering.summary() == {'method': 'fiemap', 'files': 10, 'prefetched': 0}
+
+
+def test_prefetch_runs_ahead_of_the_consumer():
+    locations = {f"f{n}": n for n in range(10)}
+    ordering = located(locations, lookahead=3)
+    for path in ordering.order(list(locations)):
+        n = int(path[1:])
+        # Everything up to `lookahead` files ahead was already asked for
+        assert ordering.prefetched_paths == [f"f{i}" for i in range(min(n + 4, 10))]
+
+
+def test_fiemap_location(tmp_path, monkeypatch):
+    path = tmp_path / 'a.txt'
+    path.write_text('a')
+    monkeypatch.setattr(usbscanner.ordering, 'fiemap_offset', lambda fd: 4096)
+    ordering = PhysicalOrder()
+    assert ordering.location(str(path)) == 4096
+    assert ordering.location(str(tmp_path / 'missing')) == sys.maxsize
+
+
+def test_inode_fallback(tmp_path, monkeypatch):
+    path = tmp_path / 'a.txt'
+    path.write_text('a')
+
+    def unsupported(fd):
+        raise OSError(errno.EOPNOTSUPP, 'not supported')
+
+    monkeypatch.setattr(usbscanner.ordering, 'fiemap_offset', unsupported)
+    ordering = PhysicalOrder()
+    assert ordering.location(str(path)) == path.stat().st_ino
+    assert ordering.method == 'inode'
+
+
+def test_other_fiemap_errors_sort_last(tmp_path, monkeypatch):
+    path = tmp_path / 'a.txt'
+    path.write_text('a')
+
+    def failing(fd):
+        raise OSError(errno.EIO, 'I/O error')
+
+    monkeypatch.setattr(usbscanner.ordering, 'fiemap_offset', failing)
+    ordering = PhysicalOrder()
+    assert ordering.location(str(path)) == sys.maxsize
+    assert ordering.method == 'fiemap'
+
+
+def test_only_small_files_prefetched(tmp_path, monkeypatch):
+    monkeypatch.setattr(PhysicalOrder, 'PREFETCH_MAX', 10)
+    small, large = tmp_path / 'small', tmp_path / 'large'
+    small.write_bytes(b'x' * 10)
+    large.write_bytes(b'x' * 11)
+    ordering = PhysicalOrder()
+    for path in (small, large, tmp_path / 'missing'):
+        ordering.prefetch(str(path))
+    assert ordering.prefetched == 1
@@ -0,0 +1,84 @@
+"""QuarantineStore: deduplication, restore, purge and the legacy flat-file import"""
+
+import json
+import os
+
+import pytest
+
+from tests.fakes import EICAR
+from usbscanner.quarantine import QuarantineStore
+
+
+@pytest.fixture(params=['lzma', 'zlib'])
+def store(tmp_path, request):
+    store = QuarantineStore(tmp_path / 'quarantine', request.param)
+    yield store
+    store.db.close()
+
+
+def infected(tmp_path, name, data=EICAR):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def objects(store):
+    return [path for path in store.objects.rglob('*') if path.is_file()]
+
+
+def test_identical_files_stored_once(store, tmp_path):
+    first_id, sha, duplicate = store.add(infected(tmp_path, 'a.com'), 'Eicar-Test-Signature')
+    assert not duplicate
+    second_id, same_sha, duplicate = store.add(infected(tmp_path, 'b.com'), 'Eicar-Test-Signature',
+                                               device_info={'label': 'STICK'})
+    assert duplicate and same_sha == sha and second_id != first_id
+    assert len(objects(store)) == 1
+    entries = store.list()
+    assert [entry['original_path'] for entry in entries] == [str(tmp_path / 'a.com'), str(tmp_path / 'b.com')]
+    assert entries[0]['size'] == len(EICAR)
+    assert json.loads(entries[1]['device_info']) == {'label': 'STICK'}
+
+
+def test_restore(store, tmp_path):
+    data = EICAR + os.urandom(3 * QuarantineStore.CHUNK_SIZE // 2)
+    entry_id, _, _ = store.add(infected(tmp_path, 'big.exe', data), 'Eicar-Test-Signature')
+    os.remove(tmp_path / 'big.exe')
+    assert store.restore(entry_id) == str(tmp_path / 'big.exe')
+    assert (tmp_path / 'big.exe').read_bytes() == data
+    assert store.get(entry_id)['restored_to'] == str(tmp_path / 'big.exe')
+    # Never over an existing file
+    with pytest.raises(FileExistsError):
+        store.restore(entry_id)
+    with pytest.raises(KeyError):
+        store.restore(entry_id + 1)
+
+
+def test_purge_keeps_shared_objects(store, tmp_path):
+    first_id, _, _ = store.add(infected(tmp_path, 'a.com'), 'Eicar-Test-Signature')
+    store.add(infected(tmp_path, 'b.com'), 'Eicar-Test-Signature')
+    other_id, _, _ = store.add(infected(tmp_path, 'c.exe', EICAR + b'other'), 'Eicar-Test-Signature')
+    assert store.purge(first_id) == 1
+    assert len(objects(store)) == 2
+    assert store.purge(other_id) == 1
+    assert len(objects(store)) == 1
+    assert store.purge() == 1
+    assert store.list() == [] and objects(store) == []
+
+
+def test_import_legacy_skips_unreadable_files(store, tmp_path):
+    directory = store.directory
+    (directory / '20250101_120000_a.com.quarantine').write_bytes(EICAR)
+    (directory / '20250101_120000_a.com.quarantine.metadata').write_text(json.dumps({
+        'original_path': '/media/stick/a.com', 'detection': 'Eicar-Test-Signature',
+        'quarantine_time': '20250101_120000'}))
+    # A directory where a file is expected cannot be read
+    (directory / '20250101_120001_b.com.quarantine').mkdir()
+    (directory / '20250101_120002_c.com.quarantine').write_bytes(EICAR + b'c')
+
+    assert store.import_legacy() == (2, 1)
+    entries = store.list()
+    assert [entry['original_path'] for entry in entries] == [
+        '/media/stick/a.com', str(directory / '20250101_120002_c.com.quarantine')]
+    assert entries[0]['quarantine_time'] == '2025-01-01T12:00:00'
+    # The unreadable one stays for the next attempt
+    assert [path.name for path in directory.glob('*.quarantine')] == ['20250101_120001_b.com.quarantine']
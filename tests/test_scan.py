@@ -0,0 +1,146 @@
+"""USBScanner.scan_device outcomes as logged and shown in the GUI"""
+
+import os
+import threading
+
+import usb_scanner
+from tests.fakes import EICAR
+from usb_scanner import directory_device_info
+from usbscanner.scheduler import ScanJob
+
+
+class FakeGUI:
+    def __init__(self):
+        self.statuses = []
+
+    def update_status(self, text, color):
+        self.statuses.append(text)
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+def scan(scanner, tmp_path, monkeypatch, cancel=False):
+    root = tmp_path / 'stick'
+    root.mkdir()
+    for i in range(5):
+        (root / f"file{i}.txt").write_text(f"clean {i}")
+    scanner.check_dependencies()
+    logged = []
+    monkeypatch.setattr(scanner, 'log', lambda message, level='INFO': logged.append(message))
+    scanner.gui = FakeGUI()
+    device_info = directory_device_info(str(root))
+    job = ScanJob(device_info['path'], str(root), device_info)
+    if cancel:
+        job.cancel()
+    scanner.scan_device(str(root), device_info, job)
+    return logged, scanner.gui.statuses
+
+
+def test_complete_scan_reported_clean(scanner, tmp_path, monkeypatch):
+    logged, statuses = scan(scanner, tmp_path, monkeypatch)
+    assert "✅ Scan complete - No threats" in logged
+    assert statuses[-1] == "Clean"
+
+
+def test_cancelled_scan_never_reported_clean(scanner, tmp_path, monkeypatch):
+    logged, statuses = scan(scanner, tmp_path, monkeypatch, cancel=True)
+    assert "✅ Scan complete - No threats" not in logged
+    assert any('cancelled - incomplete' in message for message in logged)
+    assert statuses[-1] == "Scan cancelled / incomplete" and "Clean" not in statuses
+
+
+def test_only_hinted_sizes_hashed_before_the_engine(scanner, tmp_path, monkeypatch):
+    root = tmp_path / 'stick'
+    root.mkdir()
+    (root / 'a.txt').write_text('one')
+    (root / 'b.txt').write_text('four')
+    scanner.check_dependencies()
+    monkeypatch.setattr(scanner, 'log', lambda message, level='INFO': None)
+    engine_read, hashed = [], []
+    scan_file = scanner.engine._scan
+    monkeypatch.setattr(scanner.engine, '_scan', lambda path: engine_read.append(path) or scan_file(path))
+    hash_file = usb_scanner._engine.hash_file
+    monkeypatch.setattr(usb_scanner._engine, 'hash_file',
+                        lambda path: hashed.append((path, path in engine_read)) or hash_file(path))
+
+    def run():
+        engine_read.clear()
+        hashed.clear()
+        device_info = directory_device_info(str(root))
+        scanner.scan_device(str(root), device_info, ScanJob(device_info['path'], str(root), device_info))
+
+    # Nothing cached yet: every file is hashed after the engine has read it
+    run()
+    assert sorted(hashed) == [(str(root / 'a.txt'), True), (str(root / 'b.txt'), True)]
+    assert scanner.verdict_cache.sizes('simulated/1') == {3, 4}
+
+    # Known sizes are hashed up front and answered from the cache; a new size goes to the engine first
+    (root / 'c.txt').write_text('seven')
+    run()
+    assert engine_read == [str(root / 'c.txt')]
+    assert sorted(hashed) == [(str(root / 'a.txt'), False), (str(root / 'b.txt'), False),
+                              (str(root / 'c.txt'), True)]
+
+
+def test_threats_quarantined_while_the_scan_runs(scanner, tmp_path, monkeypatch):
+    root = tmp_path / 'stick'
+    root.mkdir()
+    (root / 'setup.com').write_bytes(EICAR)
+    for i in range(3):
+        (root / f"notes{i}.txt").write_text(f"clean {i}")
+    scanner.check_dependencies()
+    monkeypatch.setattr(scanner, 'log', lambda message, level='INFO': None)
+    quarantined = threading.Event()
+    quarantine_file = scanner._quarantine_file
+
+    def quarantine(*args):
+        entry_id = quarantine_file(*args)
+        quarantined.set()
+        return entry_id
+
+    monkeypatch.setattr(scanner, '_quarantine_file', quarantine)
+    # The executable is triaged first; the rest of the scan cannot finish until its verdict was acted on
+    waited = []
+    scan_file = scanner.engine._scan
+
+    def scan(path):
+        if not path.endswith('.com'):
+            waited.append(quarantined.wait(5))
+        return scan_file(path)
+
+    monkeypatch.setattr(scanner.engine, '_scan', scan)
+
+    device_info = directory_device_info(str(root))
+    scanner.scan_device(str(root), device_info, ScanJob(device_info['path'], str(root), device_info))
+    assert waited == [True, True, True]
+    assert not (root / 'setup.com').exists()
+    [entry] = scanner.quarantine.list()
+    assert (entry['original_path'], entry['detection']) == (str(root / 'setup.com'), 'Eicar-Test-Signature')
+
+
+def test_job_priority_restored_afterwards(scanner, tmp_path, monkeypatch):
+    seen = {}
+
+    def scan_device(mount_point, device_info, job=None):
+        tid = threading.get_native_id()
+        seen['during'] = os.getpriority(os.PRIO_PROCESS, tid), usb_scanner.ioprio(tid)
+
+    def worker():
+        tid = threading.get_native_id()
+        seen['before'] = os.getpriority(os.PRIO_PROCESS, tid), usb_scanner.ioprio(tid)
+        scanner._run_job(job)
+        seen['after'] = os.getpriority(os.PRIO_PROCESS, tid), usb_scanner.ioprio(tid)
+
+    monkeypatch.setattr(scanner, 'scan_device', scan_device)
+    scanner.config.update(scan_nice=19, scan_ionice='idle')
+    job = ScanJob(str(tmp_path), str(tmp_path), directory_device_info(str(tmp_path)))
+    thread = threading.Thread(target=worker)
+    thread.start()
+    thread.join(5)
+    assert job.priority == {'nice': 19, 'ionice': 'idle'}
+    assert seen['during'] == (19, 3 << usb_scanner.IOPRIO_CLASS_SHIFT)
+    # The worker only gets its nice value back with CAP_SYS_NICE
+    assert seen['after'][1] == seen['before'][1]
+    if os.geteuid() == 0:
+        assert seen['after'] == seen['before']
@@ -0,0 +1,56 @@
+"""ScanScheduler: failures and shutdown"""
+
+import threading
+
+from usbscanner.scheduler import ScanJob, ScanScheduler
+
+
+def test_crashing_job_is_logged():
+    logged = []
+
+    def run_job(job):
+        raise RuntimeError('engine fell over')
+
+    scheduler = ScanScheduler(run_job, max_concurrent=1, log=lambda message, level: logged.append((level, message)))
+    scheduler.start()
+    job = ScanJob('/dev/sdb1', '/media/stick', {})
+    assert scheduler.submit(job)
+    assert job.finished.wait(5)
+    assert job.state == 'failed'
+    assert job.error == 'RuntimeError: engine fell over'
+    assert job.as_dict()['error'] == job.error
+    [(level, message)] = logged
+    assert level == 'ERROR'
+    assert '/dev/sdb1' in message and 'Traceback' in message
+    scheduler.stop()
+
+
+def test_stop_reaches_every_worker_with_a_full_queue():
+    release = threading.Event()
+    started = threading.Semaphore(0)
+
+    def run_job(job):
+        started.release()
+        release.wait(5)
+
+    scheduler = ScanScheduler(run_job, max_concurrent=3, max_queued=2)
+    scheduler.start()
+    jobs = [ScanJob(f"/dev/sd{letter}1", f"/media/{letter}", {}) for letter in 'bcdef']
+    for job in jobs[:3]:
+        assert scheduler.submit(job)
+        assert started.acquire(timeout=5)
+    # All workers busy and the queue full
+    assert scheduler.submit(jobs[3]) and scheduler.submit(jobs[4])
+    assert not scheduler.submit(ScanJob('/dev/sdg1', '/media/g', {}))
+
+    stopper = threading.Thread(target=scheduler.stop)
+    stopper.start()
+    release.set()
+    stopper.join(5)
+    assert not stopper.is_alive()
+    for worker in scheduler.workers:
+        worker.join(5)
+        assert not worker.is_alive()
+    assert [job.state for job in jobs[3:]] == ['cancelled', 'cancelled']
+    assert all(job.finished.is_set() for job in jobs)
+    assert not scheduler.jobs
@@ -0,0 +1,94 @@
+"""ShardedScan: fan-out over engine workers, prefilter, throttle, cancellation and errors"""
+
+import threading
+import time
+
+import pytest
+
+from usbscanner.engine import ScanEngine, ScanResult, ShardedScan
+from usbscanner.scheduler import EngineSlots
+
+PATHS = [f"/media/stick/file{n:03}.txt" for n in range(200)]
+
+
+class RecordingEngine(ScanEngine):
+    """Answers OK for every path and records which thread scanned it"""
+
+    capacity = 4
+
+    def __init__(self, delay=0.001, fail_on=None):
+        self.delay = delay
+        self.fail_on = fail_on
+        self.scanned = []
+        self.threads = set()
+        self.lock = threading.Lock()
+
+    def scan_files(self, paths):
+        for path in paths:
+            if path == self.fail_on:
+                raise RuntimeError('engine fell over')
+            time.sleep(self.delay)
+            with self.lock:
+                self.scanned.append(path)
+                self.threads.add(threading.current_thread().name)
+            yield ScanResult(path, 'OK', None)
+
+
+def sharded(engine, **options):
+    return ShardedScan(engine, EngineSlots(engine.capacity), 'job', **options)
+
+
+def test_every_path_scanned_once_across_workers():
+    engine = RecordingEngine()
+    scan = sharded(engine, workers=4, batch_size=8)
+    results = list(scan.run(iter(PATHS)))
+    assert sorted(result.path for result in results) == PATHS
+    assert sorted(engine.scanned) == PATHS
+    assert len(engine.threads) > 1
+    assert scan.batches_dispatched == 25
+
+
+def test_prefilter_answers_skip_the_engine():
+    engine = RecordingEngine(delay=0)
+    seen = []
+
+    def prefilter(batch):
+        seen.append(len(batch))
+        return {path: ScanResult(path, 'FOUND', 'Cached') for path in batch if path.endswith('0.txt')}
+
+    results = {r.path: r for r in sharded(engine, workers=2, batch_size=10, prefilter=prefilter).run(PATHS)}
+    assert len(results) == 200 and sum(seen) == 200 and max(seen) == 10
+    assert results[PATHS[10]] == ScanResult(PATHS[10], 'FOUND', 'Cached')
+    assert len(engine.scanned) == 180 and PATHS[10] not in engine.scanned
+
+
+def test_throttle_runs_before_every_read():
+    engine = RecordingEngine(delay=0)
+    throttled = []
+
+    def throttle(path):
+        assert path not in engine.scanned
+        throttled.append(path)
+
+    list(sharded(engine, workers=3, batch_size=7, throttle=throttle).run(PATHS))
+    assert sorted(throttled) == PATHS
+
+
+def test_cancel_stops_claiming_batches():
+    engine = RecordingEngine(delay=0.005)
+    cancel = threading.Event()
+    scan = sharded(engine, workers=2, batch_size=5, cancel_event=cancel)
+    results = scan.run(PATHS)
+    for _ in range(10):
+        next(results)
+    cancel.set()
+    remaining = list(results)
+    # Workers finish the batch in hand at most, never claim another
+    assert 10 + len(remaining) < 30
+    assert len(engine.scanned) < 30
+
+
+def test_engine_error_is_raised():
+    engine = RecordingEngine(delay=0, fail_on=PATHS[50])
+    with pytest.raises(RuntimeError, match='engine fell over'):
+        list(sharded(engine, workers=2, batch_size=10).run(PATHS))
@@ -0,0 +1,103 @@
+"""BlockTopology against a fake sysfs tree and udev database"""
+
+import os
+
+import pytest
+
+from tests.fakes import FakeDevice
+from usbscanner.devices import BlockTopology
+from usbscanner.mounts import MountWatcher
+
+USB_PORT = 'devices/pci0000:00/0000:00:14.0/usb2/2-1'
+USB_DISK = f'{USB_PORT}/2-1:1.0/host6/target6:0:0/6:0:0:0'
+SATA_DISK = 'devices/pci0000:00/0000:00:17.0/ata1/host0/target0:0:0/0:0:0:0'
+
+
+def write(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+
+
+def add_disk(sys_root, device_dir, name, dev, removable, rotational, partitions=()):
+    """A disk (and its partitions) the way sysfs lays them out, with /sys/block and /sys/class/block links"""
+    disk = sys_root / device_dir / 'block' / name
+    write(disk / 'dev', f"{dev}\n")
+    write(disk / 'removable', f"{int(removable)}\n")
+    write(disk / 'queue' / 'rotational', f"{int(rotational)}\n")
+    write(disk / 'queue' / 'read_ahead_kb', "128\n")
+    os.symlink('../..', disk / 'device')
+    for link in (sys_root / 'block' / name, sys_root / 'class' / 'block' / name):
+        link.parent.mkdir(parents=True, exist_ok=True)
+        os.symlink(disk, link)
+    major, minor = dev.split(':')
+    for number in partitions:
+        partition = disk / f"{name}{number}"
+        write(partition / 'dev', f"{major}:{int(minor) + number}\n")
+        write(partition / 'partition', f"{number}\n")
+        os.symlink(partition, sys_root / 'class' / 'block' / f"{name}{number}")
+
+
+def add_udev(udev_db, dev, **properties):
+    write(udev_db / f"b{dev}", ''.join(f"E:{key}={value}\n" for key, value in properties.items()))
+
+
+@pytest.fixture
+def topology(tmp_path):
+    sys_root, udev_db = tmp_path / 'sys', tmp_path / 'udev'
+    add_disk(sys_root, USB_DISK, 'sdb', '8:16', removable=True, rotational=False, partitions=(1, 2))
+    write(sys_root / USB_PORT / 'busnum', "2\n")
+    write(sys_root / USB_PORT / 'speed', "5000\n")
+    add_disk(sys_root, SATA_DISK, 'sda', '8:0', removable=False, rotational=True, partitions=(1,))
+    add_udev(udev_db, '8:17', ID_FS_TYPE='vfat', ID_FS_LABEL='STICK', ID_FS_UUID='1234-ABCD',
+             ID_SERIAL='Acme_Stick_0001', ID_VENDOR='Acme', ID_MODEL='Stick')
+    add_udev(udev_db, '8:18', ID_FS_TYPE='swap')
+    add_udev(udev_db, '8:1', ID_FS_TYPE='ext4', ID_BUS='ata')
+    mountinfo = tmp_path / 'mountinfo'
+    mountinfo.write_text("40 22 8:17 / /media/STICK rw - vfat /dev/sdb1 rw\n")
+    topology = BlockTopology(sys_root, udev_db, MountWatcher(str(mountinfo)))
+    topology.refresh()
+    return topology
+
+
+def test_enumeration(topology):
+    assert set(topology.devices) == {'sda', 'sda1', 'sdb', 'sdb1', 'sdb2'}
+    stick = topology.get('/dev/sdb1')
+    assert stick['partition'] and stick['disk'] == 'sdb' and stick['dev'] == '8:17'
+    assert stick['transport'] == 'usb' and stick['removable']
+    assert (stick['fs_type'], stick['label'], stick['uuid']) == ('vfat', 'STICK', '1234-ABCD')
+    disk = topology.get('sdb')
+    assert not disk['partition'] and disk['disk'] == 'sdb' and disk['transport'] == 'usb'
+    internal = topology.get('sda1')
+    assert internal['disk'] == 'sda' and internal['transport'] == 'ata' and not internal['removable']
+
+
+def test_partitions_and_usb_filesystems(topology):
+    assert {d['name'] for d in topology.partitions('sdb')} == {'sdb1', 'sdb2'}
+    assert topology.partition_paths('sdb') == {'/dev/sdb1', '/dev/sdb2'}
+    assert topology.partition_paths('sda') == {'/dev/sda1'}
+    assert topology.partition_paths('sdz') is None
+    # sdb2 is swap and sda1 is not on USB
+    assert [d['name'] for d in topology.usb_filesystems()] == ['sdb1']
+    assert topology.mount_point('sdb1') == '/media/STICK'
+    assert topology.mount_point('sdb2') is None
+    info = BlockTopology.device_info(topology.get('sdb1'))
+    assert info['path'] == '/dev/sdb1' and info['serial'] == 'Acme_Stick_0001'
+
+
+def test_io_profile(topology):
+    assert topology.io_profile('/dev/sdb1') == {'disk': 'sdb', 'speed_mbps': 5000.0, 'rotational': False,
+                                                'read_ahead_kb': 128}
+    assert topology.io_profile('sda') == {'disk': 'sda', 'speed_mbps': None, 'rotational': True,
+                                          'read_ahead_kb': 128}
+    assert topology.io_profile('sdq') is None
+    assert topology.set_read_ahead('sdb', 1024)
+    assert topology.io_profile('sdb')['read_ahead_kb'] == 1024
+
+
+def test_udev_events(topology):
+    topology.update(FakeDevice('remove', '/dev/sdb2'))
+    assert topology.get('sdb2') is None
+    # Event properties override the udev database
+    topology.update(FakeDevice('change', '/dev/sdb1', ID_FS_LABEL='RENAMED'))
+    assert topology.get('sdb1')['label'] == 'RENAMED'
+    assert topology.get('sdb1')['fs_type'] == 'vfat'
@@ -0,0 +1,70 @@
+"""Triage: classification and windowed risk ordering"""
+
+import itertools
+
+from usbscanner.ordering import Triage
+
+
+def make(tmp_path, name, data=b'data'):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_classify_by_extension_then_magic(tmp_path):
+    triage = Triage(media_size_cap=100)
+    assert triage.classify(make(tmp_path, 'AUTORUN.INF'), 4) == 'autorun'
+    assert triage.classify(make(tmp_path, 'setup.exe'), 4) == 'executable'
+    assert triage.classify(make(tmp_path, 'report.docm'), 4) == 'office_macro'
+    # A known extension is trusted without opening the file
+    assert triage.classify(make(tmp_path, 'photo.jpg', b'MZ\x90\x00'), 4) == 'media'
+    assert triage.classify(make(tmp_path, 'film.mp4'), 200) == 'large_media'
+    # Unknown or missing extensions are sniffed
+    assert triage.classify(make(tmp_path, 'update', b'MZ\x90\x00'), 4) == 'executable'
+    assert triage.classify(make(tmp_path, 'clip.dat', b'\x00\x00\x00\x18ftypmp42'), 4) == 'media'
+    assert triage.classify(make(tmp_path, 'notes.xyz', b'hello'), 4) == 'other'
+    assert triage.classify(str(tmp_path / 'gone.xyz'), 0) == 'other'
+
+
+def test_order_is_windowed(tmp_path):
+    paths = [make(tmp_path, name) for name in
+             ('a.jpg', 'b.exe', 'c.txt', 'd.pdf', 'e.jpg', 'f.txt', 'g.pdf', 'h.bat')]
+    triage = Triage(window=3)
+    ordered = triage.order(iter(paths))
+    # The executable goes out before its window is full
+    assert next(ordered) == paths[1]
+    # Each window is released highest risk first without waiting for the rest of the walk
+    assert list(itertools.islice(ordered, 3)) == [paths[3], paths[2], paths[0]]
+    assert list(ordered) == [paths[6], paths[5], paths[4], paths[7]]
+    assert triage.counts == {'media': 2, 'other': 2, 'document': 2, 'executable': 1, 'script': 1}
+
+
+def test_walk_is_not_buffered(tmp_path):
+    consumed = []
+
+    def walk():
+        for n in range(10):
+            consumed.append(n)
+            yield make(tmp_path, f"{n}.txt")
+
+    ordered = Triage(window=4).order(walk())
+    assert len(list(itertools.islice(ordered, 4))) == 4
+    assert len(consumed) == 4
+
+
+def test_large_media_spilled_to_the_end(tmp_path):
+    big = make(tmp_path, 'big.mkv', b'x' * 200)
+    small = [make(tmp_path, f"{n}.txt") for n in range(4)]
+    triage = Triage(media_size_cap=100, window=2)
+    assert list(triage.order([big] + small)) == small + [big]
+    assert triage.summary()['deferred'] == [{'path': big, 'size': 200}]
+
+
+def test_large_media_skipped(tmp_path):
+    big = make(tmp_path, 'big.mkv', b'x' * 200)
+    doc = make(tmp_path, 'doc.pdf')
+    triage = Triage(media_size_cap=100, large_media='skip')
+    assert list(triage.order([big, doc])) == [doc]
+    summary = triage.summary()
+    assert (summary['skipped_count'], summary['skipped_bytes']) == (1, 200)
+    assert summary['skipped'] == [{'path': big, 'size': 200}]
@@ -0,0 +1,81 @@
+"""VerdictCache lookups, bulk lookups and merging"""
+
+import sqlite3
+
+from usbscanner.engine import VerdictCache
+
+CLEAN = 'a' * 64
+INFECTED = 'b' * 64
+UNKNOWN = 'c' * 64
+
+
+def test_get_many(tmp_path):
+    cache = VerdictCache(tmp_path / 'verdicts.db')
+    cache.put(CLEAN, 'v1', 'OK')
+    cache.put(INFECTED, 'v1', 'FOUND', 'Eicar-Test-Signature')
+    cache.flush()
+    assert cache.get_many([CLEAN, INFECTED, UNKNOWN], 'v1') == {
+        CLEAN: ('OK', None), INFECTED: ('FOUND', 'Eicar-Test-Signature')}
+    assert cache.get_many([CLEAN], 'v2') == {}
+    assert cache.get_many([], 'v1') == {}
+    assert (cache.hits, cache.misses) == (2, 2)
+    cache.close()
+
+
+def test_get_many_in_chunks(tmp_path):
+    cache = VerdictCache(tmp_path / 'verdicts.db')
+    digests = [f"{i:064x}" for i in range(1200)]
+    for digest in digests:
+        cache.put(digest, 'v1', 'OK')
+    cache.flush()
+    assert len(cache.get_many(digests, 'v1')) == 1200
+    cache.close()
+
+
+def test_get_many_refreshes_last_used(tmp_path):
+    cache = VerdictCache(tmp_path / 'verdicts.db', max_entries=1)
+    cache.put(CLEAN, 'v1', 'OK')
+    cache.flush()
+    cache.put(INFECTED, 'v1', 'FOUND', 'Eicar-Test-Signature')
+    cache.flush()
+    cache.get_many([CLEAN], 'v1')
+    assert cache.evict() == 1
+    assert cache.get(CLEAN, 'v1') == ('OK', None)
+    assert cache.get(INFECTED, 'v1') is None
+    cache.close()
+
+
+def test_merge_keeps_detections(tmp_path):
+    cache = VerdictCache(tmp_path / 'verdicts.db')
+    assert cache.merge([(INFECTED, 'v1', 'FOUND', 'Eicar-Test-Signature'), (CLEAN, 'v1', 'OK', None)]) == 2
+    assert cache.merge([(INFECTED, 'v1', 'OK', None)]) == 0
+    assert cache.merge([(CLEAN, 'v1', 'FOUND', 'Win.Test')]) == 1
+    assert cache.get_many([CLEAN, INFECTED], 'v1') == {
+        CLEAN: ('FOUND', 'Win.Test'), INFECTED: ('FOUND', 'Eicar-Test-Signature')}
+    cache.close()
+
+
+def test_sizes(tmp_path):
+    cache = VerdictCache(tmp_path / 'verdicts.db')
+    cache.put(CLEAN, 'v1', 'OK', size=10)
+    cache.put(INFECTED, 'v2', 'FOUND', 'Eicar-Test-Signature', size=68)
+    cache.merge([(UNKNOWN, 'v1', 'OK', None)])
+    assert cache.sizes('v1') == {10}
+    assert cache.sizes('v2') == {68}
+    cache.close()
+
+
+def test_cache_without_sizes_is_upgraded(tmp_path):
+    path = tmp_path / 'verdicts.db'
+    db = sqlite3.connect(str(path))
+    db.execute("""CREATE TABLE verdicts (sha256 TEXT NOT NULL, db_version TEXT NOT NULL, status TEXT NOT NULL,
+                                         detection TEXT, last_used REAL NOT NULL, PRIMARY KEY (sha256, db_version))""")
+    db.execute("INSERT INTO verdicts VALUES (?, 'v1', 'OK', NULL, 0)", (CLEAN,))
+    db.commit()
+    db.close()
+    cache = VerdictCache(path)
+    cache.put(INFECTED, 'v1', 'FOUND', 'Eicar-Test-Signature', size=68)
+    assert cache.sizes('v1') == {68}
+    assert cache.get_many([CLEAN, INFECTED], 'v1') == {
+        CLEAN: ('OK', None), INFECTED: ('FOUND', 'Eicar-Test-Signature')}
+    cache.close()
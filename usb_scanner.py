@@ -2,277 +2,723 @@
 """
 Simplified USB Virus Scanner v2.1
 Streamlined Python application for automatically scanning USB drives using ClamAV
+
+The GUI, scan engines, quarantine, reporting, device tracking, scheduling
+and the control socket live in the `usbscanner` package next to this file
+and are imported on first use, so `--status`, the subcommands and headless
+starts only load what they need.
 """
 
 import os
 import threading
 import time
+import importlib
+import importlib.util
 import sys
 import subprocess
-import logging
 import json
 import signal
+import socket
+import shutil
+import errno
+import ctypes
+import platform
+from collections import deque
+from contextlib import closing
 from datetime import datetime
 from pathlib import Path
 
-try:
-    import psutil
-except ImportError:
-    psutil = None
-    print("Warning: psutil not available. Some features may be limited.")
+_IMPORTED = time.perf_counter()    # end of module imports, for --profile-startup
 
-try:
-    from pyudev import Context, Monitor, MonitorObserver
-except ImportError:
-    print("Error: pyudev not installed. Run: sudo apt install python3-pyudev")
-    sys.exit(1)
 
-try:
-    import tkinter as tk
-    from tkinter import ttk, scrolledtext, messagebox
-    GUI_AVAILABLE = True
-except ImportError:
-    GUI_AVAILABLE = False
+DATA_DIR = Path.home() / '.local' / 'share' / 'usb-scanner'
 
-import queue
+DEPENDENCY_CACHE_TTL = 24 * 3600    # seconds a successful sudo check is trusted
 
+DEFAULT_CONFIG = {
+    'engine': 'auto',                          # auto, clamd or clamscan
+    'clamd_socket': '/var/run/clamav/clamd.ctl',
+    'clamd_pool_size': 4,
+    'clamd_timeout': 120,
+    'clamd_multiscan': False,                  # hand whole trees to clamd (detections only)
+    'clamscan_processes': 2,                   # concurrent clamscan runs (~1 GB RAM each)
+    'max_concurrent_scans': 2,
+    'max_queued_scans': 32,
+    'scan_mode': 'sharded',                    # sharded or tree (one recursive engine call)
+    'scan_workers': min(8, os.cpu_count() or 1),
+    'batch_size': 64,                          # files handed to a worker at a time
+    'incremental_scans': True,                 # only rescan files changed since the last scan
+    'manifest_max_churn': 0.5,                 # above this fraction of changed files, scan in full
+    'resume_window': 24 * 3600,                # seconds an interrupted scan can be resumed (0: always restart)
+    'verdict_cache': True,                     # skip files already known clean
+    'verdict_cache_size': 500000,              # entries kept (least recently used evicted)
+    'verdict_exchange': None,                  # URL of a verdict exchange shared with other stations
+    'verdict_exchange_token': None,            # bearer token the exchange expects
+    'verdict_exchange_timeout': 2.0,           # seconds per exchange request
+    'verdict_exchange_retry': 60,              # seconds to rely on the local cache after the exchange fails
+    'adaptive_io': True,                       # match workers and read-ahead to the device's bus and media
+    'scan_nice': 10,                           # CPU niceness of scan threads (None to leave alone)
+    'scan_ionice': 'best-effort',              # I/O class of scan threads: best-effort (lowest level), idle or None
+    'bandwidth_limit': None,                   # MB/s read from each device (None for no cap)
+    'triage': True,                            # scan high-risk file types first
+    'physical_order': 'auto',                  # sort work by on-disk location: auto (rotational/USB 2.0), always, never
+    'triage_media_size_cap': 256 * 1024 * 1024,
+    'triage_large_media': 'defer',             # defer (scan last) or skip media above the cap
+    'event_debounce': 0.5,                     # seconds to wait for more partitions when sysfs can't tell
+    'report_files': True,                      # also write each report as JSON to the device root
+    'definitions_mirror': None,                # local CVD/CDIFF directory instead of freshclam
+    'definitions_store': None,                 # mirror mode: database dirs (default DATA_DIR/signatures)
+    'clamav_database_dir': '/var/lib/clamav',  # where freshclam keeps the databases
+    'definitions_interval': 4 * 3600,          # seconds between update checks
+    'definitions_idle_grace': 30,              # only update after this long without scans
+    'definitions_verify': True,                # test-load mirror databases before switching
+    'quarantine_compression': 'lzma',          # lzma (smaller) or zlib (faster)
+    'progress_interval': 0.5,                  # seconds between GUI progress updates
+    'progress_log_interval': 10,               # seconds between progress log lines
+    'metrics_port': None,                      # serve Prometheus metrics on 127.0.0.1:<port>
+    'metrics_textfile': None,                  # or write them for node-exporter's textfile collector
+    'control_socket': None,                    # control API socket (default DATA_DIR/control.sock)
+    'log_file': None,                          # default /var/log/usb_scanner.log, or DATA_DIR if not writable
+    'log_json': True,                          # also write JSON lines (usb_scanner.jsonl)
+    'log_max_bytes': 10 * 1024 * 1024,         # rotate log files at this size
+    'log_backups': 3,                          # rotated files kept
+    'log_queue_size': 10000,                   # queued records before INFO messages are dropped
+}
 
-class SimpleGUI:
-    """Simplified GUI with essential features only"""
-    
-    def __init__(self, minimize=False):
-        if not GUI_AVAILABLE:
-            raise RuntimeError("GUI not available - tkinter not installed")
-            
-        self.root = tk.Tk()
-        self.root.title("USB Virus Scanner v2.1")
-        self.root.geometry("800x600")
-        self.root.configure(bg='#1a1a1a')
-        
-        if minimize:
-            self.root.withdraw()
-            self.minimized = True
-        else:
-            self.minimized = False
-            
-        self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
-        self.message_queue = queue.Queue()
-        
-        self._setup_gui()
-        self._process_queue()
-        
-    def _setup_gui(self):
-        """Setup simplified GUI"""
-        # Main container
-        main_frame = tk.Frame(self.root, bg='#1a1a1a', padx=15, pady=15)
-        main_frame.pack(fill=tk.BOTH, expand=True)
-        
-        # Title
-        title = tk.Label(main_frame, text="🛡️ USB Virus Scanner v2.1", 
-                        font=('Arial', 18, 'bold'), fg='#00ff88', bg='#1a1a1a')
-        title.pack(pady=(0, 20))
-        
-        # Status frame
-        status_frame = tk.LabelFrame(main_frame, text="Status", bg='#2d2d2d', 
-                                   fg='#ffffff', font=('Arial', 12, 'bold'))
-        status_frame.pack(fill=tk.X, pady=(0, 15))
-        
-        status_inner = tk.Frame(status_frame, bg='#2d2d2d', padx=10, pady=10)
-        status_inner.pack(fill=tk.X)
-        
-        self.status_indicator = tk.Label(status_inner, text="●", font=('Arial', 16), 
-                                       fg='#3498db', bg='#2d2d2d')
-        self.status_indicator.pack(side=tk.LEFT, padx=(0, 10))
-        
-        self.status_label = tk.Label(status_inner, text="Initializing...", 
-                                   font=('Arial', 11), fg='#ffffff', bg='#2d2d2d')
-        self.status_label.pack(side=tk.LEFT, fill=tk.X, expand=True)
-        
-        self.progress = ttk.Progressbar(status_inner, mode='indeterminate', length=150)
-        self.progress.pack(side=tk.RIGHT)
-        
-        # Device info
-        self.device_info = tk.Label(main_frame, text="No USB device detected", 
-                                  font=('Arial', 10), fg='#cccccc', bg='#1a1a1a',
-                                  justify=tk.LEFT, anchor=tk.W)
-        self.device_info.pack(fill=tk.X, pady=(0, 15))
-        
-        # Log
-        log_frame = tk.LabelFrame(main_frame, text="Activity Log", bg='#2d2d2d', 
-                                fg='#ffffff', font=('Arial', 12, 'bold'))
-        log_frame.pack(fill=tk.BOTH, expand=True, pady=(0, 15))
-        
-        self.log_text = scrolledtext.ScrolledText(
-            log_frame, height=15, bg='#0a0a0a', fg='#00ff88', 
-            font=('Consolas', 9), wrap=tk.WORD)
-        self.log_text.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
-        
-        # Configure log colors
-        self.log_text.tag_configure('INFO', foreground='#00ff88')
-        self.log_text.tag_configure('WARNING', foreground='#ffaa00')
-        self.log_text.tag_configure('ERROR', foreground='#ff4444')
-        self.log_text.tag_configure('SUCCESS', foreground='#00ffff')
-        
-        # Buttons
-        button_frame = tk.Frame(main_frame, bg='#1a1a1a')
-        button_frame.pack(fill=tk.X)
-        
-        tk.Button(button_frame, text="Clear Log", command=self._clear_log, 
-                 bg='#e74c3c', fg='white', relief=tk.FLAT, padx=15).pack(side=tk.LEFT)
-        
-        tk.Button(button_frame, text="Minimize", command=self.minimize, 
-                 bg='#3498db', fg='white', relief=tk.FLAT, padx=15).pack(side=tk.LEFT, padx=(10, 0))
-        
-        tk.Button(button_frame, text="Exit", command=self.exit_app, 
-                 bg='#c0392b', fg='white', relief=tk.FLAT, padx=15).pack(side=tk.RIGHT)
-    
-    def _process_queue(self):
-        """Process message queue"""
+
+# Subsystems
+
+class LazyModule:
+    """Stand-in for a module that is imported on first attribute access.
+
+    Import times are kept for --profile-startup.
+    """
+
+    loaded = {}     # module name -> seconds spent importing it
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            started = time.perf_counter()
+            self._module = importlib.import_module(self._name)
+            LazyModule.loaded[self._name] = time.perf_counter() - started
+        value = getattr(self._module, attr)
+        setattr(self, attr, value)      # later lookups skip __getattr__
+        return value
+
+
+_gui = LazyModule('usbscanner.gui')
+_engine = LazyModule('usbscanner.engine')
+_quarantine = LazyModule('usbscanner.quarantine')
+_reporting = LazyModule('usbscanner.reporting')
+_images = LazyModule('usbscanner.images')
+_logwriter = LazyModule('usbscanner.logwriter')
+_exchange = LazyModule('usbscanner.exchange')
+_mounts = LazyModule('usbscanner.mounts')
+_devices = LazyModule('usbscanner.devices')
+_ordering = LazyModule('usbscanner.ordering')
+_scheduler = LazyModule('usbscanner.scheduler')
+_control = LazyModule('usbscanner.control')
+_client = LazyModule('usbscanner.client')
+_pyudev = LazyModule('pyudev')
+asyncio = LazyModule('asyncio')     # only the daemon needs an event loop
+
+
+def definitions_manager(config):
+    """DefinitionsManager for a scanner configuration"""
+    return _engine.DefinitionsManager(store=config['definitions_store'] or DATA_DIR / 'signatures',
+                                      state_path=DATA_DIR / 'definitions.json',
+                                      mirror=config['definitions_mirror'],
+                                      database_dir=config['clamav_database_dir'],
+                                      interval=config['definitions_interval'],
+                                      verify=config['definitions_verify'])
+
+
+def create_engine(config, database=None):
+    """Pick a scan engine: clamd when reachable, clamscan as fallback"""
+    choice = config.get('engine', 'auto')
+    if choice in ('auto', 'clamd'):
+        engine = _engine.ClamdEngine(config['clamd_socket'],
+                                     pool_size=config['clamd_pool_size'],
+                                     timeout=config['clamd_timeout'],
+                                     multiscan=config['clamd_multiscan'])
+        if choice == 'clamd' or engine.available():
+            return engine
+    return _engine.ClamscanEngine(max_processes=config['clamscan_processes'], database=database)
+
+
+def find_processes(script_name, proc_root='/proc'):
+    """PIDs of other processes whose command line mentions script_name"""
+    pids = []
+    for entry in os.listdir(proc_root):
+        if not entry.isdigit() or int(entry) == os.getpid():
+            continue
         try:
-            while True:
-                message, level = self.message_queue.get_nowait()
-                self._log_internal(message, level)
-        except queue.Empty:
+            with open(os.path.join(proc_root, entry, 'cmdline'), 'rb') as f:
+                cmdline = f.read().split(b'\0')
+        except OSError:
+            continue
+        if any(os.path.basename(arg.decode(errors='replace')) == script_name for arg in cmdline):
+            pids.append(entry)
+    return pids
+
+
+# Adaptive I/O
+
+USB_SPEEDS = {1.5: 'USB 1.0', 12: 'USB 1.1', 480: 'USB 2.0', 5000: 'USB 3.0', 10000: 'USB 3.1',
+              20000: 'USB 3.2', 40000: 'USB4'}
+
+IOPRIO_CLASSES = {'best-effort': 2, 'idle': 3}
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_SYSCALLS = {'x86_64': (251, 252), 'aarch64': (30, 31)}     # ioprio_set, ioprio_get
+
+
+def plan_io(profile, max_workers):
+    """Worker count and read-ahead (KB, None to leave alone) suited to a device.
+
+    A spinning disk or a USB 2.0 link is saturated by one sequential reader,
+    and extra workers only add seeks; fast flash on USB 3 keeps scaling.
+    """
+    if not profile:
+        return max_workers, None
+    speed = profile['speed_mbps']
+    if profile['rotational']:
+        return 1, 2048
+    if speed is not None and speed <= 480:
+        return 1, 1024
+    if speed is not None and speed <= 5000:
+        return min(max_workers, 4), 512
+    return max_workers, 512
+
+
+def describe_link(profile):
+    """'USB 2.0 (480 Mb/s), flash' style summary of an io profile"""
+    speed = profile['speed_mbps']
+    if speed is None:
+        link = "unknown link"
+    else:
+        link = f"{USB_SPEEDS.get(speed, 'USB')} ({speed:g} Mb/s)"
+    return f"{link}, {'rotational' if profile['rotational'] else 'flash'}"
+
+
+def ioprio(tid, value=None):
+    """Read, or set to `value`, a thread's I/O priority through the ioprio syscalls.
+
+    Raises OSError where they fail or are not known for this architecture.
+    """
+    numbers = IOPRIO_SYSCALLS.get(platform.machine())
+    if not numbers:
+        raise OSError(errno.ENOSYS, f"ioprio syscalls unknown on {platform.machine()}")
+    libc = ctypes.CDLL(None, use_errno=True)
+    if value is None:
+        result = libc.syscall(numbers[1], IOPRIO_WHO_PROCESS, tid)
+    else:
+        result = libc.syscall(numbers[0], IOPRIO_WHO_PROCESS, tid, value)
+    if result < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return result
+
+
+def lower_thread_priority(nice=None, ionice=None):
+    """Lower the calling thread's CPU and I/O priority.
+
+    Both are per-thread on Linux and inherited by the threads and processes
+    it starts, so scan workers and clamscan runs follow. Returns what was
+    applied and the previous values for `restore_thread_priority`.
+    """
+    applied, previous = {}, {}
+    tid = threading.get_native_id()
+    if nice is not None:
+        try:
+            previous['nice'] = os.getpriority(os.PRIO_PROCESS, tid)
+            value = max(nice, previous['nice'])
+            os.setpriority(os.PRIO_PROCESS, tid, value)
+            applied['nice'] = value
+        except OSError:
             pass
-        finally:
-            self.root.after(100, self._process_queue)
-    
-    def log(self, message, level='INFO'):
-        """Thread-safe logging"""
-        self.message_queue.put((message, level))
-    
-    def _log_internal(self, message, level):
-        """Internal log method"""
-        timestamp = datetime.now().strftime('%H:%M:%S')
-        indicators = {'INFO': '🔵', 'WARNING': '🟡', 'ERROR': '🔴', 'SUCCESS': '🟢'}
-        
-        self.log_text.insert(tk.END, f"[{timestamp}] {indicators.get(level, '🔵')} {message}\n", level)
-        self.log_text.see(tk.END)
-        self.root.update_idletasks()
-    
-    def update_status(self, status, color='#3498db'):
-        """Update status"""
-        self.status_label.config(text=status)
-        self.status_indicator.config(fg=color)
-        self.root.update_idletasks()
-    
-    def update_device_info(self, info):
-        """Update device info"""
-        self.device_info.config(text=info, fg='#2ecc71')
-        self.root.update_idletasks()
-    
-    def start_progress(self):
-        self.progress.start(10)
-    
-    def stop_progress(self):
-        self.progress.stop()
-    
-    def show(self):
-        """Show window"""
-        if self.minimized:
-            self.root.deiconify()
-            self.root.lift()
-            self.minimized = False
-    
-    def minimize(self):
-        """Minimize window"""
-        self.root.withdraw()
-        self.minimized = True
-    
-    def _clear_log(self):
-        """Clear log"""
-        self.log_text.delete(1.0, tk.END)
-        self.log("Log cleared")
-    
-    def on_closing(self):
-        """Handle close"""
-        if messagebox.askokcancel("Quit", "Exit USB Scanner?"):
-            self.exit_app()
-    
-    def exit_app(self):
-        """Exit application"""
-        self.root.quit()
-        self.root.destroy()
+    if ionice in IOPRIO_CLASSES:
+        level = 7 if ionice == 'best-effort' else 0
+        try:
+            previous['ionice'] = ioprio(tid)
+            ioprio(tid, IOPRIO_CLASSES[ionice] << IOPRIO_CLASS_SHIFT | level)
+            applied['ionice'] = ionice
+        except OSError:
+            pass
+    return applied, previous
+
+
+def restore_thread_priority(previous):
+    """Put back what `lower_thread_priority` changed on the calling thread.
+
+    Raising the CPU priority again needs CAP_SYS_NICE; without it the thread
+    keeps the lower value.
+    """
+    tid = threading.get_native_id()
+    try:
+        if 'nice' in previous:
+            os.setpriority(os.PRIO_PROCESS, tid, previous['nice'])
+    except OSError:
+        pass
+    try:
+        if 'ionice' in previous:
+            ioprio(tid, previous['ionice'])
+    except OSError:
+        pass
+
+
+class TokenBucket:
+    """Byte-rate limiter shared by the workers of one scan.
+
+    Consumers may overdraw (a file larger than the burst still goes through)
+    and then sleep off the debt, so the long-run rate holds.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.waited = 0.0
+        self.lock = threading.Lock()
+
+    def consume(self, amount, cancel_event=None):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+            self.waited += wait
+        if wait:
+            (cancel_event or threading.Event()).wait(wait)
+
+
+def read_pressure(resource, root='/proc/pressure'):
+    """Total 'some' stall time in microseconds from PSI (None if unsupported)"""
+    line = _devices.read_sysfs(os.path.join(root, resource), '').split('\n')[0]
+    for field in line.split()[1:]:
+        key, _, value = field.partition('=')
+        if key == 'total':
+            return int(value)
+    return None
+
+
+class ResponsivenessProbe:
+    """Measures how the host copes while scans run.
+
+    A normal-priority thread sleeps in short ticks and records how late it
+    wakes up; together with the kernel's pressure stall counters this shows
+    whether scanning is starving the rest of the system. It only ticks while
+    at least one scan is active.
+    """
+
+    INTERVAL = 0.05
+
+    def __init__(self):
+        self.samples = deque(maxlen=100000)    # (monotonic time, wake-up lag in seconds)
+        self.active = 0
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+
+    def begin(self):
+        """Start measuring for one scan; returns the token for `end`"""
+        with self.lock:
+            if not self.thread:
+                self.thread = threading.Thread(target=self._run, daemon=True, name='responsiveness')
+                self.thread.start()
+            self.active += 1
+        self.wake.set()
+        return time.monotonic(), {r: read_pressure(r) for r in ('cpu', 'io')}
+
+    def end(self, token):
+        """Responsiveness summary for the window since `begin`"""
+        started, pressure = token
+        now = time.monotonic()
+        with self.lock:
+            self.active -= 1
+            if not self.active:
+                self.wake.clear()
+            lags = sorted(lag for at, lag in self.samples if at >= started)
+        summary = {'samples': len(lags)}
+        if lags:
+            summary['wakeup_lag_ms'] = {
+                'p50': round(lags[len(lags) // 2] * 1000, 2),
+                'p99': round(lags[min(len(lags) - 1, int(len(lags) * 0.99))] * 1000, 2),
+                'max': round(lags[-1] * 1000, 2),
+            }
+        elapsed = max(now - started, 1e-6)
+        for resource, before in pressure.items():
+            after = read_pressure(resource)
+            if before is not None and after is not None:
+                summary[f"{resource}_stall_percent"] = round((after - before) / 1e6 / elapsed * 100, 2)
+        return summary
+
+    def _run(self):
+        while True:
+            self.wake.wait()
+            before = time.monotonic()
+            time.sleep(self.INTERVAL)
+            after = time.monotonic()
+            self.samples.append((after, max(0.0, after - before - self.INTERVAL)))
+
+
+# Control socket
+
+def directory_device_info(path):
+    """device_info for a directory scanned on request rather than a udev device"""
+    return {
+        'path': str(path),
+        'fs_type': 'Unknown',
+        'label': os.path.basename(os.path.normpath(path)) or str(path),
+        'vendor': 'Local',
+        'model': 'Directory',
+        'uuid': 'Unknown',
+        'serial': 'Unknown'
+    }
+
+
+# Batch scanning
+
+def image_device_info(image, volume=None):
+    """device_info for one volume of a disk image (volume None: the whole image, scanned raw)"""
+    name = os.path.basename(image)
+    info = {
+        'path': f"{image}#{volume.number}" if volume and volume.number else image,
+        'fs_type': volume.fs_type if volume and volume.fs_type else 'Unknown',
+        'label': volume.label if volume and volume.label else name,
+        'vendor': 'Image',
+        'model': name,
+        'uuid': volume.uuid if volume and volume.uuid else 'Unknown',
+        'serial': 'Unknown',
+        'read_only': True,
+    }
+    if not volume:
+        info['raw_image'] = True
+    return info
+
+
+def batch_summary(rows):
+    """Consolidated table for a batch scan"""
+    lines = [f"{'Target':<40} {'Access':<9} {'Files':>9} {'Size':>10} {'Threats':>7} {'Time':>7}  Result"]
+    for row in rows:
+        target = row['target'] if len(row['target']) <= 40 else '…' + row['target'][-39:]
+        lines.append(f"{target:<40} {row['access']:<9} {row['files']:>9,} "
+                     f"{_engine.format_bytes(row['bytes']):>10} {row['threats']:>7} "
+                     f"{row['seconds']:>6.1f}s  {row['result']}")
+    totals = {key: sum(row[key] for row in rows) for key in ('files', 'bytes', 'threats')}
+    infected = sum(1 for row in rows if row['threats'])
+    failed = sum(1 for row in rows if row['result'] in ('failed', 'cancelled'))
+    lines.append(f"{len(rows)} volumes, {totals['files']:,} files, {_engine.format_bytes(totals['bytes'])}: "
+                 f"{totals['threats']} threats in {infected} volumes, {failed} not scanned completely")
+    return '\n'.join(lines)
+
+
+# Startup profiling
+
+def process_age():
+    """Seconds since this process started (10 ms resolution; None without /proc)"""
+    try:
+        with open('/proc/self/stat') as f:
+            fields = f.read().rpartition(')')[2].split()
+        started = int(fields[19]) / os.sysconf('SC_CLK_TCK')
+        return time.clock_gettime(time.CLOCK_BOOTTIME) - started
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class StartupProfile:
+    """Time spent in each startup phase, from process start until monitoring is live"""
+
+    def __init__(self):
+        age = process_age()
+        self.origin = time.perf_counter() - age if age is not None else _IMPORTED
+        self.marks = [('interpreter and imports', _IMPORTED)]
+
+    def mark(self, phase):
+        """End the current phase, naming it"""
+        self.marks.append((phase, time.perf_counter()))
+
+    def report(self):
+        lines = ["Startup profile (phase, duration, since process start):"]
+        previous = self.origin
+        for phase, at in self.marks:
+            lines.append(f"  {phase:<26} {(at - previous) * 1000:8.1f} ms {(at - self.origin) * 1000:9.1f} ms")
+            previous = at
+        for module, seconds in LazyModule.loaded.items():
+            lines.append(f"  (loaded {module} in {seconds * 1000:.1f} ms)")
+        return "\n".join(lines)
+
+
+def sudo_fingerprint(binary):
+    """Identity of clamscan and the sudo configuration; a change invalidates the cached sudo check"""
+    parts = [os.getuid()]
+    for path in (binary, '/etc/sudoers', '/etc/sudoers.d'):
+        try:
+            st = os.stat(path)
+            parts.append([path, st.st_ino, st.st_mtime_ns])
+        except (OSError, TypeError):
+            parts.append([path, None, None])
+    return parts
+
+
+# Scan progress
+
+class ScanProgress:
+    """Running counters for one scan, fed one ScanResult at a time"""
+
+    def __init__(self, mount_point):
+        self.mount_point = mount_point
+        self.files = 0
+        self.bytes = 0
+        self.threats = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.exchange_hits = 0
+        self.current_path = None
+        self.started = time.time()
+        self.first_verdict = None
+        self.quarantine_seconds = 0.0
+        self.lock = threading.Lock()    # hit counts come from every scan worker
+        self._last_emit = {}
+
+    def update(self, result):
+        if self.first_verdict is None:
+            self.first_verdict = time.time()
+        self.files += 1
+        self.current_path = result.path
+        try:
+            self.bytes += os.lstat(result.path).st_size
+        except OSError:
+            pass
+        if result.status == 'FOUND':
+            self.threats += 1
+        elif result.status == 'ERROR':
+            self.errors += 1
+
+    def count_known(self, cache_hits=0, exchange_hits=0):
+        """Add the files of one batch answered without the engine"""
+        with self.lock:
+            self.cache_hits += cache_hits
+            self.exchange_hits += exchange_hits
+
+    def due(self, channel, interval):
+        """True at most once per `interval` seconds for each output channel"""
+        now = time.time()
+        if now - self._last_emit.get(channel, 0) >= interval:
+            self._last_emit[channel] = now
+            return True
+        return False
+
+    def summary(self):
+        return f"{self.files:,} files, {_engine.format_bytes(self.bytes)}"
+
+    def as_dict(self):
+        return {
+            'mount_point': self.mount_point,
+            'files_scanned': self.files,
+            'bytes_scanned': self.bytes,
+            'threats': self.threats,
+            'errors': self.errors,
+            'cache_hits': self.cache_hits,
+            'exchange_hits': self.exchange_hits,
+            'current_path': self.current_path,
+            'elapsed': round(time.time() - self.started, 2),
+        }
 
 
 class USBScanner:
     """Simplified USB virus scanner"""
     
-    def __init__(self, headless=False, minimize=False):
+    def __init__(self, headless=False, minimize=False, config=None, startup=None):
         self.headless = headless
-        self.gui = None if headless else SimpleGUI(minimize) if GUI_AVAILABLE else None
-        self.scanning = False
+        self.config = dict(DEFAULT_CONFIG, **(config or {}))
+        self.startup = startup
+        self.gui = None if headless else _gui.SimpleGUI(minimize) if _gui.GUI_AVAILABLE else None
+        if self.gui:
+            self._mark('gui')
         self.running = True
+        self.engine = None
+        self.engine_slots = None
+        self.signature_version = None
+        self.verdict_cache = None
+        self.verdict_exchange = None
+        self._exchange_error = None
+        self.manifests = _engine.ManifestStore(DATA_DIR / 'manifests')
+        self.mount_watcher = None
+        self.topology = None
+        self.quarantine = None
+        self.history = None
+        self.definitions = definitions_manager(self.config)
+        self.metrics = _reporting.Metrics()
+        self.metrics_server = None
+        self.control = None
+        self.started_at = time.time()
+        self.responsiveness = ResponsivenessProbe()
+        self.scheduler = _scheduler.ScanScheduler(self._run_job,
+                                                  max_concurrent=self.config['max_concurrent_scans'],
+                                                  max_queued=self.config['max_queued_scans'], log=self.log)
         
         # Setup logging
         self._setup_logging()
+        self._setup_metrics()
+        self._mark('logging and metrics')
+        
+        try:
+            self.quarantine = _quarantine.QuarantineStore(DATA_DIR / 'quarantine',
+                                                          self.config['quarantine_compression'])
+        except Exception as e:
+            self.log(f"⚠ Quarantine store unavailable: {e}", 'ERROR')
+        if self.quarantine:
+            try:
+                imported, skipped = self.quarantine.import_legacy()
+            except Exception as e:
+                self.log(f"⚠ Importing legacy quarantine files failed: {e}", 'WARNING')
+            else:
+                if imported:
+                    self.log(f"Moved {imported} legacy quarantine files into the quarantine store")
+                if skipped:
+                    self.log(f"⚠ {skipped} legacy quarantine files could not be read, left in place", 'WARNING')
         
-        # Setup USB monitoring
-        self.context = Context()
-        self.monitor = Monitor.from_netlink(self.context)
-        self.monitor.filter_by(subsystem='block', device_type='partition')
-        self.observer = None
+        if self.config['verdict_cache']:
+            try:
+                self.verdict_cache = _engine.VerdictCache(DATA_DIR / 'verdicts.db',
+                                                          max_entries=self.config['verdict_cache_size'])
+            except Exception as e:
+                self.log(f"⚠ Verdict cache unavailable: {e}", 'WARNING')
+        if self.config['verdict_exchange']:
+            self.verdict_exchange = _exchange.VerdictExchange(self.config['verdict_exchange'],
+                                                              token=self.config['verdict_exchange_token'],
+                                                              timeout=self.config['verdict_exchange_timeout'],
+                                                              retry_after=self.config['verdict_exchange_retry'])
+            self.log(f"🔗 Sharing verdicts through {self.config['verdict_exchange']}")
+        
+        try:
+            self.history = _reporting.ScanHistory(DATA_DIR / 'history.db')
+        except Exception as e:
+            self.log(f"⚠ Scan history unavailable: {e}", 'WARNING')
+        self._mark('stores')
+        
+        # Event loop state (see _main); the netlink socket is opened there
+        self.context = None
+        self.monitor = None
+        self.loop = None
+        self._stopping = None
+        self._core_result = False
+        self.intake = _devices.DeviceIntake(self.config['event_debounce'])
+        self.device_tasks = {}      # disk path -> task mounting and scanning its partitions
+        self.mount_waits = {}       # partition path -> task waiting for it to mount
+        self._dispatch_timer = None
         
         # Signal handlers
         signal.signal(signal.SIGTERM, self._shutdown)
         signal.signal(signal.SIGINT, self._shutdown)
     
+    def _mark(self, phase):
+        if self.startup:
+            self.startup.mark(phase)
+    
     def _setup_logging(self):
-        """Setup logging"""
-        log_dir = Path('/var/log')
-        if not log_dir.exists() or not os.access(log_dir, os.W_OK):
-            log_dir = Path.home() / '.local' / 'share' / 'usb-scanner'
-            log_dir.mkdir(parents=True, exist_ok=True)
-        
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler(log_dir / 'usb_scanner.log'),
-                logging.StreamHandler() if self.headless else logging.NullHandler()
-            ]
-        )
-        self.logger = logging.getLogger(__name__)
+        """Start the background log writer (text log, JSON lines next to it, console when headless)"""
+        log_file = self.config['log_file']
+        if not log_file:
+            log_dir = Path('/var/log')
+            if not log_dir.exists() or not os.access(log_dir, os.W_OK):
+                log_dir = DATA_DIR
+            log_file = log_dir / 'usb_scanner.log'
+        log_file = Path(log_file)
+        self.log_writer = _logwriter.LogWriter(
+            log_file,
+            json_path=log_file.with_suffix('.jsonl') if self.config['log_json'] else None,
+            console=not self.gui,
+            max_bytes=self.config['log_max_bytes'],
+            backups=self.config['log_backups'],
+            capacity=self.config['log_queue_size'])
+    
+    def _setup_metrics(self):
+        """Declare the metrics this scanner exports"""
+        m = self.metrics
+        m.describe('scan_phase_seconds', 'histogram',
+                   'Time spent in each phase of a device scan (detect_to_mount, queue_wait, '
+                   'first_verdict, scan, total)')
+        m.describe('scans_total', 'counter', 'Completed device scans by result')
+        m.describe('files_scanned_total', 'counter', 'Files scanned')
+        m.describe('bytes_scanned_total', 'counter', 'Bytes scanned')
+        m.describe('threats_total', 'counter', 'Threats found')
+        m.describe('cache_hits_total', 'counter', 'Files answered from the verdict cache')
+        m.describe('exchange_hits_total', 'counter', 'Files answered by the verdict exchange')
+        m.describe('scan_files_per_second', 'gauge', 'Files per second in the last scan of a device')
+        m.describe('scan_bytes_per_second', 'gauge', 'Bytes per second in the last scan of a device')
+        m.describe('quarantine_seconds', 'histogram', 'Time to quarantine one file')
+        m.describe('definitions_update_seconds', 'histogram', 'Duration of signature updates')
+        m.describe('definitions_updates_total', 'counter', 'Signature updates by result')
+        m.describe('definitions_version', 'gauge', 'Active signature database version')
+        m.describe('scans_running', 'gauge', 'Device scans in progress')
+        m.describe('scans_queued', 'gauge', 'Device scans waiting for a worker')
+        m.describe('engine_slots_in_use', 'gauge', 'Engine workers busy')
+        m.describe('engine_slots_waiting', 'gauge', 'Scan workers waiting for an engine slot')
+        m.collect_with(self._collect_metrics)
+    
+    def _collect_metrics(self, metrics):
+        metrics.set('scans_running', len(self.scheduler.running()))
+        metrics.set('scans_queued', len(self.scheduler.pending()))
+        for database, version in self.definitions.versions().items():
+            metrics.set('definitions_version', version, database=database)
+        if self.engine_slots:
+            in_use, waiting = self.engine_slots.usage()
+            metrics.set('engine_slots_in_use', in_use)
+            metrics.set('engine_slots_waiting', waiting)
+    
+    def _publish_metrics(self):
+        """Refresh the node-exporter textfile, if configured"""
+        if not self.config['metrics_textfile']:
+            return
+        try:
+            self.metrics.write_textfile(self.config['metrics_textfile'])
+        except OSError as e:
+            self.log(f"⚠ Could not write metrics file: {e}", 'WARNING')
     
     def _shutdown(self, signum, frame):
         """Handle shutdown"""
-        self.log("Shutting down...")
-        self.running = False
-        if self.observer:
-            self.observer.stop()
-        sys.exit(0)
+        if not self.loop:
+            sys.exit(0)
+        # Let the event loop cancel scans and close everything in order
+        self.request_stop()
+        if self.gui:
+            self.gui.after(0, self.gui.exit_app)
     
     def log(self, message, level='INFO'):
-        """Log message"""
+        """Log message (only queued here; the log writer and the GUI do the I/O)"""
         if self.gui:
             self.gui.log(message, level)
-        else:
-            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            print(f"[{timestamp}] {level}: {message}")
-        
-        # Log to file
-        if level == 'ERROR':
-            self.logger.error(message)
-        elif level == 'WARNING':
-            self.logger.warning(message)
-        else:
-            self.logger.info(message)
+        self.log_writer.write(level, message)
     
-    def check_dependencies(self):
-        """Check required dependencies"""
+    def check_dependencies(self, monitoring=True):
+        """Check required dependencies (pyudev only when monitoring devices)"""
         missing = []
+        if monitoring and importlib.util.find_spec('pyudev') is None:
+            missing.append("pyudev (install: sudo apt install python3-pyudev)")
+        self.engine = create_engine(self.config,
+                                    database=self.definitions.active_dir if self.definitions.mirror else None)
         
-        # Check ClamAV
-        if subprocess.run(['which', 'clamscan'], capture_output=True).returncode != 0:
-            missing.append("clamscan (install: sudo apt install clamav)")
-        
-        # Check sudo permissions
-        try:
-            if subprocess.run(['sudo', '-n', 'clamscan', '--version'], 
-                            capture_output=True, timeout=5).returncode != 0:
+        if self.engine.name == 'clamd':
+            # Check clamd socket
+            if not self.engine.available():
+                missing.append(f"clamd at {self.config['clamd_socket']} (install: sudo apt install clamav-daemon)")
+        else:
+            # Check ClamAV
+            binary = shutil.which('clamscan')
+            if binary is None:
+                missing.append("clamscan (install: sudo apt install clamav)")
+            
+            # Check sudo permissions
+            elif not self._sudo_allowed(binary):
                 missing.append("sudo permissions (run setup.sh)")
-        except:
-            missing.append("sudo permissions (run setup.sh)")
         
         if missing:
             self.log("Missing dependencies:", 'ERROR')
@@ -280,32 +726,109 @@ class USBScanner:
                 self.log(f"  - {dep}", 'ERROR')
             return False
         
-        self.log("✓ Dependencies satisfied")
+        self.engine_slots = _scheduler.EngineSlots(self.engine.capacity)
+        self.log(f"✓ Dependencies satisfied (engine: {self.engine.name})")
         return True
     
-    def update_virus_definitions(self):
+    def _sudo_allowed(self, binary):
+        """Whether clamscan may run through `sudo -n`.
+        
+        Asks sudo for the rule (`sudo -l`) rather than starting clamscan, and
+        remembers a success until clamscan or the sudoers files change.
+        """
+        cache_path = DATA_DIR / 'dependencies.json'
+        fingerprint = sudo_fingerprint(binary)
+        try:
+            with open(cache_path) as f:
+                cached = json.load(f)
+            if cached['sudo_clamscan'] == fingerprint and time.time() - cached['checked'] < DEPENDENCY_CACHE_TTL:
+                return True
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        
+        try:
+            allowed = subprocess.run(['sudo', '-n', '-l', binary], capture_output=True,
+                                     timeout=5).returncode == 0
+        except (OSError, subprocess.SubprocessError):
+            allowed = False
+        if allowed:
+            try:
+                DATA_DIR.mkdir(parents=True, exist_ok=True)
+                with open(cache_path, 'w') as f:
+                    json.dump({'sudo_clamscan': fingerprint, 'checked': time.time()}, f)
+            except OSError:
+                pass
+        return allowed
+    
+    async def update_virus_definitions(self):
         """Update ClamAV definitions"""
         self.log("Updating virus definitions...")
         if self.gui:
             self.gui.update_status("Updating definitions...", '#f39c12')
             self.gui.start_progress()
         
+        started = time.time()
+        outcome = 'failed'
         try:
-            result = subprocess.run(['sudo', 'freshclam'], 
-                                  capture_output=True, text=True, timeout=300)
-            if result.returncode == 0:
-                self.log("✓ Definitions updated", 'SUCCESS')
+            outcome = await self.definitions.update()
+            if outcome == 'updated':
+                if self.engine:
+                    await asyncio.to_thread(self._reload_engine)
+                self.log(f"✓ Definitions updated in {time.time() - started:.1f}s "
+                         f"({self.definitions.version_string()})", 'SUCCESS')
+            elif outcome == 'current':
+                self.log(f"✓ Definitions up to date ({self.definitions.version_string()})")
+            elif outcome == 'timeout':
+                self.log("⚠ Update timed out", 'WARNING')
             else:
                 self.log("⚠ Could not update definitions", 'WARNING')
-        except subprocess.TimeoutExpired:
-            self.log("⚠ Update timed out", 'WARNING')
+        except asyncio.CancelledError:
+            outcome = 'cancelled'
+            raise
         except Exception as e:
             self.log(f"⚠ Update error: {e}", 'WARNING')
         finally:
+            self.metrics.observe('definitions_update_seconds', time.time() - started)
+            self.metrics.inc('definitions_updates_total', result=outcome)
+            self._publish_metrics()
             if self.gui:
                 self.gui.stop_progress()
                 self.gui.update_status("Monitoring...", '#3498db')
     
+    def _is_idle(self):
+        return not (self.scheduler.running() or self.scheduler.pending() or self.device_tasks
+                    or self.intake.pending())
+    
+    async def _definitions_loop(self):
+        """Run signature updates when due, once no scan has run for a grace period"""
+        grace = self.config['definitions_idle_grace']
+        while True:
+            await asyncio.sleep(self.definitions.seconds_until_due())
+            idle_since = None
+            while True:
+                if not self._is_idle():
+                    idle_since = None
+                elif idle_since is None:
+                    idle_since = time.monotonic()
+                elif time.monotonic() - idle_since >= grace:
+                    break
+                await asyncio.sleep(min(5, max(grace, 0.1)))
+            await self.update_virus_definitions()
+    
+    def _reload_engine(self):
+        self.engine.reload()
+        self.refresh_signature_version()
+    
+    def refresh_signature_version(self):
+        """Read the loaded signature version, invalidating cached verdicts if it changed"""
+        version = self.engine.version()
+        if version and version != self.signature_version:
+            if self.signature_version and self.verdict_cache:
+                removed = self.verdict_cache.invalidate(version)
+                self.log(f"♻ Signatures changed ({version}), dropped {removed:,} cached verdicts")
+            self.signature_version = version
+        return version
+    
     def get_device_info(self, device):
         """Get device information"""
         return {
@@ -313,233 +836,867 @@ class USBScanner:
             'fs_type': device.get('ID_FS_TYPE', 'Unknown'),
             'label': device.get('ID_FS_LABEL', 'No Label'),
             'vendor': device.get('ID_VENDOR', 'Unknown'),
-            'model': device.get('ID_MODEL', 'Unknown')
+            'model': device.get('ID_MODEL', 'Unknown'),
+            'uuid': device.get('ID_FS_UUID', 'Unknown'),
+            'serial': device.get('ID_SERIAL', 'Unknown')
         }
     
-    def wait_for_mount(self, device_path, timeout=30):
-        """Wait for device to mount"""
-        self.log(f"Waiting for {device_path} to mount...")
-        start_time = time.time()
-        
-        while time.time() - start_time < timeout:
-            try:
-                result = subprocess.run(['findmnt', '-S', device_path, '-o', 'TARGET', '-n'], 
-                                      capture_output=True, text=True)
-                if result.returncode == 0 and result.stdout.strip():
-                    mount_point = result.stdout.strip()
-                    self.log(f"✓ Mounted at: {mount_point}")
-                    return mount_point
-                time.sleep(1)
-            except Exception:
-                time.sleep(1)
-        
-        self.log(f"⚠ Mount timeout for {device_path}", 'WARNING')
-        return None
-    
     def scan_existing_devices(self):
         """Scan existing USB devices"""
         self.log("Checking for existing USB devices...")
         try:
-            result = subprocess.run(['lsblk', '-o', 'NAME,FSTYPE,MOUNTPOINT,TRAN', '-J'], 
-                                  capture_output=True, text=True)
-            if result.returncode == 0:
-                data = json.loads(result.stdout)
-                for device in data.get('blockdevices', []):
-                    if device.get('tran') == 'usb':
-                        for child in device.get('children', []):
-                            fstype = child.get('fstype')
-                            mountpoint = child.get('mountpoint')
-                            if fstype in ['vfat', 'ntfs', 'exfat', 'ext4', 'ext3'] and mountpoint:
-                                device_info = {
-                                    'path': f'/dev/{child.get("name")}',
-                                    'fs_type': fstype,
-                                    'label': child.get('label', 'No Label'),
-                                    'vendor': 'Unknown',
-                                    'model': 'USB Device'
-                                }
-                                self.log(f"Found existing device: {mountpoint}")
-                                if self.gui:
-                                    self.gui.update_device_info(f"Device: USB Storage\nPath: {mountpoint}\nType: {fstype}")
-                                threading.Thread(target=self.scan_device, args=(mountpoint, device_info), daemon=True).start()
-                                return
+            found = 0
+            for entry in self.topology.usb_filesystems():
+                mountpoint = self.topology.mount_point(entry['name'])
+                if not mountpoint:
+                    continue
+                device_info = self.topology.device_info(entry)
+                fstype = device_info['fs_type']
+                self.log(f"Found existing device: {mountpoint}")
+                if self.gui:
+                    self.gui.update_device_info(f"Device: USB Storage\nPath: {mountpoint}\nType: {fstype}")
+                self.queue_scan(device_info['path'], mountpoint, device_info)
+                found += 1
+            if found:
+                return
         except Exception as e:
             self.log(f"Error checking devices: {e}", 'WARNING')
         
         self.log("No existing USB devices found")
     
-    def on_device_event(self, device):
-        """Handle device events"""
-        if not self.running or self.scanning:
+    def queue_scan(self, device_path, mount_point, device_info, detected_at=None, mounted_at=None):
+        """Queue a device for scanning"""
+        job = _scheduler.ScanJob(device_path, mount_point, device_info, detected_at, mounted_at)
+        if self.scheduler.submit(job):
+            waiting = len(self.scheduler.pending())
+            if waiting > 1 or self.scheduler.running():
+                self.log(f"⏳ Queued {mount_point} ({waiting} waiting)")
+            return job
+        if device_path in self.scheduler.jobs:
+            self.log(f"Scan of {device_path} already queued", 'WARNING')
+        else:
+            self.log(f"❌ Scan queue full, cannot queue {device_path}", 'ERROR')
+        return None
+    
+    def _on_udev_readable(self):
+        """Event loop callback: drain pending udev events into the intake"""
+        while True:
+            device = self.monitor.poll(timeout=0)
+            if device is None:
+                break
+            self._intake(device, time.time())
+        self._schedule_dispatch()
+    
+    def _intake(self, device, detected_at):
+        """Record a udev event; never blocks"""
+        device_info = self._accept_event(device)
+        if device.action != 'add':
             return
+        device_path = device.get('DEVNAME')
+        entry = self.topology.get(device_path) if self.topology else None
+        if entry:
+            disk = f"/dev/{entry['disk']}"
+            expected = self.topology.partition_paths(entry['disk'])
+        else:
+            partition = getattr(device, 'device_type', 'partition') == 'partition'
+            disk = f"/dev/{_devices.parent_disk_name(device_path)}" if partition else device_path
+            expected = None
+        self.intake.add(disk, device_path, device_info, detected_at, expected)
+    
+    def _schedule_dispatch(self):
+        """Arm the timer for the next disk whose events will have settled"""
+        if self._dispatch_timer:
+            self._dispatch_timer.cancel()
+            self._dispatch_timer = None
+        due = self.intake.next_due(busy=self.device_tasks)
+        if due is not None and self.running:
+            # The event loop clock is time.monotonic()
+            self._dispatch_timer = self.loop.call_at(due, self._dispatch)
+    
+    def _dispatch(self):
+        """Start one task per settled disk"""
+        self._dispatch_timer = None
+        for disk, group in self.intake.ready(busy=self.device_tasks):
+            task = self.loop.create_task(self._disk_task(disk, group))
+            self.device_tasks[disk] = task
+            task.add_done_callback(lambda t, d=disk: self._disk_task_done(d, t))
+        self._schedule_dispatch()
+    
+    def _disk_task_done(self, disk, task):
+        if self.device_tasks.get(disk) is task:
+            del self.device_tasks[disk]
+        # Partitions that turned up while this disk was busy
+        self._schedule_dispatch()
+    
+    async def _wait_mounted(self, device_path):
+        self.log(f"Waiting for {device_path} to mount...")
+        mount_point = await self.mount_watcher.wait_for_async(device_path) if self.mount_watcher else None
+        if mount_point:
+            self.log(f"✓ Mounted at: {mount_point}")
+        else:
+            self.log(f"⚠ Mount timeout for {device_path}", 'WARNING')
+        return mount_point, time.time()
+    
+    async def _disk_task(self, disk, group):
+        """Scan a disk's partitions one after another, each as soon as it has mounted.
         
-        if (device.action == 'add' and 
-            device.get('ID_FS_TYPE') in ['vfat', 'ntfs', 'exfat', 'ext4', 'ext3']):
-            
-            device_info = self.get_device_info(device)
-            device_path = device_info['path']
-            
-            self.log(f"🔌 USB device detected: {device_path}")
-            
-            if self.gui:
-                self.gui.show()
-                vendor = device_info['vendor']
-                model = device_info['model']
-                device_name = f"{vendor} {model}" if vendor != 'Unknown' else 'USB Device'
-                self.gui.update_device_info(f"Device: {device_name}\nPath: {device_path}\nType: {device_info['fs_type']}\nMounting...")
-                self.gui.update_status("Device detected...", '#f39c12')
-            
-            mount_point = self.wait_for_mount(device_path)
-            if mount_point:
-                if self.gui:
-                    self.gui.update_device_info(f"Device: {device_name}\nPath: {device_path}\nType: {device_info['fs_type']}\nMount: {mount_point}")
-                threading.Thread(target=self.scan_device, args=(mount_point, device_info), daemon=True).start()
-            else:
-                self.log(f"❌ Mount failed for {device_path}", 'ERROR')
-                if self.gui:
-                    self.gui.update_status("Mount failed", '#e74c3c')
+        Cancelled (with the running scan) if the disk goes away; a partition
+        that goes away only has its own mount wait dropped.
+        """
+        waits = {asyncio.ensure_future(self._wait_mounted(info['path'])): (info, detected_at)
+                 for info, detected_at in group}
+        mine = set(waits)
+        for wait, (info, _) in waits.items():
+            self.mount_waits[info['path']] = wait
+        try:
+            while waits:
+                done, _ = await asyncio.wait(waits, return_when=asyncio.FIRST_COMPLETED)
+                for wait in sorted(done, key=lambda w: waits[w][0]['path']):
+                    device_info, detected_at = waits.pop(wait)
+                    if not wait.cancelled():
+                        await self._scan_mounted(device_info, detected_at, *wait.result())
+        finally:
+            for wait in waits:
+                wait.cancel()
+            for info, _ in group:
+                if self.mount_waits.get(info['path']) in mine:
+                    del self.mount_waits[info['path']]
     
-    def scan_device(self, mount_point, device_info):
-        """Scan device with ClamAV"""
-        if self.scanning:
-            self.log("Scan already in progress", 'WARNING')
+    async def _scan_mounted(self, device_info, detected_at, mount_point, mounted_at):
+        job = self._mounted(device_info, mount_point, detected_at, mounted_at)
+        if not job:
             return
+        done = self._job_done(job)
+        try:
+            await asyncio.shield(done)
+        except asyncio.CancelledError:
+            # Stop the scan and let its workers wind down before going away
+            job.cancel()
+            try:
+                await asyncio.wait_for(done, 10)
+            except asyncio.TimeoutError:
+                self.log(f"⚠ Scan of {device_info['path']} did not stop within 10s", 'WARNING')
+            raise
+    
+    def _job_done(self, job):
+        """Future resolved (on the event loop) when a job finishes"""
+        future = self.loop.create_future()
+        
+        def resolve(job):
+            if not future.done():
+                future.set_result(job)
+        
+        job.add_done_callback(lambda j: self.loop.call_soon_threadsafe(resolve, j))
+        return future
+    
+    def _accept_event(self, device):
+        """Apply a udev event; returns device_info if it announces a device to scan"""
+        if self.topology:
+            self.topology.update(device)
+        
+        if device.action == 'remove':
+            self._device_removed(device.get('DEVNAME'))
+            return None
+        
+        if device.action != 'add' or device.get('ID_FS_TYPE') not in _devices.SUPPORTED_FILESYSTEMS:
+            return None
+        # Whole disks only count when a USB stick carries its filesystem without a partition table
+        if getattr(device, 'device_type', 'partition') == 'disk' and device.get('ID_BUS') != 'usb':
+            return None
+        
+        device_info = self.get_device_info(device)
+        self.log(f"🔌 USB device detected: {device_info['path']}")
+        if self.gui:
+            self.gui.show()
+            self.gui.update_device_info(self._device_text(device_info, "Mounting..."))
+            self.gui.update_status("Device detected...", '#f39c12')
+        return device_info
+    
+    def _mounted(self, device_info, mount_point, detected_at, mounted_at=None):
+        """Queue the scan of a freshly mounted device; returns the job"""
+        if not mount_point:
+            self.log(f"❌ Mount failed for {device_info['path']}", 'ERROR')
+            if self.gui:
+                self.gui.update_status("Mount failed", '#e74c3c')
+            return None
+        if self.gui:
+            self.gui.update_device_info(self._device_text(device_info, f"Mount: {mount_point}"))
+        return self.queue_scan(device_info['path'], mount_point, device_info, detected_at,
+                               mounted_at or time.time())
+    
+    def _device_text(self, device_info, state):
+        vendor = device_info['vendor']
+        device_name = f"{vendor} {device_info['model']}" if vendor != 'Unknown' else 'USB Device'
+        return f"Device: {device_name}\nPath: {device_info['path']}\nType: {device_info['fs_type']}\n{state}"
+    
+    def scan_path(self, path):
+        """Queue a scan of a directory (a mounted device's root gets its device identity)"""
+        device_info = None
+        if self.topology:
+            for entry in self.topology.usb_filesystems():
+                if self.topology.mount_point(entry['name']) == path:
+                    device_info = self.topology.device_info(entry)
+                    break
+        if not device_info:
+            device_info = directory_device_info(path)
+        self.log(f"📥 Scan of {path} requested")
+        return self.queue_scan(device_info['path'], path, device_info)
+    
+    def cancel_scan(self, target):
+        """Cancel a job by id, or whatever is pending for a device path; returns what was cancelled"""
+        for job in self.scheduler.jobs.copy().values():
+            if target in (job.id, job.device_path, job.mount_point):
+                job.cancel()
+                self.log(f"⏹ Scan of {job.mount_point} cancelled on request", 'WARNING')
+                return [job.id]
+        task = self.device_tasks.get(self.intake.disk_of(target)) if isinstance(target, str) else None
+        if task:
+            task.cancel()
+            self.log(f"⏹ Pending scan of {target} cancelled on request", 'WARNING')
+            return [target]
+        return []
+    
+    def job_list(self):
+        """Running and queued jobs, plus devices still waiting to mount"""
+        jobs = [job.as_dict() for job in sorted(self.scheduler.jobs.copy().values(), key=lambda j: j.id)]
+        queued = {job['device'] for job in jobs}
+        busy = {self.intake.disk_of(path) for path in queued}
+        jobs += [{'device': path, 'state': 'settling'} for path in self.intake.pending()]
+        jobs += [{'device': disk, 'state': 'mounting'} for disk in sorted(self.device_tasks) if disk not in busy]
+        return jobs
+    
+    def status(self):
+        """Snapshot for the control API; cheap enough to answer in milliseconds"""
+        cache = self.verdict_cache
+        return {
+            'pid': os.getpid(),
+            'version': '2.1',
+            'uptime': round(time.time() - self.started_at, 1),
+            'monitoring': bool(self.monitor) and self.running,
+            'engine': self.engine.name if self.engine else None,
+            'signature_version': self.signature_version,
+            'definitions': self.definitions.version_string(),
+            'jobs': self.job_list(),
+            'cache': {'hits': cache.hits, 'misses': cache.misses} if cache else None,
+            'exchange': self.verdict_exchange.stats() if self.verdict_exchange else None,
+        }
+    
+    def _batch_sources(self, path):
+        """(device_info, mount_point, access, mount) for each volume of a --scan target"""
+        if os.path.isdir(path):
+            return [(directory_device_info(path), path, 'directory', None)]
+        
+        sources = []
+        unmounted = False
+        volumes = _images.image_volumes(path)
+        for volume in volumes:
+            name = f"{path}#{volume.number}" if volume.number else path
+            if not volume.fs_type:
+                self.log(f"⚠ {name}: no known filesystem", 'WARNING')
+                unmounted = True
+                continue
+            mount = _images.ImageMount(path, volume)
+            try:
+                mount_point = mount.mount()
+            except OSError as e:
+                self.log(f"⚠ {name}: cannot mount {volume.fs_type} read-only: {e}", 'WARNING')
+                unmounted = True
+                continue
+            self.log(f"💿 {name} ({volume.fs_type}) mounted read-only at {mount_point}")
+            sources.append((image_device_info(path, volume), mount_point, 'mounted', mount))
+        
+        # Whatever could not be mounted is still scanned as raw bytes
+        if unmounted or not volumes:
+            self.log(f"⚠ Scanning {path} as a raw image; files are only matched if stored contiguously",
+                     'WARNING')
+            sources.append((image_device_info(path), path, 'raw', None))
+        return sources
+    
+    def scan_batch(self, paths):
+        """Scan directories and disk images offline, `max_concurrent_scans` at a time.
+        
+        Returns one summary row per volume scanned (None if the engine is missing).
+        """
+        if not self.check_dependencies(monitoring=False):
+            return None
+        self.log("🛡️ USB Scanner v2.1 batch scan")
+        
+        rows = []
+        sources = []
+        for path in dict.fromkeys(os.path.abspath(p) for p in paths):
+            try:
+                sources += [(path,) + source for source in self._batch_sources(path)]
+            except OSError as e:
+                self.log(f"❌ {path}: {e}", 'ERROR')
+                rows.append({'target': path, 'access': '-', 'files': 0, 'bytes': 0, 'threats': 0,
+                             'seconds': 0.0, 'result': 'failed'})
+        
+        self.scheduler = _scheduler.ScanScheduler(self._run_job, max_concurrent=self.config['max_concurrent_scans'],
+                                                  max_queued=max(1, len(sources)), log=self.log)
+        self.scheduler.start()
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        jobs = []
+        try:
+            for path, device_info, mount_point, access, mount in sources:
+                job = self.queue_scan(device_info['path'], mount_point, device_info)
+                if job is None:
+                    # Already queued under the same device path (or no room); queue_scan logged why
+                    if mount:
+                        mount.unmount()
+                    rows.append({'target': device_info['path'], 'access': access, 'files': 0, 'bytes': 0,
+                                 'threats': 0, 'seconds': 0.0, 'result': 'failed'})
+                    continue
+                if mount:
+                    job.add_done_callback(lambda job, mount=mount: mount.unmount())
+                jobs.append((device_info['path'], access, job))
+            for _, _, job in jobs:
+                job.finished.wait()
+        except KeyboardInterrupt:
+            self.log("⏹ Batch scan interrupted", 'WARNING')
+        finally:
+            self.scheduler.stop()
+            for _, _, job in jobs:
+                job.finished.wait(10)
+            for source in sources:
+                if source[4]:
+                    source[4].unmount()
+            if self.engine:
+                self.engine.close()
+            if self.verdict_cache:
+                self.verdict_cache.flush()
+            if self.verdict_exchange:
+                self.verdict_exchange.close()
         
-        self.scanning = True
+        for target, access, job in jobs:
+            report = job.report or {}
+            result = 'failed' if job.state == 'failed' or (job.state == 'done' and not report) else job.state
+            if report.get('cancelled'):
+                result = 'cancelled'
+            elif report:
+                result = f"{report['threats_found']} threats" if report['threats_found'] else 'clean'
+            rows.append({'target': target, 'access': access, 'files': report.get('files_scanned', 0),
+                         'bytes': report.get('bytes_scanned', 0), 'threats': report.get('threats_found', 0),
+                         'seconds': report.get('duration_seconds', 0.0), 'result': result})
+        return rows
+    
+    def _device_removed(self, device_path):
+        """Cancel anything pending or running for an unplugged partition or disk"""
+        disk, dropped = self.intake.remove(device_path)
+        # A partition going away leaves its siblings' mount waits and scans alone. The
+        # entries stay until the task has unwound (_disk_task_done), keeping the disk
+        # busy so a quick re-plug cannot start a second task on it meanwhile.
+        task = self.device_tasks.get(disk) if device_path == disk else None
+        wait = self.mount_waits.get(device_path)
+        stopped = [t.cancel() for t in (task, wait) if t]
+        jobs = [self.scheduler.cancel(job.device_path) for job in self.scheduler.jobs.copy().values()
+                if job.device_path == device_path or self.intake.disk_of(job.device_path) == device_path]
+        if any(stopped) or any(jobs) or dropped:
+            self.log(f"⏏ {device_path} removed, scan cancelled", 'WARNING')
+    
+    def _run_job(self, job):
+        """Scheduler callback: run one queued job"""
+        if self.gui:
+            running = len(self.scheduler.running())
+            if running == 1:
+                self.gui.start_progress()
+        # Scheduler workers are reused, so the next job starts from the old priority
+        job.priority, previous = lower_thread_priority(self.config['scan_nice'], self.config['scan_ionice'])
+        try:
+            self.scan_device(job.mount_point, job.device_info, job)
+        finally:
+            restore_thread_priority(previous)
+    
+    def _scan_status(self):
+        """Status text for the GUI while scans are running"""
+        running = len(self.scheduler.running())
+        waiting = len(self.scheduler.pending())
+        status = "Scanning..." if running <= 1 else f"Scanning {running} devices..."
+        if waiting:
+            status += f" ({waiting} queued)"
+        return status
+    
+    def scan_device(self, mount_point, device_info, job=None):
+        """Scan device with ClamAV"""
         start_time = datetime.now()
+        progress = ScanProgress(mount_point)
+        if job:
+            job.progress = progress
         
         try:
             self.log(f"🔍 Scanning {mount_point}")
             if self.gui:
-                self.gui.update_status("Scanning...", '#e67e22')
-                self.gui.start_progress()
+                self.gui.update_status(self._scan_status(), '#e67e22')
             
-            # Create quarantine directory if it doesn't exist
-            quarantine_dir = os.path.join(os.path.expanduser('~'), '.local', 'share', 'usb-scanner', 'quarantine')
-            os.makedirs(quarantine_dir, exist_ok=True)
+            infected_files = []
+            sharded = self.config['scan_mode'] != 'tree'
+            version = self.refresh_signature_version() if sharded else None
+            manifest = self._manifest_tracker(mount_point, device_info, version) if sharded else None
+            journal = self._scan_journal(mount_point, device_info, version) if sharded else None
+            if journal and journal.previous:
+                self.log(f"⏯ Resuming interrupted scan: {len(journal.completed):,} files already checked")
+            triage = _ordering.Triage(self.config['triage_media_size_cap'],
+                                      self.config['triage_large_media']) if sharded and self.config['triage'] else None
             
-            # Scan without removing files first
-            command = [
-                'sudo', 'clamscan', '-r', '--infected',
-                '--suppress-ok-results', mount_point
-            ]
+            io = self._prepare_io(job) if sharded else None
+            probe = self.responsiveness.begin()
             
-            # Run the scan and capture output
-            result = subprocess.run(command, capture_output=True, text=True)
+            # Consume verdicts as they arrive; quarantine each threat right away
+            finished = False
+            try:
+                with closing(self._scan_results(mount_point, job, progress, version, manifest, triage,
+                                                io, journal)) as results:
+                    for result in results:
+                        if job and job.cancelled:
+                            break
+                        progress.update(result)
+                        if manifest:
+                            manifest.record(result)
+                        if result.status == 'FOUND':
+                            handled = time.perf_counter()
+                            self._handle_threat(result, device_info, infected_files)
+                            progress.quarantine_seconds += time.perf_counter() - handled
+                        if journal:
+                            journal.record(result)
+                        self._emit_progress(progress)
+                    else:
+                        finished = not (job and job.cancelled)
+            finally:
+                host = self.responsiveness.end(probe)
+                if io:
+                    self._restore_io(io)
+                if journal:
+                    journal.close(complete=finished)
+            self._emit_progress(progress, final=True)
+            timings = self._record_scan_metrics(job, progress, cancelled=bool(job and job.cancelled))
             
-            infected_files = []
-            quarantined_files = []
+            if journal and journal.previous:
+                infected_files += journal.previous_threats()
+                self.log(f"⏯ {journal.skipped_files:,} files ({_engine.format_bytes(journal.skipped_bytes)}) "
+                         f"carried over from {journal.runs - 1} earlier run(s)")
+                if manifest:
+                    for path in journal.resumed_clean:
+                        manifest.record(_engine.ScanResult(path, 'OK', None))
             
-            # Process scan results
-            for line in result.stdout.splitlines():
-                line = line.strip()
-                if 'FOUND' in line:
-                    # Extract file path from ClamAV output (format: "/path/to/file: Malware.Type FOUND")
-                    try:
-                        file_path = line.split(': ')[0].strip()
-                        malware_type = line.split(': ')[1].strip()
-                        infected_files.append(line)
-                        self.log(f"🦠 THREAT: {line}", 'ERROR')
-                        
-                        # Quarantine the file
-                        if os.path.exists(file_path):
-                            # Create a unique filename for the quarantined file
-                            file_basename = os.path.basename(file_path)
-                            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                            quarantine_filename = f"{timestamp}_{file_basename}.quarantine"
-                            quarantine_path = os.path.join(quarantine_dir, quarantine_filename)
-                            
-                            # Copy the file to quarantine
-                            try:
-                                # Save file metadata
-                                metadata = {
-                                    "original_path": file_path,
-                                    "detection": malware_type,
-                                    "quarantine_time": timestamp,
-                                    "device_info": device_info
-                                }
-                                
-                                # Copy the file and store metadata
-                                import shutil
-                                shutil.copy2(file_path, quarantine_path)
-                                with open(f"{quarantine_path}.metadata", 'w') as mf:
-                                    json.dump(metadata, mf, indent=2)
-                                
-                                # Remove original file after successful quarantine
-                                os.remove(file_path)
-                                
-                                quarantined_files.append(quarantine_path)
-                                self.log(f"✓ Quarantined: {file_path} → {quarantine_path}", 'INFO')
-                            except Exception as e:
-                                self.log(f"⚠️ Quarantine failed: {str(e)}", 'ERROR')
-                    except Exception as e:
-                        self.log(f"⚠️ Error processing threat: {str(e)}", 'ERROR')
+            if manifest:
+                if manifest.mode == 'incremental':
+                    self.log(f"⏩ Incremental scan: {manifest.unchanged:,} unchanged files skipped")
+                elif manifest.previous:
+                    self.log(f"Full scan: {manifest.reason}")
+                if not (job and job.cancelled):
+                    self.manifests.save(_engine.device_identity(device_info), manifest.manifest())
+            
+            if triage:
+                deferred = triage.counts.get('large_media', 0)
+                if triage.large_media == 'skip' and deferred:
+                    self.log(f"⏭ Skipped {deferred:,} large media files "
+                             f"({_engine.format_bytes(triage.skipped_bytes)}), see report", 'WARNING')
+                elif deferred:
+                    self.log(f"Deferred {deferred:,} large media files to the end of the scan")
             
             return_code = 1 if infected_files else 0
             duration = datetime.now() - start_time
             
-            if self.gui:
+            if self.gui and len(self.scheduler.running()) <= 1:
                 self.gui.stop_progress()
             
-            # Results
-            if return_code == 0:
+            # Results; a cancelled scan is never reported clean, whatever it saw before stopping
+            if job and job.cancelled:
+                self.log(f"⏹ Scan of {mount_point} cancelled - incomplete, "
+                         f"{len(infected_files)} threats quarantined so far", 'WARNING')
+                if self.gui:
+                    self.gui.update_status("Scan cancelled / incomplete", '#95a5a6')
+            elif return_code == 0:
                 self.log("✅ Scan complete - No threats", 'SUCCESS')
                 if self.gui:
                     self.gui.update_status("Clean", '#27ae60')
-            elif return_code == 1:
+            else:
                 self.log(f"⚠️ {len(infected_files)} threats quarantined", 'WARNING')
                 if self.gui:
                     self.gui.update_status(f"Threats quarantined: {len(infected_files)}", '#f39c12')
-            else:
-                self.log(f"⚠️ Scan warnings (code: {return_code})", 'WARNING')
-                if self.gui:
-                    self.gui.update_status("Scan warnings", '#f39c12')
             
             # Summary
             self.log("=" * 40)
             self.log(f"Device: {mount_point}")
             self.log(f"Duration: {duration}")
+            self.log(f"Scanned: {progress.summary()}")
+            if progress.cache_hits:
+                self.log(f"Cached verdicts: {progress.cache_hits:,}")
+            if progress.exchange_hits:
+                self.log(f"Verdicts from the exchange: {progress.exchange_hits:,}")
+            self.log(f"Throughput: {timings['files_per_second']:,.0f} files/s, "
+                     f"{_engine.format_bytes(timings['bytes_per_second'])}/s")
+            if 'wakeup_lag_ms' in host:
+                self.log(f"Host wake-up lag: p50 {host['wakeup_lag_ms']['p50']} ms, "
+                         f"p99 {host['wakeup_lag_ms']['p99']} ms")
             self.log(f"Threats: {len(infected_files)}")
             self.log("=" * 40)
             
             # Save report
-            self._save_report(mount_point, device_info, return_code, start_time, duration, infected_files)
-            
+            report = self._save_report(mount_point, device_info, return_code, start_time, duration, infected_files,
+                                       progress=progress, scan_plan=manifest.summary() if manifest else None,
+                                       triage=triage.summary() if triage else None,
+                                       cancelled=bool(job and job.cancelled), timings=timings, io=io, host=host,
+                                       resume=journal.summary() if journal and journal.previous else None)
+            if job:
+                job.report = report
+            self._publish_metrics()
+        
         except Exception as e:
+            self.metrics.inc('scans_total', result='failed')
+            self._publish_metrics()
             if self.gui:
-                self.gui.stop_progress()
+                if len(self.scheduler.running()) <= 1:
+                    self.gui.stop_progress()
                 self.gui.update_status("Scan failed", '#e74c3c')
             self.log(f"❌ Scan error: {e}", 'ERROR')
         finally:
-            self.scanning = False
             if self.gui:
-                self.gui.root.after(5000, lambda: self.gui.update_status("Monitoring...", '#3498db'))
+                self.gui.after(5000, self._reset_status)
+    
+    def _record_scan_metrics(self, job, progress, cancelled=False):
+        """Update metrics for a finished scan; returns its phase timings for the report"""
+        completed = time.time()
+        phases = {}
+        if job and job.detected_at and job.mounted_at:
+            phases['detect_to_mount'] = job.mounted_at - job.detected_at
+        if job:
+            phases['queue_wait'] = progress.started - job.queued_at
+        if progress.first_verdict:
+            phases['first_verdict'] = progress.first_verdict - progress.started
+        phases['scan'] = completed - progress.started
+        origin = (job.detected_at or job.queued_at) if job else progress.started
+        phases['total'] = completed - origin
+        
+        m = self.metrics
+        for phase, seconds in phases.items():
+            m.observe('scan_phase_seconds', seconds, phase=phase)
+        result = 'cancelled' if cancelled else 'infected' if progress.threats else 'clean'
+        m.inc('scans_total', result=result)
+        m.inc('files_scanned_total', progress.files)
+        m.inc('bytes_scanned_total', progress.bytes)
+        m.inc('threats_total', progress.threats)
+        m.inc('cache_hits_total', progress.cache_hits)
+        m.inc('exchange_hits_total', progress.exchange_hits)
+        
+        elapsed = max(phases['scan'], 1e-6)
+        timings = {phase: round(seconds, 3) for phase, seconds in phases.items()}
+        timings['quarantine'] = round(progress.quarantine_seconds, 3)
+        timings['files_per_second'] = round(progress.files / elapsed, 1)
+        timings['bytes_per_second'] = round(progress.bytes / elapsed)
+        device = os.path.basename(job.device_path) if job else progress.mount_point
+        m.set('scan_files_per_second', timings['files_per_second'], device=device)
+        m.set('scan_bytes_per_second', timings['bytes_per_second'], device=device)
+        return timings
+    
+    def _manifest_tracker(self, mount_point, device_info, version):
+        """Tracker comparing this scan against the device's last manifest (None if not applicable)"""
+        identity = _engine.device_identity(device_info)
+        if not identity or not version:
+            return None
+        previous = self.manifests.load(identity) if self.config['incremental_scans'] else None
+        return _engine.ManifestTracker(mount_point, previous, version, device_info.get('fs_type'),
+                                       max_churn=self.config['manifest_max_churn'])
+    
+    def _scan_journal(self, mount_point, device_info, version):
+        """Checkpoint journal for this scan, resuming an interrupted one (None if not applicable)"""
+        identity = _engine.device_identity(device_info)
+        if not identity or not version or not self.config['resume_window']:
+            return None
+        journal = _engine.ScanJournal(DATA_DIR / 'checkpoints', identity, mount_point, version,
+                                      window=self.config['resume_window'])
+        try:
+            journal.open()
+        except OSError as e:
+            self.log(f"⚠ Scan checkpoints unavailable: {e}", 'WARNING')
+            return None
+        return journal
+    
+    def _prepare_io(self, job):
+        """Match scan concurrency and read-ahead to the device's link and media.
+        
+        Returns the plan for `_scan_results` and the report; `_restore_io`
+        puts the read-ahead back afterwards.
+        """
+        io = {'workers': self.config['scan_workers']}
+        if job:
+            io.update(job.priority)
+        if self.config['bandwidth_limit']:
+            io['bandwidth_limit_mbps'] = self.config['bandwidth_limit']
+        profile = self.topology.io_profile(job.device_path) if job and self.topology else None
+        if not profile or not self.config['adaptive_io']:
+            return io
+        
+        workers, read_ahead = plan_io(profile, self.config['scan_workers'])
+        io.update(profile, workers=workers, link=describe_link(profile))
+        if read_ahead and read_ahead != profile['read_ahead_kb'] and \
+                self.topology.set_read_ahead(profile['disk'], read_ahead):
+            io['read_ahead_kb'] = read_ahead
+            io['previous_read_ahead_kb'] = profile['read_ahead_kb']
+        read_ahead = f", read-ahead {io['read_ahead_kb']} KB" if io['read_ahead_kb'] else ""
+        self.log(f"⚙ {io['link']}: up to {workers} workers{read_ahead}")
+        return io
+    
+    def _wants_physical_order(self, io):
+        """Seek-bound media (spinning disks, USB 2.0 links) are read in on-disk order"""
+        mode = self.config['physical_order']
+        if mode != 'auto':
+            return mode == 'always'
+        if not io:
+            return False
+        speed = io.get('speed_mbps')
+        return bool(io.get('rotational') or (speed is not None and speed <= 480))
+    
+    def _restore_io(self, io):
+        previous = io.get('previous_read_ahead_kb')
+        if previous and self.topology:
+            self.topology.set_read_ahead(io['disk'], previous)
+    
+    def _scan_results(self, mount_point, job, progress, version=None, manifest=None, triage=None, io=None,
+                      journal=None):
+        """Yield verdicts for mount_point using the configured scan mode"""
+        owner = job.id if job else mount_point
+        if self.config['scan_mode'] == 'tree':
+            with self.engine_slots.slot(owner), closing(self.engine.scan_tree(mount_point)) as results:
+                yield from results
+            return
+        
+        # Never take more than a fair share of the engine from other running devices
+        share = self.engine_slots.share(len(self.scheduler.running()))
+        workers = min(io['workers'] if io else self.config['scan_workers'], share)
+        self.log(f"⚙ Sharded scan: {workers} workers, batches of {self.config['batch_size']}")
+        
+        # Reads (hashing and engine) are charged against the bandwidth cap before they happen
+        bucket = TokenBucket(self.config['bandwidth_limit'] * 1024 * 1024) \
+            if self.config['bandwidth_limit'] else None
+        cancel_event = job.cancel_event if job else None
+        
+        def throttle(path):
+            try:
+                bucket.consume(os.lstat(path).st_size, cancel_event)
+            except OSError:
+                pass
+        
+        # Files whose content was already judged under the loaded signatures skip the engine:
+        # first the local cache, then one exchange request for the rest of the batch. Only
+        # files of a size the local cache has a verdict for are hashed up front; the rest are
+        # hashed after the engine has read them, to be remembered for next time.
+        cache = self.verdict_cache
+        exchange = self.verdict_exchange
+        hinted = cache.sizes(version) if cache and version else None
+        digests = {}
+        
+        def known_verdicts(paths):
+            hashed = {}
+            for path in paths:
+                try:
+                    if hinted is None or os.stat(path).st_size in hinted:
+                        hashed[path] = _engine.hash_file(path)
+                    else:
+                        digests[path] = None
+                except OSError:
+                    continue
+            local = cache.get_many(set(hashed.values()), version) if cache and hashed else {}
+            known = {path: _engine.ScanResult(path, *local[digest])
+                     for path, digest in hashed.items() if digest in local}
+            cache_hits = len(known)
+            missing = {digest for path, digest in hashed.items() if path not in known}
+            remote = exchange.lookup(missing, version) if exchange and missing else {}
+            for path, digest in hashed.items():
+                if path in known:
+                    continue
+                verdict = remote.get(digest)
+                if verdict:
+                    # Answers from other stations are never written into this station's cache
+                    known[path] = _engine.ScanResult(path, *verdict)
+                else:
+                    digests[path] = digest
+            progress.count_known(cache_hits, len(known) - cache_hits)
+            return known
+        
+        scan = _engine.ShardedScan(self.engine, self.engine_slots, owner,
+                                   workers=workers, batch_size=self.config['batch_size'],
+                                   cancel_event=cancel_event,
+                                   prefilter=known_verdicts if (cache or exchange) and version else None,
+                                   throttle=throttle if bucket else None)
+        paths = manifest.paths() if manifest else _engine.iter_files(mount_point)
+        if journal:
+            paths = journal.pending(paths)
+        if triage:
+            paths = triage.order(paths)
+        ordering = _ordering.PhysicalOrder() if self._wants_physical_order(io) else None
+        if ordering:
+            paths = ordering.order(paths)
+        try:
+            with closing(scan.run(paths)) as results:
+                for result in results:
+                    pending = result.path in digests
+                    digest = digests.pop(result.path, None)
+                    if pending and result.status in ('OK', 'FOUND'):
+                        try:
+                            size = os.stat(result.path).st_size
+                            # Files not hashed up front are still in the page cache from the engine's read
+                            digest = digest or _engine.hash_file(result.path)
+                        except OSError:
+                            digest = None
+                        if digest and cache:
+                            cache.put(digest, version, result.status, result.detection, size)
+                            hinted.add(size)
+                        if digest and exchange:
+                            exchange.publish(digest, version, result.status, result.detection)
+                    yield result
+        finally:
+            if cache:
+                cache.evict()
+            if exchange:
+                exchange.flush()
+                self._check_exchange()
+            if io is not None:
+                io['workers_used'] = workers
+                if bucket:
+                    io['throttled_seconds'] = round(bucket.waited, 3)
+                if ordering:
+                    io['physical_order'] = ordering.summary()
+    
+    def _check_exchange(self):
+        """Log when the verdict exchange stops or starts answering"""
+        error = self.verdict_exchange.last_error
+        if error and error != self._exchange_error:
+            self.log(f"⚠ Verdict exchange unreachable ({error}), using the local cache only", 'WARNING')
+        elif self._exchange_error and not error:
+            self.log("🔗 Verdict exchange reachable again")
+        self._exchange_error = error
+    
+    def _handle_threat(self, result, device_info, infected_files):
+        """Record a detection and quarantine the file"""
+        try:
+            file_path = result.path
+            malware_type = result.detection
+            line = f"{file_path}: {malware_type} FOUND"
+            infected_files.append(line)
+            self.log(f"🦠 THREAT: {line}", 'ERROR')
+            
+            if device_info.get('raw_image'):
+                self.log("Detection in an unmounted image, nothing to quarantine", 'WARNING')
+            elif os.path.exists(file_path):
+                self._quarantine_file(file_path, malware_type, device_info)
+        except Exception as e:
+            self.log(f"⚠️ Error processing threat: {str(e)}", 'ERROR')
+    
+    def _quarantine_file(self, file_path, malware_type, device_info):
+        """Move an infected file into quarantine"""
+        try:
+            if not self.quarantine:
+                raise RuntimeError("quarantine store unavailable")
+            
+            # Store (deduplicated by content) before touching the original
+            started = time.perf_counter()
+            entry_id, digest, duplicate = self.quarantine.add(file_path, malware_type, device_info)
+            self.metrics.observe('quarantine_seconds', time.perf_counter() - started)
+            
+            stored = "already stored" if duplicate else "stored"
+            
+            # Remove original file after successful quarantine (evidence on read-only sources stays)
+            if device_info.get('read_only'):
+                self.log(f"✓ Copied to quarantine: {file_path} → #{entry_id} ({digest[:12]}, {stored}); "
+                         f"original left on read-only source", 'INFO')
+                return entry_id
+            os.remove(file_path)
+            
+            self.log(f"✓ Quarantined: {file_path} → #{entry_id} ({digest[:12]}, {stored})", 'INFO')
+            return entry_id
+        except Exception as e:
+            self.log(f"⚠️ Quarantine failed: {str(e)}", 'ERROR')
+            return None
     
-    def _save_report(self, mount_point, device_info, exit_code, start_time, duration, infected_files):
-        """Save scan report"""
+    def _emit_progress(self, progress, final=False):
+        """Push progress to the GUI (often) and the log (rarely)"""
+        if self.gui and (final or progress.due('gui', self.config['progress_interval'])):
+            text = f"{progress.mount_point}: {progress.summary()} scanned"
+            if not final and progress.current_path:
+                text += f"\n{progress.current_path}"
+            self.gui.update_progress(text)
+        if not final and progress.due('log', self.config['progress_log_interval']):
+            self.log(f"📊 {progress.mount_point}: {progress.summary()} scanned "
+                     f"(current: {progress.current_path})")
+    
+    def _reset_status(self):
+        """Return the GUI status to idle once no scans are left"""
+        if self.scheduler.running() or self.scheduler.pending():
+            self.gui.update_status(self._scan_status(), '#e67e22')
+        else:
+            self.gui.update_status("Monitoring...", '#3498db')
+    
+    def _save_report(self, mount_point, device_info, exit_code, start_time, duration, infected_files,
+                     progress=None, scan_plan=None, triage=None, cancelled=False, timings=None,
+                     io=None, host=None, resume=None):
+        """Record the scan in history and write its report file; returns the report"""
         # Get quarantine location for the report
-        quarantine_dir = os.path.join(os.path.expanduser('~'), '.local', 'share', 'usb-scanner', 'quarantine')
+        quarantine_dir = str(DATA_DIR / 'quarantine')
         
         report = {
             'timestamp': start_time.isoformat(),
             'device': device_info,
             'mount_point': mount_point,
             'duration': str(duration),
+            'duration_seconds': round(duration.total_seconds(), 3),
             'exit_code': exit_code,
             'threats_found': len(infected_files),
             'infected_files': infected_files,
             'quarantine_location': quarantine_dir,
             'action_taken': 'quarantined' if infected_files else 'none'
         }
+        report['scan_mode'] = self.config['scan_mode']
+        report['signature_version'] = self.signature_version
+        if progress:
+            report['files_scanned'] = progress.files
+            report['bytes_scanned'] = progress.bytes
+            report['scan_errors'] = progress.errors
+            report['cache_hits'] = progress.cache_hits
+            if self.verdict_exchange:
+                report['exchange_hits'] = progress.exchange_hits
+        if scan_plan:
+            report['scan_plan'] = scan_plan
+        if triage:
+            report['triage'] = triage
+        if timings:
+            report['timings'] = timings
+        if io:
+            report['io'] = {k: v for k, v in io.items() if k != 'previous_read_ahead_kb'}
+        if host:
+            report['host_responsiveness'] = host
+        if resume:
+            # Totals cover every run of an interrupted scan
+            report['resume'] = resume
+            report['files_scanned'] = report.get('files_scanned', 0) + resume['resumed_files']
+            report['bytes_scanned'] = report.get('bytes_scanned', 0) + resume['resumed_bytes']
+        if cancelled:
+            report['cancelled'] = True
+        
+        recorded = False
+        if self.history:
+            try:
+                scan_id = self.history.append(report)
+                recorded = True
+                self.log(f"🗂 Recorded as scan #{scan_id}")
+            except Exception as e:
+                self.log(f"⚠ Could not record scan history: {e}", 'WARNING')
+        
+        # Read-only sources (disk images) keep no copy of their own
+        on_device = self.config['report_files'] and not device_info.get('read_only')
+        if recorded and not on_device:
+            return report
         
         timestamp_str = start_time.strftime('%Y%m%d_%H%M%S')
         filename = f"scan_report_{timestamp_str}.json"
         
-        # Try multiple save locations
-        locations = [
-            os.path.join(mount_point, filename),
-            os.path.join(os.path.expanduser('~'), 'Desktop', filename),
-            f"/tmp/{filename}"
-        ]
+        # The copy on the device is for whoever holds it; fall back to local
+        # locations only when the history store could not keep the report
+        locations = [os.path.join(mount_point, filename)] if on_device else []
+        if not recorded:
+            locations += [
+                os.path.join(os.path.expanduser('~'), 'Desktop', filename),
+                f"/tmp/{filename}"
+            ]
         
         for location in locations:
             try:
@@ -549,54 +1706,402 @@ class USBScanner:
                 break
             except Exception:
                 continue
+        return report
     
-    def start(self):
-        """Start monitoring"""
-        if not self.check_dependencies():
-            return False
+    async def _main(self):
+        """Event loop owning udev events, mount watching, definition updates and timers"""
+        self.loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        self.scheduler.start()
         
-        self.log("🛡️ USB Scanner v2.1 started")
-        if self.gui:
-            self.gui.update_status("Starting...", '#f39c12')
+        if self.config['metrics_port']:
+            try:
+                self.metrics_server = _reporting.MetricsServer(self.metrics, self.config['metrics_port'])
+                self.metrics_server.start()
+                self.log(f"📈 Metrics at http://127.0.0.1:{self.metrics_server.port}/metrics")
+            except OSError as e:
+                self.log(f"⚠ Metrics endpoint unavailable: {e}", 'WARNING')
+        self._publish_metrics()
+        
+        try:
+            self.control = _control.ControlServer(self, self.config['control_socket'] or DATA_DIR / 'control.sock')
+            await self.control.start()
+        except OSError as e:
+            self.control = None
+            self.log(f"⚠ Control socket unavailable: {e}", 'WARNING')
+        self._mark('scheduler, metrics and control')
+        
+        # Track the mount table so mounts are seen the moment they appear. A mount
+        # watcher, topology or udev monitor set beforehand (the benchmark's fakes) is kept
+        try:
+            if not self.mount_watcher:
+                self.mount_watcher = _mounts.MountWatcher()
+            self.mount_watcher.attach(self.loop)
+        except OSError as e:
+            self.mount_watcher = None
+            self.log(f"⚠ Mount watcher unavailable: {e}", 'WARNING')
+        self._mark('mount watcher')
+        
+        # Index block devices once; udev events keep it current
+        if not self.topology:
+            self.topology = _devices.BlockTopology(mount_watcher=self.mount_watcher)
+        self.topology.refresh()
+        self._mark('block devices')
+        
+        # A mirror-fed station has nothing to scan with until the first build
+        if self.definitions.mirror and not self.definitions.active_dir.exists():
+            await self.update_virus_definitions()
+            self._mark('initial definitions')
+            if not self.definitions.active_dir.exists():
+                self.log(f"❌ No signature databases in {self.definitions.mirror}; devices cannot be scanned "
+                         f"until it has some (checked every {self.definitions.MISSING_RETRY}s)", 'ERROR')
+                if self.gui:
+                    self.gui.update_status("No virus definitions", '#e74c3c')
         
         # Check existing devices
         self.scan_existing_devices()
-        
-        # Update definitions in background
-        threading.Thread(target=self.update_virus_definitions, daemon=True).start()
+        self._mark('existing devices')
         
         # Start monitoring
         try:
-            self.observer = MonitorObserver(self.monitor, callback=self.on_device_event)
-            self.observer.daemon = True
-            self.observer.start()
-            
-            self.log("✅ Monitoring active", 'SUCCESS')
-            if self.gui:
-                self.gui.update_status("Monitoring...", '#3498db')
-            return True
+            if not self.monitor:
+                self.context = _pyudev.Context()
+                self.monitor = _pyudev.Monitor.from_netlink(self.context)
+                self.monitor.filter_by(subsystem='block')
+                self.monitor.start()
+            self.loop.add_reader(self.monitor.fileno(), self._on_udev_readable)
         except Exception as e:
             self.log(f"❌ Failed to start: {e}", 'ERROR')
+            if self.gui:
+                self.gui.update_status("Failed to start", '#e74c3c')
+            await self._close()
             return False
+        
+        self.log("✅ Monitoring active", 'SUCCESS')
+        if self.gui:
+            self.gui.update_status("Monitoring...", '#3498db')
+        if self.startup:
+            self._mark('udev monitor')
+            print(self.startup.report(), file=sys.stderr, flush=True)
+        
+        background = [asyncio.create_task(self._definitions_loop()),
+                      asyncio.create_task(self._maintenance())]
+        await self._stopping.wait()
+        
+        self.log("Shutting down...")
+        self.running = False
+        self.loop.remove_reader(self.monitor.fileno())
+        if self._dispatch_timer:
+            self._dispatch_timer.cancel()
+        tasks = list(self.device_tasks.values()) + background
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self._close()
+        return True
+    
+    async def _close(self):
+        """Cancel outstanding scans, wait for them to wind down and release resources"""
+        jobs = self.scheduler.running()
+        self.scheduler.stop()
+        if jobs:
+            await asyncio.wait([self._job_done(job) for job in jobs], timeout=10)
+        if self.mount_watcher:
+            self.mount_watcher.detach()
+        if self.metrics_server:
+            self.metrics_server.stop()
+        if self.control:
+            await self.control.stop()
+        if self.engine:
+            self.engine.close()
+        if self.verdict_cache:
+            self.verdict_cache.flush()
+        if self.verdict_exchange:
+            self.verdict_exchange.close()
+    
+    async def _maintenance(self, interval=60):
+        """Periodic housekeeping on the event loop"""
+        while True:
+            await asyncio.sleep(interval)
+            if self.verdict_cache:
+                await asyncio.to_thread(self.verdict_cache.flush)
+            if self.verdict_exchange:
+                await asyncio.to_thread(self.verdict_exchange.flush)
+            self._publish_metrics()
+    
+    def _run_core(self):
+        self._core_result = asyncio.run(self._main())
+    
+    def request_stop(self):
+        """Ask the event loop to shut down (safe from any thread and from signal handlers)"""
+        self.running = False
+        if self.loop and self._stopping and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._stopping.set)
     
     def run(self):
         """Run the scanner"""
-        if not self.start():
+        if not self.check_dependencies():
             return False
+        self._mark('dependencies')
         
+        self.log("🛡️ USB Scanner v2.1 started")
+        if not self.gui:
+            self.log("Running in daemon mode...")
+            try:
+                return asyncio.run(self._main())
+            finally:
+                self.log("Scanner stopped")
+        
+        # Tk needs the main thread; the event loop runs beside it and feeds
+        # the GUI through its thread-safe update methods
+        self.gui.update_status("Starting...", '#f39c12')
+        core = threading.Thread(target=self._run_core, name='scanner-core', daemon=True)
+        core.start()
         try:
-            if self.gui:
-                self.gui.root.mainloop()
-            else:
-                self.log("Running in daemon mode...")
-                while self.running:
-                    time.sleep(1)
+            self.gui.root.mainloop()
         except KeyboardInterrupt:
             self.log("Stopped by user")
         finally:
-            if self.observer:
-                self.observer.stop()
+            self.request_stop()
+            core.join(timeout=15)
             self.log("Scanner stopped")
+        return self._core_result
+
+
+def quarantine_command(args):
+    """Handle `usb_scanner.py quarantine ...`"""
+    store = _quarantine.QuarantineStore(DATA_DIR / 'quarantine')
+    _imported, skipped = store.import_legacy()
+    if skipped:
+        print(f"{skipped} legacy quarantine files could not be read, left in {store.directory}", file=sys.stderr)
+    
+    if args.action == 'list':
+        entries = store.list()
+        if not entries:
+            print("Quarantine is empty")
+        for entry in entries:
+            restored = f" (restored to {entry['restored_to']})" if entry['restored_to'] else ""
+            print(f"#{entry['id']:<5} {entry['quarantine_time'][:19]}  [{entry['detection']}] "
+                  f"{entry['original_path']}  {_engine.format_bytes(entry['size'])} → "
+                  f"{_engine.format_bytes(entry['stored_size'])}  {entry['sha256'][:12]}{restored}")
+        return 0
+    
+    if args.action == 'restore':
+        try:
+            target = store.restore(args.id, args.to)
+        except (KeyError, OSError) as e:
+            print(f"Restore failed: {e}")
+            return 1
+        print(f"Restored #{args.id} to {target}")
+        return 0
+    
+    if args.target == 'all':
+        removed = store.purge()
+    else:
+        try:
+            removed = store.purge(int(args.target))
+        except ValueError:
+            print(f"Invalid entry id: {args.target}")
+            return 1
+    print(f"Purged {removed} quarantine entries")
+    return 0 if removed or args.target == 'all' else 1
+
+
+def history_command(args):
+    """Handle `usb_scanner.py history ...`"""
+    history = _reporting.ScanHistory(DATA_DIR / 'history.db')
+    
+    if args.action == 'show':
+        report = history.get(args.id)
+        if report is None:
+            print(f"No scan #{args.id}")
+            return 1
+        print(json.dumps(report, indent=2))
+        return 0
+    
+    if args.action == 'import':
+        paths = []
+        for target in args.paths:
+            target = Path(target)
+            paths += sorted(target.glob('scan_report_*.json')) if target.is_dir() else [target]
+        print(f"Imported {history.import_reports(paths)} of {len(paths)} reports")
+        return 0
+    
+    try:
+        filters = {
+            'device': args.device,
+            'since': _reporting.parse_since(args.since) if args.since else None,
+            'until': _reporting.parse_since(args.until) if args.until else None,
+            'detection': args.detection,
+            'threats_only': args.threats,
+        }
+    except ValueError as e:
+        print(f"Invalid time: {e}")
+        return 1
+    
+    def when(started):
+        return datetime.fromtimestamp(started).strftime('%Y-%m-%d %H:%M')
+    
+    if args.action == 'list':
+        scans = history.scans(limit=args.limit, **filters)
+        if not scans:
+            print("No matching scans")
+        for scan in scans:
+            duration = f"{scan['duration']:.1f}s" if scan['duration'] is not None else "?"
+            threats = f"{scan['threats']} threats" if scan['threats'] else "clean"
+            cancelled = " (cancelled)" if scan['cancelled'] else ""
+            print(f"#{scan['id']:<5} {when(scan['started'])}  {scan['device'] or scan['device_id'] or '-'}  "
+                  f"{scan['mount_point']}  {scan['files'] or 0:,} files  {duration}  {threats}{cancelled}")
+        return 0
+    
+    rows = history.aggregate(group_by=args.by, **filters)
+    if not rows:
+        print("No matching scans")
+    for row in rows:
+        if args.by == 'detection':
+            print(f"{row['key']}: {row['threats']} found in {row['scans']} scans on {row['devices']} devices "
+                  f"(last {when(row['last_seen'])})")
+            continue
+        label = f"{row['key']}: " if args.by else ""
+        if args.by == 'device' and row['name']:
+            label = f"{row['name']} ({row['key']}): "
+        average = f"{row['avg_duration']:.1f}s" if row['avg_duration'] is not None else "?"
+        print(f"{label}{row['scans']} scans of {row['devices']} devices, {row['threats'] or 0} threats "
+              f"in {row['infected_scans'] or 0} scans, {row['files'] or 0:,} files / "
+              f"{_engine.format_bytes(row['bytes'] or 0)}, average {average}")
+    return 0
+
+
+def definitions_command(args, config):
+    """Handle `usb_scanner.py definitions ...`"""
+    manager = definitions_manager(config)
+    
+    if args.action == 'update':
+        try:
+            outcome = asyncio.run(manager.update())
+        except Exception as e:
+            print(f"Update failed: {e}")
+            return 1
+        if outcome == 'updated':
+            engine = create_engine(config, database=manager.active_dir if manager.mirror else None)
+            engine.reload()
+            engine.close()
+        print(f"{outcome}: {manager.version_string()}")
+        return 0 if outcome in ('updated', 'current') else 1
+    
+    state = manager.state()
+    source = f"mirror {manager.mirror}" if manager.mirror else "freshclam"
+    print(f"Source:    {source}")
+    print(f"Databases: {manager.active_dir}")
+    for database, version in manager.versions().items():
+        print(f"  {database:<9} {version}")
+    for key, label in (('last_update', 'Updated'), ('last_check', 'Checked')):
+        if state.get(key):
+            print(f"{label + ':':<10} {datetime.fromtimestamp(state[key]):%Y-%m-%d %H:%M}")
+    return 0
+
+
+def status_command(path):
+    """Handle `usb_scanner.py --status`: ask the running scanner over its control socket"""
+    try:
+        status = _client.control_request(path, {'cmd': 'status'})
+    except (OSError, ValueError):
+        pids = find_processes('usb_scanner.py')
+        if pids:
+            print(f"USB Scanner running (PIDs: {', '.join(pids)}), control socket {path} not reachable")
+            return 0
+        print("USB Scanner not running")
+        return 1
+    
+    hours, rest = divmod(int(status['uptime']), 3600)
+    print(f"USB Scanner {'monitoring' if status['monitoring'] else 'starting'} "
+          f"(PID {status['pid']}, up {hours}h {rest // 60:02d}m)")
+    print(f"Engine:     {status['engine'] or 'not loaded'}, signatures {status['definitions']}")
+    if status['cache']:
+        print(f"Cache:      {status['cache']['hits']:,} hits, {status['cache']['misses']:,} misses")
+    exchange = status.get('exchange')
+    if exchange:
+        state = 'reachable' if not exchange['last_error'] else f"unreachable ({exchange['last_error']})"
+        print(f"Exchange:   {exchange['url']} {state}, {exchange['hits']:,} hits, "
+              f"{exchange['sent']:,} verdicts shared, {exchange['queued']:,} queued")
+    if not status['jobs']:
+        print("Scans:      idle")
+    for job in status['jobs']:
+        progress = job.get('progress')
+        if progress and job['state'] == 'running':
+            print(f"  #{job['id']} scanning {job['mount_point']}: {progress['files_scanned']:,} files, "
+                  f"{_engine.format_bytes(progress['bytes_scanned'])}, {progress['threats']} threats, "
+                  f"{progress['elapsed']:.0f}s")
+        else:
+            label = f"#{job['id']}" if 'id' in job else ''
+            print(f"  {label} {job['state']} {job.get('mount_point') or job['device']}")
+    return 0
+
+
+def control_command(args, path):
+    """Handle `usb_scanner.py control ...`: raw JSON requests to the running scanner"""
+    if args.action == 'watch':
+        try:
+            for event in _client.control_stream(path, {'cmd': 'subscribe', 'interval': args.interval}):
+                print(json.dumps(event), flush=True)
+        except KeyboardInterrupt:
+            return 0
+        except OSError as e:
+            print(f"Scanner not reachable: {e}")
+            return 1
+        return 0
+    
+    request = {'cmd': args.action}
+    if args.action == 'scan':
+        request['path'] = os.path.abspath(args.target)
+    elif args.action == 'cancel':
+        request['job'] = int(args.target) if args.target.isdigit() else args.target
+    try:
+        reply = _client.control_request(path, request)
+    except (OSError, ValueError) as e:
+        print(f"Scanner not reachable: {e}")
+        return 1
+    print(json.dumps(reply, indent=2))
+    return 0 if reply.get('ok') else 1
+
+
+def serve_verdicts_command(args):
+    """Handle `usb_scanner.py serve-verdicts`: run a verdict exchange for other stations"""
+    path = Path(args.db) if args.db else DATA_DIR / 'exchange.db'
+    cache = _engine.VerdictCache(path, max_entries=args.max_entries)
+    try:
+        server = _exchange.VerdictServer(cache, args.port, host=args.bind, token=args.token)
+    except ValueError as e:
+        print(f"Refusing to serve verdicts: {e} (set $USB_SCANNER_EXCHANGE_TOKEN or --exchange-token)")
+        cache.close()
+        return 1
+    except OSError as e:
+        print(f"Cannot listen on {args.bind}:{args.port}: {e}")
+        cache.close()
+        return 1
+    print(f"Serving verdicts from {path} on http://{args.bind}:{server.port}/v1/"
+          + (" (token required)" if args.token else ""), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        cache.close()
+    return 0
+
+
+def batch_command(paths, config):
+    """Handle `usb_scanner.py --scan PATH...`: exit status 1 if anything was found, 2 on errors"""
+    scanner = USBScanner(headless=True, config=config)
+    rows = scanner.scan_batch(paths)
+    scanner.log_writer.close()      # the log comes out before the summary
+    if rows is None:
+        return 2
+    print(batch_summary(rows))
+    if any(row['threats'] for row in rows):
+        return 1
+    return 2 if any(row['result'] in ('failed', 'cancelled') for row in rows) else 0
 
 
 def main():
@@ -607,31 +2112,146 @@ def main():
     parser.add_argument('--minimize', action='store_true', help='Start minimized')
     parser.add_argument('--headless', action='store_true', help='No GUI')
     parser.add_argument('--status', action='store_true', help='Show status')
+    parser.add_argument('--scan', nargs='+', metavar='PATH',
+                        help='Scan directories or disk images (read-only) once and exit; '
+                             '--max-scans of them at a time')
+    parser.add_argument('--control-socket', help='Control API socket (default ~/.local/share/usb-scanner/control.sock)')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='Print how long each startup phase took once monitoring is live')
+    parser.add_argument('--engine', choices=['auto', 'clamd', 'clamscan'],
+                        default=DEFAULT_CONFIG['engine'], help='Scan engine backend')
+    parser.add_argument('--clamd-socket', default=DEFAULT_CONFIG['clamd_socket'],
+                        help='clamd UNIX socket path')
+    parser.add_argument('--max-scans', type=int, default=DEFAULT_CONFIG['max_concurrent_scans'],
+                        help='Number of devices scanned concurrently')
+    parser.add_argument('--scan-mode', choices=['sharded', 'tree'], default=DEFAULT_CONFIG['scan_mode'],
+                        help='Split the file tree across workers, or one recursive engine call')
+    parser.add_argument('--workers', type=int, default=DEFAULT_CONFIG['scan_workers'],
+                        help='Engine workers per device in sharded mode')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_CONFIG['batch_size'],
+                        help='Files per batch in sharded mode')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Do not reuse verdicts for files already scanned')
+    parser.add_argument('--full-scan', action='store_true',
+                        help='Always rescan every file, ignoring device manifests')
+    parser.add_argument('--no-triage', action='store_true',
+                        help='Scan files in directory order instead of highest risk first')
+    parser.add_argument('--skip-large-media', action='store_true',
+                        help='Skip (rather than defer) media files above the size cap')
+    parser.add_argument('--bandwidth-limit', type=float, metavar='MB/S',
+                        help='Cap how fast each device is read')
+    parser.add_argument('--no-adaptive-io', action='store_true',
+                        help="Don't tune workers and read-ahead to the device's bus speed")
+    parser.add_argument('--physical-order', choices=['auto', 'always', 'never'],
+                        default=DEFAULT_CONFIG['physical_order'],
+                        help='Scan files in on-disk order (auto: spinning disks and USB 2.0)')
+    parser.add_argument('--mirror', help='Update signatures from this directory of CVD/CDIFF files')
+    parser.add_argument('--metrics-port', type=int, default=DEFAULT_CONFIG['metrics_port'],
+                        help='Serve Prometheus metrics on this localhost port')
+    parser.add_argument('--metrics-textfile',
+                        help='Write Prometheus metrics to this file (node-exporter textfile collector)')
+    parser.add_argument('--verdict-exchange', metavar='URL',
+                        help='Share verdicts with other stations through this exchange (see serve-verdicts)')
+    parser.add_argument('--exchange-token', default=os.environ.get('USB_SCANNER_EXCHANGE_TOKEN'),
+                        help='Bearer token for the exchange (default $USB_SCANNER_EXCHANGE_TOKEN)')
+    
+    commands = parser.add_subparsers(dest='command')
+    quarantine = commands.add_parser('quarantine', help='Manage quarantined files')
+    actions = quarantine.add_subparsers(dest='action', required=True)
+    actions.add_parser('list', help='List quarantine entries')
+    restore = actions.add_parser('restore', help='Restore an entry to its original path')
+    restore.add_argument('id', type=int, help='Entry number from `quarantine list`')
+    restore.add_argument('--to', help='Restore to this path instead')
+    purge = actions.add_parser('purge', help='Delete an entry (or all)')
+    purge.add_argument('target', help="Entry number or 'all'")
+    
+    history = commands.add_parser('history', help='Query past scans')
+    views = history.add_subparsers(dest='action', required=True)
+    for name, text in (('list', 'List scans, newest first'), ('stats', 'Aggregate scans')):
+        view = views.add_parser(name, help=text)
+        view.add_argument('--device', help='Serial, UUID, label, vendor/model or mount point (substring)')
+        view.add_argument('--since', help="ISO date/time or relative age such as 7d, 12h, 4w")
+        view.add_argument('--until', help="ISO date/time or relative age")
+        view.add_argument('--detection', help='Only scans with a matching signature name (substring)')
+        view.add_argument('--threats', action='store_true', help='Only scans that found threats')
+        if name == 'list':
+            view.add_argument('--limit', type=int, default=50, help='Number of scans shown')
+        else:
+            view.add_argument('--by', choices=['device', 'day', 'month', 'detection'], help='Group results')
+    show = views.add_parser('show', help='Print the full report of a scan')
+    show.add_argument('id', type=int, help='Scan number from `history list`')
+    imports = views.add_parser('import', help='Add scan_report_*.json files from earlier versions')
+    imports.add_argument('paths', nargs='+', help='Report files or directories containing them')
+    
+    definitions = commands.add_parser('definitions', help='Signature database status and updates')
+    definitions.add_argument('action', choices=['status', 'update'])
+    
+    control = commands.add_parser('control', help='Talk to the running scanner over its control socket')
+    control.add_argument('action', choices=['status', 'jobs', 'cache', 'scan', 'cancel', 'watch'])
+    control.add_argument('target', nargs='?', help='Directory to scan, or job number / device to cancel')
+    control.add_argument('--interval', type=float, default=1.0, help='Seconds between progress events (watch)')
+    
+    serve = commands.add_parser('serve-verdicts', help='Run a verdict exchange for other stations')
+    serve.add_argument('--port', type=int, default=8765, help='Port to listen on')
+    serve.add_argument('--bind', default='127.0.0.1', help='Address to listen on (0.0.0.0 for the network)')
+    serve.add_argument('--db', help="Verdict database (default: exchange.db in the data directory)")
+    serve.add_argument('--max-entries', type=int, default=DEFAULT_CONFIG['verdict_cache_size'] * 4,
+                       help='Verdicts kept (least recently used evicted)')
     
     args = parser.parse_args()
+    startup = StartupProfile() if args.profile_startup else None
+    if startup:
+        startup.mark('arguments')
+    
+    if args.command == 'quarantine':
+        sys.exit(quarantine_command(args))
+    if args.command == 'history':
+        sys.exit(history_command(args))
+    if args.command == 'serve-verdicts':
+        args.token = args.exchange_token
+        sys.exit(serve_verdicts_command(args))
+    if args.command == 'definitions':
+        sys.exit(definitions_command(args, dict(DEFAULT_CONFIG, definitions_mirror=args.mirror,
+                                                engine=args.engine, clamd_socket=args.clamd_socket)))
     
+    control_path = args.control_socket or DATA_DIR / 'control.sock'
+    if args.command == 'control':
+        if args.action in ('scan', 'cancel') and not args.target:
+            parser.error(f"control {args.action} needs a target")
+        sys.exit(control_command(args, control_path))
     if args.status:
-        # Check if running
-        try:
-            result = subprocess.run(['pgrep', '-f', 'usb_scanner.py'], capture_output=True, text=True)
-            if result.returncode == 0:
-                pids = result.stdout.strip().split('\n')
-                print(f"USB Scanner running (PIDs: {', '.join(pids)})")
-                sys.exit(0)
-            else:
-                print("USB Scanner not running")
-                sys.exit(1)
-        except Exception:
-            print("Status check failed")
-            sys.exit(1)
+        sys.exit(status_command(control_path))
     
     # Auto-enable headless if no GUI
-    if not args.headless and not GUI_AVAILABLE:
+    if not args.headless and not args.scan and not _gui.GUI_AVAILABLE:
         print("GUI not available, running headless")
         args.headless = True
     
     try:
-        scanner = USBScanner(headless=args.headless, minimize=args.minimize)
+        config = {
+            'engine': args.engine,
+            'clamd_socket': args.clamd_socket,
+            'max_concurrent_scans': args.max_scans,
+            'scan_mode': args.scan_mode,
+            'scan_workers': args.workers,
+            'batch_size': args.batch_size,
+            'verdict_cache': not args.no_cache,
+            'incremental_scans': not args.full_scan,
+            'triage': not args.no_triage,
+            'triage_large_media': 'skip' if args.skip_large_media else 'defer',
+            'adaptive_io': not args.no_adaptive_io,
+            'bandwidth_limit': args.bandwidth_limit,
+            'physical_order': args.physical_order,
+            'metrics_port': args.metrics_port,
+            'metrics_textfile': args.metrics_textfile,
+            'definitions_mirror': args.mirror,
+            'control_socket': args.control_socket,
+            'verdict_exchange': args.verdict_exchange,
+            'verdict_exchange_token': args.exchange_token,
+        }
+        if args.scan:
+            sys.exit(batch_command(args.scan, config))
+        scanner = USBScanner(headless=args.headless, minimize=args.minimize, config=config, startup=startup)
         success = scanner.run()
         sys.exit(0 if success else 1)
     except Exception as e:
@@ -0,0 +1,27 @@
+"""Requests to a running scanner over its control socket"""
+
+import json
+import socket
+
+
+def control_request(path, request, timeout=2.0):
+    """Send one request to a running scanner and return its reply (OSError if none is listening)"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(str(path))
+        sock.sendall(json.dumps(request).encode() + b'\n')
+        with sock.makefile('rb') as replies:
+            line = replies.readline()
+    if not line:
+        raise ConnectionError("no reply from scanner")
+    return json.loads(line)
+
+
+def control_stream(path, request):
+    """Yield the events of a streaming request (such as subscribe) until the scanner hangs up"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(str(path))
+        sock.sendall(json.dumps(request).encode() + b'\n')
+        with sock.makefile('rb') as replies:
+            for line in replies:
+                yield json.loads(line)
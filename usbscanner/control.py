@@ -0,0 +1,134 @@
+"""JSON control API of a running scanner"""
+
+import os
+import time
+import json
+import errno
+import asyncio
+from pathlib import Path
+
+from .client import control_request
+
+
+class ControlServer:
+    """JSON control API on a UNIX socket, served from the scanner's event loop.
+
+    Requests and replies are single-line JSON objects. A request names a
+    `cmd` (status, jobs, cache, scan, cancel or subscribe) and every reply
+    carries `ok`. `subscribe` keeps the connection open and streams a
+    `progress` event every `interval` seconds plus a `job` event whenever a
+    job changes state. The socket is only accessible to its owner, since a
+    request can start a scan that quarantines files.
+    """
+
+    def __init__(self, scanner, path):
+        self.scanner = scanner
+        self.path = Path(path)
+        self.server = None
+        self.handlers = {
+            'status': lambda request: scanner.status(),
+            'jobs': lambda request: {'jobs': scanner.job_list()},
+            'cache': self._cache,
+            'scan': self._scan,
+            'cancel': self._cancel,
+        }
+
+    async def start(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if self.path.exists():
+            try:
+                control_request(self.path, {'cmd': 'status'}, timeout=0.5)
+            except (OSError, ValueError):
+                self.path.unlink()      # left behind by a scanner that did not shut down
+            else:
+                raise OSError(errno.EADDRINUSE, f"another scanner is listening on {self.path}")
+        umask = os.umask(0o177)
+        try:
+            self.server = await asyncio.start_unix_server(self._client, path=str(self.path))
+        finally:
+            os.umask(umask)
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            try:
+                self.path.unlink()
+            except OSError:
+                pass
+
+    async def _client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    command = request.get('cmd')
+                except (ValueError, AttributeError):
+                    request, command = {}, None
+                if command == 'subscribe':
+                    await self._subscribe(request, writer)
+                    break
+                handler = self.handlers.get(command)
+                if handler is None:
+                    reply = {'ok': False, 'error': f"unknown command: {command!r}"}
+                else:
+                    try:
+                        reply = handler(request)
+                        if asyncio.iscoroutine(reply):
+                            reply = await reply
+                        reply = dict(reply, ok=reply.get('ok', True))
+                    except Exception as e:
+                        reply = {'ok': False, 'error': str(e)}
+                writer.write(json.dumps(reply).encode() + b'\n')
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _cache(self, request):
+        cache = self.scanner.verdict_cache
+        if not cache:
+            return {'ok': False, 'error': 'verdict cache disabled'}
+        # Counting entries touches the whole table; keep it off the event loop
+        return {'cache': await asyncio.to_thread(cache.stats)}
+
+    def _scan(self, request):
+        path = request.get('path')
+        if not path or not os.path.isdir(path):
+            return {'ok': False, 'error': f"not a directory: {path}"}
+        job = self.scanner.scan_path(os.path.abspath(path))
+        if not job:
+            return {'ok': False, 'error': 'already queued or queue full'}
+        return {'job': job.as_dict()}
+
+    def _cancel(self, request):
+        target = request.get('job', request.get('device'))
+        cancelled = self.scanner.cancel_scan(target)
+        if not cancelled:
+            return {'ok': False, 'error': f"no such scan: {target}"}
+        return {'cancelled': cancelled}
+
+    async def _subscribe(self, request, writer):
+        interval = max(0.1, float(request.get('interval', 1.0)))
+        seen = {}       # job id -> (job, state last reported)
+        while True:
+            current = {job.id: job for job in self.scanner.scheduler.jobs.copy().values()}
+            for job_id, job in current.items():
+                seen.setdefault(job_id, (job, None))
+            events = []
+            for job_id, (job, reported) in list(seen.items()):
+                state = job.state
+                if state != reported:
+                    events.append({'event': 'job', 'job': job.as_dict()})
+                    seen[job_id] = (job, state)
+                if job_id not in current and job.finished.is_set():
+                    del seen[job_id]
+            events.append({'event': 'progress', 'time': time.time(),
+                           'jobs': [job.as_dict() for job in current.values() if job.state == 'running']})
+            writer.write(b''.join(json.dumps(event).encode() + b'\n' for event in events))
+            await writer.drain()
+            await asyncio.sleep(interval)
@@ -0,0 +1,263 @@
+"""Block device topology and coalescing of udev add events"""
+
+import os
+import re
+import time
+import threading
+from pathlib import Path
+
+
+SUPPORTED_FILESYSTEMS = ['vfat', 'ntfs', 'exfat', 'ext4', 'ext3']
+
+
+# Block device topology
+
+def read_sysfs(path, default=None):
+    """Stripped contents of a sysfs attribute, `default` if it cannot be read"""
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return default
+
+
+class BlockTopology:
+    """In-memory index of block devices built from sysfs and the udev database.
+
+    Records the transport, parent disk, partitions, filesystem and (through
+    the mount watcher) mount point of every block device, and is kept
+    current from udev events. All paths are rooted so it can run against a
+    fake sysfs tree.
+    """
+
+    def __init__(self, sys_root='/sys', udev_db='/run/udev/data', mount_watcher=None):
+        self.sys_root = Path(sys_root)
+        self.udev_db = Path(udev_db)
+        self.mount_watcher = mount_watcher
+        self.lock = threading.Lock()
+        self.devices = {}
+
+    def refresh(self):
+        """Re-enumerate every block device"""
+        devices = {}
+        try:
+            names = os.listdir(self.sys_root / 'class' / 'block')
+        except OSError:
+            names = []
+        for name in names:
+            device = self._read(name)
+            if device:
+                devices[name] = device
+        with self.lock:
+            self.devices = devices
+
+    def _udev_properties(self, dev):
+        properties = {}
+        try:
+            with open(self.udev_db / f"b{dev}") as f:
+                for line in f:
+                    if line.startswith('E:') and '=' in line:
+                        key, value = line[2:].rstrip('\n').split('=', 1)
+                        properties[key] = value
+        except OSError:
+            pass
+        return properties
+
+    def _read(self, name, properties=None):
+        node = self.sys_root / 'class' / 'block' / name
+        dev = read_sysfs(node / 'dev')
+        if dev is None:
+            return None
+        partition = (node / 'partition').exists()
+        disk = os.path.basename(os.path.dirname(os.path.realpath(node))) if partition else name
+        disk_path = os.path.realpath(self.sys_root / 'block' / disk)
+        props = self._udev_properties(dev)
+        props.update(properties or {})
+        return {
+            'name': name,
+            'dev': dev,
+            'path': f"/dev/{name}",
+            'partition': partition,
+            'disk': disk,
+            'transport': 'usb' if '/usb' in disk_path else props.get('ID_BUS'),
+            'removable': read_sysfs(self.sys_root / 'block' / disk / 'removable') == '1',
+            'fs_type': props.get('ID_FS_TYPE'),
+            'label': props.get('ID_FS_LABEL'),
+            'uuid': props.get('ID_FS_UUID'),
+            'serial': props.get('ID_SERIAL'),
+            'vendor': props.get('ID_VENDOR'),
+            'model': props.get('ID_MODEL'),
+        }
+
+    def update(self, device):
+        """Apply a pyudev event"""
+        name = device.sys_name
+        with self.lock:
+            if device.action == 'remove':
+                self.devices.pop(name, None)
+                return
+        entry = self._read(name, dict(device.properties))
+        if entry:
+            with self.lock:
+                self.devices[name] = entry
+
+    def get(self, name):
+        with self.lock:
+            return self.devices.get(os.path.basename(name))
+
+    def io_profile(self, name):
+        """Link speed, media type and read-ahead of the disk behind a block device.
+
+        The USB link speed (Mb/s) comes from the nearest USB device above the
+        disk in sysfs; None if the device is gone or not behind USB.
+        """
+        node = self.sys_root / 'class' / 'block' / os.path.basename(name)
+        if not node.exists():
+            return None
+        disk = os.path.basename(os.path.dirname(os.path.realpath(node))) if (node / 'partition').exists() \
+            else os.path.basename(name)
+        queue_dir = self.sys_root / 'block' / disk / 'queue'
+        speed = None
+        root = Path(os.path.realpath(self.sys_root))
+        path = Path(os.path.realpath(self.sys_root / 'block' / disk / 'device'))
+        while path != path.parent and path != root:
+            if (path / 'busnum').exists():
+                try:
+                    speed = float(read_sysfs(path / 'speed', ''))
+                except ValueError:
+                    pass
+                break
+            path = path.parent
+        read_ahead = read_sysfs(queue_dir / 'read_ahead_kb')
+        return {
+            'disk': disk,
+            'speed_mbps': speed,
+            'rotational': read_sysfs(queue_dir / 'rotational') == '1',
+            'read_ahead_kb': int(read_ahead) if read_ahead and read_ahead.isdigit() else None,
+        }
+
+    def set_read_ahead(self, disk, kb):
+        """Set a disk's read-ahead; False without the privileges to do so"""
+        try:
+            with open(self.sys_root / 'block' / disk / 'queue' / 'read_ahead_kb', 'w') as f:
+                f.write(str(kb))
+            return True
+        except OSError:
+            return False
+
+    def partition_paths(self, disk):
+        """Device paths of every partition sysfs lists for a disk (None if the disk is unknown)"""
+        try:
+            names = os.listdir(self.sys_root / 'block' / disk)
+        except OSError:
+            return None
+        return {f"/dev/{name}" for name in names if (self.sys_root / 'block' / disk / name / 'partition').exists()}
+
+    def partitions(self, disk):
+        with self.lock:
+            return [d for d in self.devices.values() if d['partition'] and d['disk'] == disk]
+
+    def mount_point(self, name):
+        return self.mount_watcher.lookup(f"/dev/{os.path.basename(name)}") if self.mount_watcher else None
+
+    def usb_filesystems(self):
+        """USB partitions (or unpartitioned USB disks) carrying a supported filesystem"""
+        with self.lock:
+            devices = list(self.devices.values())
+        return [d for d in devices
+                if d['transport'] == 'usb' and d['fs_type'] in SUPPORTED_FILESYSTEMS]
+
+    @staticmethod
+    def device_info(entry):
+        """Entry in the device_info format used by scans and reports"""
+        return {
+            'path': entry['path'],
+            'fs_type': entry['fs_type'] or 'Unknown',
+            'label': entry['label'] or 'No Label',
+            'vendor': entry['vendor'] or 'Unknown',
+            'model': entry['model'] or 'USB Device',
+            'uuid': entry['uuid'] or 'Unknown',
+            'serial': entry['serial'] or 'Unknown'
+        }
+
+# Device intake
+
+def parent_disk_name(name):
+    """Disk a partition belongs to, from its kernel name alone (sdb1 -> sdb, mmcblk0p2 -> mmcblk0)"""
+    name = os.path.basename(name)
+    if re.match(r'(mmcblk|nvme|loop|md)', name):
+        return re.sub(r'p\d+$', '', name)
+    return re.sub(r'\d+$', '', name) or name
+
+
+class DeviceIntake:
+    """udev `add` events waiting to be acted on, coalesced per parent disk.
+
+    Recording an event never blocks. A disk's partitions are handed out
+    together by `ready()`: as soon as every partition sysfs lists for the
+    disk has announced itself, otherwise once the disk has been quiet for
+    `debounce` seconds. A disk whose previous group is still being handled
+    (`busy`) waits, so partitions of one disk are never scanned in parallel.
+    """
+
+    def __init__(self, debounce=0.5):
+        self.debounce = debounce
+        self.lock = threading.Lock()
+        self.groups = {}       # disk -> {'devices': {path: (device_info, detected_at)}, 'seen', 'expected', 'due'}
+        self.disks = {}        # device path -> parent disk
+
+    def add(self, disk, device_path, device_info, detected_at, expected=None):
+        """Record an add event; device_info None for a partition there is nothing to scan on"""
+        with self.lock:
+            self.disks[device_path] = disk
+            group = self.groups.setdefault(disk, {'devices': {}, 'seen': set(), 'expected': None, 'due': 0})
+            if expected is not None:
+                group['expected'] = set(expected)
+            if device_path != disk:
+                group['seen'].add(device_path)
+            if device_info:
+                group['devices'][device_path] = (device_info, detected_at)
+            complete = group['expected'] is not None and group['expected'] <= group['seen']
+            group['due'] = time.monotonic() + (0 if complete else self.debounce)
+
+    def remove(self, device_path):
+        """Drop whatever is pending for a removed partition or disk; returns (disk, anything dropped)"""
+        with self.lock:
+            disk = self.disks.get(device_path, device_path)
+            group = self.groups.get(disk)
+            dropped = False
+            if group:
+                if device_path == disk:
+                    dropped = bool(self.groups.pop(disk)['devices'])
+                else:
+                    dropped = group['devices'].pop(device_path, None) is not None
+                    group['seen'].discard(device_path)
+        return disk, dropped
+
+    def disk_of(self, device_path):
+        with self.lock:
+            return self.disks.get(device_path, device_path)
+
+    def pending(self):
+        """Device paths still waiting to be dispatched"""
+        with self.lock:
+            return [path for group in self.groups.values() for path in group['devices']]
+
+    def _next_due(self, busy):
+        return min((g['due'] for disk, g in self.groups.items() if disk not in busy), default=None)
+
+    def next_due(self, busy=()):
+        """time.monotonic() at which ready() will next have something (None: nothing pending)"""
+        with self.lock:
+            return self._next_due(busy)
+
+    def ready(self, busy=()):
+        """Pop the disks whose events have settled: [(disk, [(device_info, detected_at), ...])]"""
+        now = time.monotonic()
+        groups = []
+        with self.lock:
+            for disk in [d for d, g in self.groups.items() if d not in busy and g['due'] <= now]:
+                devices = self.groups.pop(disk)['devices']
+                if devices:
+                    groups.append((disk, [devices[path] for path in sorted(devices)]))
+        return groups
@@ -0,0 +1,1183 @@
+"""Scanning: ClamAV engines, signature definitions, sharded scans, the verdict cache
+and device manifests.
+"""
+
+import os
+import stat
+import asyncio
+import threading
+import time
+import subprocess
+import json
+import socket
+import shutil
+import sqlite3
+import struct
+import hashlib
+import gzip
+import tempfile
+import queue
+from collections import namedtuple
+from contextlib import closing, contextmanager
+from pathlib import Path
+
+
+# Scan engines
+#
+# Every engine yields ScanResult tuples as verdicts arrive, one per scanned
+# file. `status` is 'OK', 'FOUND' or 'ERROR' and `detection` carries the
+# signature name (or the error text).
+
+ScanResult = namedtuple('ScanResult', ['path', 'status', 'detection'])
+
+
+def iter_file_stats(root):
+    """Yield (path, stat) for regular files below root without following symlinks.
+
+    A regular file given as root is its own tree (raw disk images are scanned that way).
+    """
+    try:
+        st = os.stat(root)
+    except OSError:
+        return
+    if stat.S_ISREG(st.st_mode):
+        yield root, st
+        return
+    pending = [root]
+    while pending:
+        try:
+            entries = os.scandir(pending.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        yield entry.path, entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+
+
+def iter_files(root):
+    """Yield regular files below root without following symlinks"""
+    for path, _stat in iter_file_stats(root):
+        yield path
+
+
+def format_bytes(size):
+    """Human readable byte count"""
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024:
+            return f"{size:.1f} {unit}" if unit != 'B' else f"{size} B"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def _error_split(line):
+    """Path and message of an error line; messages may contain ': ' themselves"""
+    starts = [i for i in range(len(line)) if line.startswith(': ', i)]
+    for i in reversed(starts):
+        if os.path.lexists(line[:i]):
+            return line[:i], line[i + 2:]
+    # Error texts ("lstat() failed: ...") carry ': ' far more often than paths do
+    return line[:starts[0]], line[starts[0] + 2:]
+
+
+def parse_clam_line(line, path=None):
+    """Parse a ClamAV result line ("/path/to/file: Malware.Type FOUND").
+
+    Pass `path` when the line is known to be about that file.
+    """
+    line = line.strip()
+    if path is not None and line.startswith(path + ': '):
+        verdict = line[len(path) + 2:]
+    else:
+        path, sep, verdict = line.rpartition(': ')
+        if not sep:
+            return None
+        if verdict.endswith(' ERROR'):
+            path, verdict = _error_split(line)
+    if verdict == 'OK':
+        return ScanResult(path, 'OK', None)
+    if verdict.endswith(' FOUND'):
+        return ScanResult(path, 'FOUND', verdict[:-len(' FOUND')])
+    if verdict.endswith(' ERROR'):
+        return ScanResult(path, 'ERROR', verdict[:-len(' ERROR')])
+    return None
+
+
+class ScanEngine:
+    """Base class for scan engine backends"""
+
+    name = 'base'
+    capacity = 1    # number of scans the backend can serve concurrently
+
+    def available(self):
+        """Return True if the backend can be used"""
+        raise NotImplementedError
+
+    def version(self):
+        """Return the engine/signature version string (or None)"""
+        return None
+
+    def scan_tree(self, path):
+        """Recursively scan a directory, yielding ScanResults"""
+        raise NotImplementedError
+
+    def scan_files(self, paths):
+        """Scan individual files, yielding ScanResults"""
+        raise NotImplementedError
+
+    def reload(self):
+        """Make the engine pick up freshly downloaded signatures"""
+
+    def close(self):
+        """Release any held resources"""
+
+
+class ClamscanEngine(ScanEngine):
+    """Fallback backend: spawns `sudo clamscan` for every scan"""
+
+    name = 'clamscan'
+
+    def __init__(self, use_sudo=True, max_processes=2, database=None):
+        self.command = ['sudo', 'clamscan'] if use_sudo else ['clamscan']
+        if database:
+            self.command.append(f"--database={database}")
+        self.capacity = max_processes
+
+    def available(self):
+        return shutil.which('clamscan') is not None
+
+    def version(self):
+        try:
+            result = subprocess.run(self.command + ['--version'],
+                                    capture_output=True, text=True, timeout=60)
+            if result.returncode == 0:
+                return result.stdout.strip()
+        except Exception:
+            pass
+        return None
+
+    def _run(self, args, file_list=None):
+        """Run clamscan, optionally feeding it a file list on stdin"""
+        process = subprocess.Popen(self.command + ['--no-summary'] + args,
+                                   stdin=subprocess.PIPE if file_list is not None else subprocess.DEVNULL,
+                                   stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                   text=True, bufsize=1)
+        if file_list is not None:
+            threading.Thread(target=self._feed, args=(process, file_list), daemon=True).start()
+        try:
+            for line in process.stdout:
+                parsed = parse_clam_line(line)
+                if parsed:
+                    yield parsed
+        finally:
+            if process.poll() is None:
+                process.terminate()
+            process.stdout.close()
+            process.wait()
+
+    @staticmethod
+    def _feed(process, paths):
+        try:
+            for path in paths:
+                if '\n' not in path:
+                    process.stdin.write(path + '\n')
+        except OSError:
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    def scan_tree(self, path):
+        return self._run(['-r', path])
+
+    def scan_files(self, paths):
+        # One process (and one signature load) for the whole stream of paths
+        return self._run(['--file-list=/dev/stdin'], file_list=paths)
+
+
+class StreamReadError(Exception):
+    """Reading a file to send over INSTREAM failed; clamd itself is fine"""
+
+
+class ClamdSession:
+    """A single clamd connection in IDSESSION mode"""
+
+    def __init__(self, socket_path, timeout):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(socket_path)
+        self.sock.sendall(b'zIDSESSION\0')
+        self.next_id = 1
+        self.buffer = b''
+
+    def command(self, command, chunks=None):
+        """Send one command (optionally with INSTREAM chunks) and return its reply"""
+        request_id = self.next_id
+        self.next_id += 1
+        self.sock.sendall(b'z' + command.encode() + b'\0')
+        if chunks is not None:
+            for chunk in chunks:
+                self.sock.sendall(struct.pack('!L', len(chunk)) + chunk)
+            self.sock.sendall(struct.pack('!L', 0))
+
+        prefix = f"{request_id}: ".encode()
+        while True:
+            reply = self._read_reply()
+            if reply.startswith(prefix):
+                return reply[len(prefix):].decode(errors='replace')
+
+    def _read_reply(self):
+        while b'\0' not in self.buffer:
+            data = self.sock.recv(4096)
+            if not data:
+                raise ConnectionError("clamd closed the session")
+            self.buffer += data
+        reply, self.buffer = self.buffer.split(b'\0', 1)
+        return reply
+
+    def close(self):
+        try:
+            self.sock.sendall(b'zEND\0')
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class ClamdEngine(ScanEngine):
+    """Backend talking to a long-lived clamd over its UNIX socket.
+
+    Per-file SCAN/INSTREAM requests reuse pooled IDSESSION connections, so
+    tree scans walk the directory here and get a verdict for every file.
+    With `multiscan` enabled tree scans are handed to clamd as one MULTISCAN
+    on a one-shot connection instead (clamd does not allow it inside a
+    session); that is faster on large trees but only reports detections.
+    """
+
+    name = 'clamd'
+    STREAM_CHUNK = 64 * 1024
+
+    def __init__(self, socket_path, pool_size=4, timeout=120, multiscan=False):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.multiscan = multiscan
+        self.capacity = pool_size
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(pool_size)
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        return sock
+
+    def _oneshot(self, command):
+        """Run a non-session command, yielding each reply until EOF"""
+        sock = self._connect()
+        try:
+            sock.sendall(b'z' + command.encode() + b'\0')
+            buffer = b''
+            while True:
+                data = sock.recv(4096)
+                if not data:
+                    break
+                buffer += data
+                *replies, buffer = buffer.split(b'\0')
+                for reply in replies:
+                    yield reply.decode(errors='replace')
+            if buffer.strip():
+                yield buffer.decode(errors='replace')
+        finally:
+            sock.close()
+
+    @contextmanager
+    def session(self):
+        """Borrow a pooled clamd session"""
+        with self._slots:
+            try:
+                session = self._idle.get_nowait()
+            except queue.Empty:
+                session = ClamdSession(self.socket_path, self.timeout)
+            try:
+                yield session
+            except BaseException:
+                session.close()
+                raise
+            self._idle.put(session)
+
+    def _call(self, command, chunks_factory=None):
+        """Run a session command, reconnecting once if clamd dropped an idle session"""
+        for attempt in range(2):
+            try:
+                with self.session() as session:
+                    chunks = chunks_factory() if chunks_factory else None
+                    return session.command(command, chunks)
+            except (ConnectionError, socket.timeout):
+                # Only the socket: a file that cannot be read is not clamd's fault
+                if attempt:
+                    raise
+                # Sessions left idle as long as this one were most likely dropped too
+                self._close_idle()
+
+    def _close_idle(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def available(self):
+        try:
+            return any(reply.strip() == 'PONG' for reply in self._oneshot('PING'))
+        except OSError:
+            return False
+
+    def version(self):
+        try:
+            return self._call('VERSION').strip()
+        except (OSError, ConnectionError):
+            return None
+
+    def reload(self):
+        try:
+            for _reply in self._oneshot('RELOAD'):
+                pass
+        except OSError:
+            pass
+
+    def _stream_file(self, path):
+        try:
+            with open(path, 'rb') as f:
+                while True:
+                    chunk = f.read(self.STREAM_CHUNK)
+                    if not chunk:
+                        break
+                    yield chunk
+        except OSError as e:
+            raise StreamReadError(str(e)) from e
+
+    def scan_stream(self, path):
+        """Send file contents over INSTREAM (for files clamd cannot open itself)"""
+        try:
+            reply = self._call('INSTREAM', lambda: self._stream_file(path))
+        except StreamReadError as e:
+            # The half-sent session was closed; the rest of the pool is untouched
+            return ScanResult(path, 'ERROR', str(e))
+        parsed = parse_clam_line(reply, 'stream')
+        if parsed is None:
+            return ScanResult(path, 'ERROR', reply.strip())
+        return parsed._replace(path=path)
+
+    @staticmethod
+    def _access_denied(result):
+        text = (result.detection or '').lower()
+        return result.status == 'ERROR' and ('denied' in text or 'lstat() failed' in text)
+
+    def scan_file(self, path):
+        reply = self._call(f'SCAN {path}')
+        parsed = parse_clam_line(reply, path) or ScanResult(path, 'ERROR', reply.strip())
+        if self._access_denied(parsed):
+            return self.scan_stream(path)
+        return parsed
+
+    def scan_files(self, paths):
+        for path in paths:
+            try:
+                yield self.scan_file(path)
+            except OSError as e:
+                yield ScanResult(path, 'ERROR', str(e))
+
+    def scan_tree(self, path):
+        if not self.multiscan:
+            yield from self.scan_files(iter_files(path))
+            return
+        for reply in self._oneshot(f'MULTISCAN {path}'):
+            parsed = parse_clam_line(reply)
+            if parsed is None:
+                continue
+            if self._access_denied(parsed) and os.path.isfile(parsed.path):
+                parsed = self.scan_stream(parsed.path)
+            yield parsed
+
+    def close(self):
+        self._close_idle()
+
+
+# Signature definitions
+
+def read_database_version(path):
+    """Version number from a .cvd/.cld header or a database's .info file (None if unknown)"""
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(512)
+    except OSError:
+        return None
+    if not header.startswith(b'ClamAV-VDB:'):
+        return None
+    try:
+        return int(header.decode('ascii', 'replace').split(':')[2])
+    except (IndexError, ValueError):
+        return None
+
+
+class DefinitionsManager:
+    """Keeps signature databases current without getting in the way of scans.
+
+    Updates come from freshclam, or from a local mirror directory of
+    CVD/CLD and CDIFF files for air-gapped stations. A mirror update is
+    built in a fresh database directory under `store` (patched with
+    `sigtool --run-cdiff` where possible, otherwise from the newest full
+    CVD), optionally test-loaded, and published by atomically repointing
+    the `current` symlink. clamd reads `store/current` and is told to
+    RELOAD, so running scans keep the old signatures until the new ones
+    are loaded.
+    """
+
+    DATABASES = ('main', 'daily', 'bytecode')
+    KEEP = 2            # database directories kept (active + previous)
+    MISSING_RETRY = 60  # seconds between mirror checks while no database has been installed
+
+    def __init__(self, store, state_path, mirror=None, database_dir='/var/lib/clamav', interval=4 * 3600,
+                 verify=True):
+        self.mirror = Path(mirror) if mirror else None
+        self.store = Path(store)
+        self.database_dir = Path(database_dir)
+        self.interval = interval
+        self.verify = verify
+        self.state_path = Path(state_path)
+        self.process = None
+
+    @property
+    def active_dir(self):
+        """Directory the engine loads signatures from"""
+        return self.store / 'current' if self.mirror else self.database_dir
+
+    def versions(self, directory=None):
+        """{database: version} for the databases present in a directory (default: the active one)"""
+        directory = Path(directory or self.active_dir)
+        versions = {}
+        for name in self.DATABASES:
+            for suffix in ('.cld', '.cvd', '.info'):
+                version = read_database_version(directory / f"{name}{suffix}")
+                if version is not None:
+                    versions[name] = version
+                    break
+        return versions
+
+    def version_string(self):
+        return ' '.join(f"{name}:{version}" for name, version in self.versions().items()) or 'unknown'
+
+    def state(self):
+        """Persisted update bookkeeping: last_check, last_update and versions"""
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self, **changes):
+        state = dict(self.state(), **changes)
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.state_path.with_suffix('.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp, self.state_path)
+
+    def seconds_until_due(self):
+        last = self.state().get('last_check', 0)
+        due = max(0.0, last + self.interval - time.time())
+        if self.mirror and not self.active_dir.exists():
+            return min(due, self.MISSING_RETRY)
+        return due
+
+    async def update(self, timeout=300):
+        """Run one update; returns 'updated', 'current', 'failed' or 'timeout'"""
+        self._save_state(last_check=time.time())
+        if self.mirror:
+            outcome = await asyncio.to_thread(self._update_from_mirror)
+        else:
+            outcome = await self._run_freshclam(timeout)
+        if outcome == 'updated':
+            self._save_state(last_update=time.time(), versions=self.versions())
+        return outcome
+
+    async def _run_freshclam(self, timeout):
+        self.process = await asyncio.create_subprocess_exec(
+            'sudo', 'freshclam', stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        before = self.versions()
+        try:
+            await asyncio.wait_for(self.process.wait(), timeout)
+        except asyncio.TimeoutError:
+            self.process.kill()
+            return 'timeout'
+        except asyncio.CancelledError:
+            if self.process.returncode is None:
+                self.process.kill()
+            raise
+        if self.process.returncode != 0:
+            return 'failed'
+        return 'updated' if self.versions() != before else 'current'
+
+    def _mirror_files(self, name):
+        """(newest full database path, its version) and {version: cdiff path} in the mirror"""
+        full, full_version = None, None
+        for suffix in ('.cvd', '.cld'):
+            path = self.mirror / f"{name}{suffix}"
+            version = read_database_version(path)
+            if version is not None and (full_version is None or version > full_version):
+                full, full_version = path, version
+        diffs = {}
+        for path in self.mirror.glob(f"{name}-*.cdiff"):
+            try:
+                diffs[int(path.stem.rsplit('-', 1)[1])] = path
+            except ValueError:
+                continue
+        return full, full_version, diffs
+
+    def _update_from_mirror(self):
+        """Build, check and publish a new database directory; runs in a worker thread"""
+        active = self.store / 'current'
+        current = self.versions(active) if active.exists() else {}
+        plan = {}
+        for name in self.DATABASES:
+            full, full_version, diffs = self._mirror_files(name)
+            have = current.get(name)
+            chain = []
+            while have is not None and have + len(chain) + 1 in diffs:
+                chain.append(diffs[have + len(chain) + 1])
+            reachable = have + len(chain) if have is not None else None
+            if chain and (full_version is None or reachable >= full_version):
+                plan[name] = ('patch', chain)
+            elif full and (have is None or full_version > have):
+                plan[name] = ('copy', full)
+            elif have is not None:
+                plan[name] = ('keep', None)
+        if not plan:
+            # Nothing installed and nothing in the mirror: there is no database to scan with
+            return 'failed'
+        if all(action == 'keep' for action, _ in plan.values()):
+            return 'current'
+
+        self.store.mkdir(parents=True, exist_ok=True)
+        staging = Path(tempfile.mkdtemp(prefix='db-', dir=self.store))
+        try:
+            for name, (action, source) in plan.items():
+                if action == 'copy':
+                    shutil.copy2(source, staging / source.name)
+                    continue
+                # Carry the active database over; files about to be patched
+                # are copied, the rest hard-linked
+                for path in active.glob(f"{name}.*"):
+                    try:
+                        if action == 'patch':
+                            raise OSError
+                        os.link(path, staging / path.name)
+                    except OSError:
+                        shutil.copy2(path, staging / path.name)
+                if action == 'patch':
+                    self._apply_cdiffs(staging, name, source)
+            if self.verify and not self._test_load(staging):
+                raise RuntimeError("new databases failed to load")
+            os.chmod(staging, 0o755)
+            link = self.store / 'current.tmp'
+            if link.is_symlink():
+                link.unlink()
+            link.symlink_to(staging.name)
+            os.replace(link, active)
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        self._prune(staging)
+        return 'updated'
+
+    def _apply_cdiffs(self, staging, name, cdiffs):
+        """Unpack one database in staging and run its CDIFF scripts in order"""
+        packed = [p for p in (staging / f"{name}.cld", staging / f"{name}.cvd") if p.exists()]
+        if packed:
+            subprocess.run(['sigtool', f"--unpack={packed[0]}"], cwd=staging, check=True,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=600)
+            packed[0].unlink()
+        for cdiff in cdiffs:
+            subprocess.run(['sigtool', f"--run-cdiff={cdiff}"], cwd=staging, check=True,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=600)
+
+    def _test_load(self, directory):
+        """Load the databases once with clamscan; True if they are usable (or cannot be checked)"""
+        if not shutil.which('clamscan'):
+            return True
+        with tempfile.NamedTemporaryFile() as probe:
+            result = subprocess.run(['clamscan', '--no-summary', f"--database={directory}", probe.name],
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=900)
+        return result.returncode == 0
+
+    def _prune(self, keep):
+        """Remove database directories other than the newest KEEP"""
+        directories = sorted((p for p in self.store.glob('db-*') if p.is_dir() and not p.is_symlink()),
+                             key=lambda p: p.stat().st_mtime, reverse=True)
+        retained = {keep} | set(directories[:self.KEEP])
+        for directory in directories:
+            if directory not in retained:
+                shutil.rmtree(directory, ignore_errors=True)
+
+
+# Sharded scanning
+
+def iter_batches(paths, batch_size):
+    """Group a path iterator into lists of at most batch_size paths"""
+    batch = []
+    for path in paths:
+        batch.append(path)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class ShardedScan:
+    """Fan batches of files out to a pool of engine workers.
+
+    Each worker holds one engine slot (a clamd connection or a clamscan
+    process) and keeps claiming batches from the shared walker until it runs
+    dry. Verdicts from all workers are merged into a single stream.
+    """
+
+    _DONE = object()
+
+    def __init__(self, engine, slots, owner, workers=4, batch_size=64, cancel_event=None,
+                 prefilter=None, throttle=None):
+        self.engine = engine
+        self.slots = slots
+        self.owner = owner
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.cancel_event = cancel_event or threading.Event()
+        self.prefilter = prefilter
+        self.throttle = throttle
+        self.batches_dispatched = 0
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._results = queue.Queue(maxsize=1024)
+        self._error = None
+
+    def _stopped(self):
+        return self._stop.is_set() or self.cancel_event.is_set()
+
+    def _claim(self, batches):
+        """Paths for one worker, claimed a batch at a time.
+
+        The prefilter gets each whole batch and returns {path: ScanResult}
+        for the paths it can answer (e.g. from the verdict cache); those are
+        reported straight away and never reach the engine. The throttle, if
+        any, is called before either reads the file.
+        """
+        while not self._stopped():
+            with self._lock:
+                batch = next(batches, None)
+                if batch is None:
+                    return
+                self.batches_dispatched += 1
+            known = {}
+            if self.prefilter:
+                # The prefilter reads the whole batch up front
+                if self.throttle:
+                    for path in batch:
+                        self.throttle(path)
+                        if self._stopped():
+                            return
+                known = self.prefilter(batch)
+            for path in batch:
+                if path in known:
+                    self._put(known[path])
+                    continue
+                if self.throttle and not self.prefilter:
+                    self.throttle(path)
+                    if self._stopped():
+                        return
+                yield path
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._results.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def _worker(self, batches):
+        try:
+            with self.slots.slot(self.owner), closing(self.engine.scan_files(self._claim(batches))) as results:
+                for result in results:
+                    self._put(result)
+                    if self._stop.is_set():
+                        break
+        except Exception as e:
+            self._error = self._error or e
+        finally:
+            self._put(self._DONE)
+
+    def run(self, paths):
+        """Scan paths, yielding merged verdicts from all workers"""
+        batches = iter_batches(paths, self.batch_size)
+        threads = [threading.Thread(target=self._worker, args=(batches,), daemon=True)
+                   for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            finished = 0
+            while finished < len(threads):
+                item = self._results.get()
+                if item is self._DONE:
+                    finished += 1
+                    continue
+                yield item
+            if self._error:
+                raise self._error
+        finally:
+            self._stop.set()
+
+
+# Verdict cache
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """SHA-256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class VerdictCache:
+    """Persistent map of (content hash, signature version) to verdict.
+
+    Lookups refresh an entry's last-used time and the table is trimmed back
+    to `max_entries` least-recently-used first. Writes are buffered and
+    committed in batches. Each entry keeps the file size it was made for,
+    so callers can skip hashing files whose size nothing in the cache has.
+    """
+
+    def __init__(self, path, max_entries=500000):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._writes = []
+        self._touches = []
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS verdicts (
+                               sha256 TEXT NOT NULL,
+                               db_version TEXT NOT NULL,
+                               status TEXT NOT NULL,
+                               detection TEXT,
+                               last_used REAL NOT NULL,
+                               size INTEGER,
+                               PRIMARY KEY (sha256, db_version))""")
+        if 'size' not in [row[1] for row in self.db.execute("PRAGMA table_info(verdicts)")]:
+            # Caches from before sizes were kept
+            self.db.execute("ALTER TABLE verdicts ADD COLUMN size INTEGER")
+        self.db.execute("CREATE INDEX IF NOT EXISTS verdicts_last_used ON verdicts (last_used)")
+        self.db.commit()
+
+    def get(self, digest, db_version):
+        """Return (status, detection) or None"""
+        with self.lock:
+            row = self.db.execute("SELECT status, detection FROM verdicts WHERE sha256 = ? AND db_version = ?",
+                                  (digest, db_version)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._touches.append((time.time(), digest, db_version))
+            if len(self._touches) >= 256:
+                self._flush_locked()
+            return row
+
+    def get_many(self, digests, db_version):
+        """Return {digest: (status, detection)} for the digests that are known"""
+        digests = list(digests)
+        found = {}
+        with self.lock:
+            for i in range(0, len(digests), 500):
+                chunk = digests[i:i + 500]
+                rows = self.db.execute(f"""SELECT sha256, status, detection FROM verdicts
+                                           WHERE db_version = ? AND sha256 IN ({','.join('?' * len(chunk))})""",
+                                       (db_version, *chunk)).fetchall()
+                found.update((digest, (status, detection)) for digest, status, detection in rows)
+            self.hits += len(found)
+            self.misses += len(digests) - len(found)
+            now = time.time()
+            self._touches.extend((now, digest, db_version) for digest in found)
+            if len(self._touches) >= 256:
+                self._flush_locked()
+        return found
+
+    def sizes(self, db_version):
+        """File sizes with a verdict under db_version (entries from other stations have none)"""
+        with self.lock:
+            self._flush_locked()
+            return {size for size, in self.db.execute(
+                "SELECT DISTINCT size FROM verdicts WHERE db_version = ? AND size IS NOT NULL", (db_version,))}
+
+    def put(self, digest, db_version, status, detection=None, size=None):
+        with self.lock:
+            self._writes.append((digest, db_version, status, detection, time.time(), size))
+            if len(self._writes) >= 256:
+                self._flush_locked()
+
+    def merge(self, records):
+        """Store (digest, db_version, status, detection) records from other stations.
+
+        A detection is never replaced by a clean verdict for the same content
+        and signature version. Returns the number of records written.
+        """
+        now = time.time()
+        with self.lock:
+            self._flush_locked()
+            before = self.db.total_changes
+            self.db.executemany("""INSERT INTO verdicts (sha256, db_version, status, detection, last_used)
+                                   VALUES (?, ?, ?, ?, ?)
+                                   ON CONFLICT (sha256, db_version) DO UPDATE
+                                   SET status = excluded.status, detection = excluded.detection,
+                                       last_used = excluded.last_used
+                                   WHERE verdicts.status != 'FOUND' OR excluded.status = 'FOUND'""",
+                                [(*record, now) for record in records])
+            self.db.commit()
+            return self.db.total_changes - before
+
+    def _flush_locked(self):
+        if self._writes:
+            self.db.executemany("INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?, ?, ?)", self._writes)
+            self._writes = []
+        if self._touches:
+            self.db.executemany("UPDATE verdicts SET last_used = ? WHERE sha256 = ? AND db_version = ?",
+                                self._touches)
+            self._touches = []
+        self.db.commit()
+
+    def flush(self):
+        with self.lock:
+            self._flush_locked()
+
+    def evict(self):
+        """Drop least recently used entries beyond max_entries"""
+        with self.lock:
+            self._flush_locked()
+            count = self.db.execute("SELECT COUNT(*) FROM verdicts").fetchone()[0]
+            excess = count - self.max_entries
+            if excess > 0:
+                self.db.execute("""DELETE FROM verdicts WHERE rowid IN (
+                                       SELECT rowid FROM verdicts ORDER BY last_used LIMIT ?)""", (excess,))
+                self.db.commit()
+            return max(0, excess)
+
+    def invalidate(self, current_version):
+        """Forget verdicts made under any other signature version"""
+        with self.lock:
+            self._flush_locked()
+            removed = self.db.execute("DELETE FROM verdicts WHERE db_version != ?",
+                                      (current_version,)).rowcount
+            self.db.commit()
+            return removed
+
+    def stats(self):
+        with self.lock:
+            entries = self.db.execute("SELECT COUNT(*) FROM verdicts").fetchone()[0]
+        return {'entries': entries, 'hits': self.hits, 'misses': self.misses}
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+
+# Device manifests
+
+# Filesystems whose inode numbers survive a remount (vfat/exfat assign them per mount)
+STABLE_INODE_FILESYSTEMS = ['ext3', 'ext4', 'ntfs']
+
+
+def device_identity(device_info):
+    """Stable identity for a device's filesystem (serial + filesystem UUID)"""
+    serial = device_info.get('serial') or ''
+    uuid = device_info.get('uuid') or ''
+    if not uuid or uuid == 'Unknown':
+        return None
+    identity = f"{serial}-{uuid}" if serial and serial != 'Unknown' else uuid
+    return ''.join(c if c.isalnum() or c in '-_.' else '_' for c in identity)
+
+
+class ManifestStore:
+    """Per-device manifests of the files found clean by the last complete scan"""
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+
+    def _path(self, identity):
+        return self.directory / f"{identity}.json.gz"
+
+    def load(self, identity):
+        try:
+            with gzip.open(self._path(identity), 'rt') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, identity, manifest):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._path(identity)
+        tmp = path.with_suffix('.tmp')
+        with gzip.open(tmp, 'wt') as f:
+            json.dump(manifest, f, separators=(',', ':'))
+        os.replace(tmp, path)
+
+
+class ManifestTracker:
+    """Plan an incremental rescan against a device's previous manifest.
+
+    Files are keyed by their path relative to the mount point and compared
+    on (size, mtime, inode). The tracker falls back to a full scan when the
+    definitions changed, the previous scan never finished, or the tree
+    changed so much that the manifest no longer looks like this device.
+    """
+
+    RACY_WINDOW_NS = 2 * 10**9    # FAT timestamps have 2 second resolution
+
+    def __init__(self, mount_point, previous, signature_version, fs_type, max_churn=0.5):
+        self.mount_point = mount_point
+        self.previous = previous
+        self.signature_version = signature_version
+        self.use_inode = fs_type in STABLE_INODE_FILESYSTEMS
+        self.max_churn = max_churn
+        self.started_ns = time.time_ns()
+        self.current = {}
+        self.clean = {}
+        self.mode = 'full'
+        self.reason = None
+        self.unchanged = 0
+
+    def _key(self, st):
+        return [st.st_size, st.st_mtime_ns, st.st_ino if self.use_inode else 0]
+
+    def _relative(self, path):
+        return os.path.relpath(path, self.mount_point)
+
+    def _full_scan_reason(self):
+        if not self.previous:
+            return "no previous manifest"
+        if not self.previous.get('complete'):
+            return "previous scan incomplete"
+        if self.previous.get('signature_version') != self.signature_version:
+            return "definitions changed"
+        return None
+
+    def paths(self):
+        """Yield the paths that need scanning"""
+        self.reason = self._full_scan_reason()
+        if self.reason:
+            for path, st in iter_file_stats(self.mount_point):
+                self.current[self._relative(path)] = self._key(st)
+                yield path
+            return
+
+        known = self.previous.get('files', {})
+        for path, st in iter_file_stats(self.mount_point):
+            self.current[self._relative(path)] = self._key(st)
+        changed = [rel for rel, key in self.current.items() if known.get(rel) != key]
+        missing = sum(1 for rel in known if rel not in self.current)
+        churn = (len(changed) + missing) / max(1, len(known))
+        skewed = any(key[1] > self.previous.get('created_ns', 0)
+                     for rel, key in self.current.items() if known.get(rel) == key)
+
+        if skewed:
+            self.reason = "timestamps newer than the manifest"
+        elif churn > self.max_churn:
+            self.reason = f"{churn:.0%} of files changed"
+        if self.reason:
+            changed = list(self.current)
+        else:
+            self.mode = 'incremental'
+            for rel, key in self.current.items():
+                if known.get(rel) == key:
+                    self.clean[rel] = key
+            self.unchanged = len(self.clean)
+
+        for rel in changed:
+            yield os.path.join(self.mount_point, rel)
+
+    def record(self, result):
+        """Remember a clean verdict for the next manifest"""
+        if result.status != 'OK':
+            return
+        rel = self._relative(result.path)
+        key = self.current.get(rel)
+        # A file modified within the timestamp resolution of this scan could change unnoticed
+        if key and key[1] < self.started_ns - self.RACY_WINDOW_NS:
+            self.clean[rel] = key
+
+    def manifest(self):
+        return {
+            'signature_version': self.signature_version,
+            'created_ns': self.started_ns,
+            'complete': True,
+            'files': self.clean,
+        }
+
+    def summary(self):
+        return {'mode': self.mode, 'reason': self.reason, 'unchanged_skipped': self.unchanged}
+
+
+# Scan checkpoints
+
+class ScanJournal:
+    """Append-only checkpoint of a device scan, so an interrupted scan can resume.
+
+    Every verdict is appended as a JSON line [path, status, detection, size,
+    mtime_ns], relative to the mount point. Lines are buffered and written
+    with one fsync per FLUSH_RECORDS verdicts or FLUSH_SECONDS, whichever
+    comes first; a torn last line after a crash is simply ignored. When the
+    device comes back within `window` seconds under the same signatures,
+    files judged by the earlier run(s) and unchanged since (size and mtime)
+    are skipped. Errors are not recorded, so they are retried. A completed
+    scan deletes its journal.
+    """
+
+    FLUSH_RECORDS = 256
+    FLUSH_SECONDS = 2.0
+
+    def __init__(self, directory, identity, mount_point, signature_version, window=24 * 3600):
+        self.path = Path(directory) / f"{identity}.jsonl"
+        self.mount_point = mount_point
+        self.signature_version = signature_version
+        self.previous = None        # header of the interrupted run being resumed
+        self.runs = 1
+        self.completed = {}         # relative path -> [status, detection, size, mtime_ns]
+        self.resumed_clean = []     # paths skipped because an earlier run found them clean
+        self.skipped_files = 0
+        self.skipped_bytes = 0
+        self.rescanned = set()      # relative paths an earlier run judged that changed since
+        self._keys = {}
+        self._buffer = []
+        self._file = None
+        self._last_flush = time.monotonic()
+        self._load(window)
+
+    def _load(self, window):
+        try:
+            age = time.time() - os.stat(self.path).st_mtime
+            with open(self.path) as f:
+                lines = f.readlines()
+        except OSError:
+            return
+        header, runs, completed = None, 1, {}
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict):
+                if header is None:
+                    header = record
+                else:
+                    runs += 1
+            elif isinstance(record, list) and len(record) == 5:
+                completed[record[0]] = record[1:]
+        if header and header.get('signature_version') == self.signature_version and age <= window:
+            self.previous = header
+            self.runs = runs + 1
+            self.completed = completed
+
+    def open(self):
+        """Start this run's part of the journal"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if self.previous:
+            self._file = open(self.path, 'a')
+            self._buffer.append(json.dumps({'resumed': time.time()}))
+        else:
+            self._file = open(self.path, 'w')
+            self._buffer.append(json.dumps({'started': time.time(), 'mount_point': self.mount_point,
+                                            'signature_version': self.signature_version}))
+        self.flush()
+
+    def pending(self, paths):
+        """Yield the paths an earlier run has not already judged"""
+        for path in paths:
+            try:
+                st = os.lstat(path)
+            except OSError:
+                yield path
+                continue
+            key = [st.st_size, st.st_mtime_ns]
+            rel = os.path.relpath(path, self.mount_point)
+            done = self.completed.get(rel)
+            if done and done[2:] == key:
+                self.skipped_files += 1
+                self.skipped_bytes += st.st_size
+                if done[0] == 'OK':
+                    self.resumed_clean.append(path)
+                continue
+            if done:
+                self.rescanned.add(rel)
+            self._keys[path] = key
+            yield path
+
+    def record(self, result):
+        """Checkpoint one verdict"""
+        key = self._keys.pop(result.path, None)
+        if key is None or result.status not in ('OK', 'FOUND') or not self._file:
+            return
+        self._buffer.append(json.dumps([os.path.relpath(result.path, self.mount_point),
+                                        result.status, result.detection] + key))
+        if len(self._buffer) >= self.FLUSH_RECORDS or \
+                time.monotonic() - self._last_flush >= self.FLUSH_SECONDS:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._file.write('\n'.join(self._buffer) + '\n')
+            self._buffer = []
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._last_flush = time.monotonic()
+
+    def close(self, complete):
+        """Keep the journal of an interrupted scan; a complete scan no longer needs one"""
+        if self._file:
+            try:
+                self.flush()
+            finally:
+                self._file.close()
+                self._file = None
+        if complete:
+            try:
+                self.path.unlink()
+            except OSError:
+                pass
+
+    def previous_threats(self):
+        """Detections made by the earlier run(s) and not rescanned by this one, as infected_files lines"""
+        return [f"{os.path.join(self.mount_point, rel)}: {detection} FOUND"
+                for rel, (status, detection, _, _) in self.completed.items()
+                if status == 'FOUND' and rel not in self.rescanned]
+
+    def summary(self):
+        return {
+            'runs': self.runs,
+            'first_started': self.previous['started'],
+            'resumed_files': self.skipped_files,
+            'resumed_bytes': self.skipped_bytes,
+            'previous_threats': len(self.previous_threats()),
+        }
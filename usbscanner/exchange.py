@@ -0,0 +1,308 @@
+"""Verdict exchange: share (content hash, signature version, verdict) records between stations over HTTP"""
+
+import re
+import hmac
+import json
+import time
+import ipaddress
+import threading
+from collections import deque
+
+
+# Records on the wire are [sha256, signature version, status, detection]
+
+STATUSES = ('OK', 'FOUND')
+HASH = re.compile(r'[0-9a-f]{64}\Z')
+
+
+def _valid_record(item):
+    """(digest, version, status, detection), or None if item is not a well-formed record"""
+    if not isinstance(item, list) or len(item) != 4:
+        return None
+    digest, version, status, detection = item
+    if not isinstance(digest, str) or not HASH.match(digest):
+        return None
+    if not isinstance(version, str) or not 0 < len(version) <= 256 or status not in STATUSES:
+        return None
+    if detection is not None and (not isinstance(detection, str) or len(detection) > 256):
+        return None
+    return digest, version, status, detection
+
+
+def _loopback(host):
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+# Client
+
+class VerdictExchange:
+    """Client for a verdict exchange service.
+
+    Lookups send one batch of hashes per request; verdicts this station
+    produces are buffered and published in batches by a background sender
+    thread, so `publish()` never waits on the network. When the service
+    cannot be reached the client stays quiet for `retry_after` seconds:
+    lookups answer nothing (the local verdict cache still applies) and
+    published records wait in a bounded backlog for the next flush.
+    """
+
+    BATCH = 256             # records per publish request
+    LOOKUP_BATCH = 1000     # hashes per lookup request
+    BACKLOG = 10000         # unsent records kept while the service is down (oldest dropped)
+
+    def __init__(self, url, token=None, timeout=2.0, retry_after=60):
+        # Only stations that use an exchange pay for importing urllib
+        import urllib.request
+        self.url = url.rstrip('/')
+        self.token = token
+        self.timeout = timeout
+        self.retry_after = retry_after
+        # A service on the local network; never route it through an HTTP proxy
+        self.opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+        self._request_class = urllib.request.Request
+        self.lock = threading.Lock()
+        self.sending = threading.Lock()
+        self.outbox = deque(maxlen=self.BACKLOG)
+        self.down_until = 0.0
+        self.last_error = None
+        self.hits = 0
+        self.misses = 0
+        self.sent = 0
+        self.failures = 0
+        self.closed = False
+        self.wakeup = threading.Event()
+        self.sender = threading.Thread(target=self._sender, name='verdict-sender', daemon=True)
+        self.sender.start()
+
+    @property
+    def available(self):
+        return time.monotonic() >= self.down_until
+
+    def _request(self, path, payload):
+        request = self._request_class(self.url + path, data=json.dumps(payload).encode(), method='POST',
+                                      headers={'Content-Type': 'application/json'})
+        if self.token:
+            request.add_header('Authorization', f"Bearer {self.token}")
+        with self.opener.open(request, timeout=self.timeout) as response:
+            reply = json.loads(response.read())
+        with self.lock:
+            self.last_error = None
+        return reply
+
+    def _failed(self, error):
+        with self.lock:
+            self.failures += 1
+            self.last_error = str(error)
+            self.down_until = time.monotonic() + self.retry_after
+
+    def lookup(self, digests, version):
+        """{digest: (status, detection)} for the digests the service knows; empty if it is unreachable"""
+        digests = list(digests)
+        found = {}
+        for i in range(0, len(digests), self.LOOKUP_BATCH):
+            if not self.available:
+                break
+            chunk = digests[i:i + self.LOOKUP_BATCH]
+            try:
+                verdicts = self._request('/v1/lookup', {'signature_version': version, 'hashes': chunk})['verdicts']
+                for digest in chunk:
+                    verdict = verdicts.get(digest)
+                    if verdict and _valid_record([digest, version, *verdict]):
+                        found[digest] = tuple(verdict)
+            except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+                self._failed(e)
+                break
+        with self.lock:
+            self.hits += len(found)
+            self.misses += len(digests) - len(found)
+        return found
+
+    def publish(self, digest, version, status, detection=None):
+        """Queue a verdict for the service; the sender thread sends it once a batch has built up"""
+        with self.lock:
+            self.outbox.append([digest, version, status, detection])
+            full = len(self.outbox) >= self.BATCH
+        if full:
+            self.wakeup.set()
+
+    def _sender(self):
+        while True:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            if self.closed:
+                return
+            with self.sending:
+                self._send()
+
+    def flush(self):
+        """Send everything queued (kept for later if the service is down)"""
+        with self.sending:
+            self._send()
+
+    def _send(self):
+        while self.available:
+            with self.lock:
+                records = [self.outbox.popleft() for _ in range(min(self.BATCH, len(self.outbox)))]
+            if not records:
+                return
+            try:
+                self._request('/v1/verdicts', {'verdicts': records})
+            except (OSError, ValueError) as e:
+                with self.lock:
+                    self.outbox.extendleft(reversed(records))
+                self._failed(e)
+                return
+            with self.lock:
+                self.sent += len(records)
+
+    def stats(self):
+        with self.lock:
+            return {'url': self.url, 'available': self.available, 'last_error': self.last_error,
+                    'hits': self.hits, 'misses': self.misses, 'sent': self.sent,
+                    'queued': len(self.outbox), 'failures': self.failures}
+
+    def close(self, timeout=5):
+        """Stop the sender thread and send what is still queued"""
+        self.closed = True
+        self.wakeup.set()
+        self.sender.join(timeout)
+        self.flush()
+
+
+# Server
+
+class VerdictServer:
+    """Verdict exchange service backed by a VerdictCache, served from a background thread.
+
+    POST /v1/lookup    {"signature_version": v, "hashes": [sha256, ...]}
+                       -> {"verdicts": {sha256: [status, detection]}}
+    POST /v1/verdicts  {"verdicts": [[sha256, signature_version, status, detection], ...]}
+                       -> {"stored": n, "rejected": n}
+    GET  /v1/stats     -> entries and request counters
+
+    With a token set, every request needs `Authorization: Bearer <token>`;
+    listening on anything but a loopback address requires one.
+    """
+
+    MAX_BODY = 8 * 1024 * 1024
+    MAX_RECORDS = 10000
+    EVICT_EVERY = 10000     # stored records between trims of the cache
+
+    def __init__(self, cache, port, host='127.0.0.1', token=None):
+        # Only stations that serve verdicts pay for importing the HTTP stack
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        if not token and not _loopback(host):
+            raise ValueError(f"a token is required to serve verdicts on {host}")
+        self.cache = cache
+        self.token = token
+        self.lock = threading.Lock()
+        self.counters = {'lookups': 0, 'hashes': 0, 'hits': 0, 'stored': 0, 'rejected': 0}
+        self._since_evict = 0
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, status, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _authorized(self):
+                if not service.token:
+                    return True
+                supplied = self.headers.get('Authorization', '')
+                if hmac.compare_digest(supplied.encode(), f"Bearer {service.token}".encode()):
+                    return True
+                self._reply(401, {'error': 'unauthorized'})
+                return False
+
+            def do_GET(self):
+                if not self._authorized():
+                    return
+                if self.path.split('?')[0] != '/v1/stats':
+                    self._reply(404, {'error': 'not found'})
+                    return
+                self._reply(200, service.stats())
+
+            def do_POST(self):
+                if not self._authorized():
+                    return
+                handler = {'/v1/lookup': service.lookup, '/v1/verdicts': service.store}.get(self.path)
+                if not handler:
+                    self._reply(404, {'error': 'not found'})
+                    return
+                try:
+                    length = int(self.headers.get('Content-Length', 0))
+                    if not 0 < length <= service.MAX_BODY:
+                        raise ValueError(f"body of {length} bytes")
+                    request = json.loads(self.rfile.read(length))
+                    if not isinstance(request, dict):
+                        raise ValueError("request is not an object")
+                    self._reply(200, handler(request))
+                except ValueError as e:
+                    self._reply(400, {'error': str(e)})
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def lookup(self, request):
+        version = request.get('signature_version')
+        hashes = request.get('hashes')
+        if not isinstance(version, str) or not isinstance(hashes, list) or len(hashes) > self.MAX_RECORDS:
+            raise ValueError("expected signature_version and up to 10000 hashes")
+        digests = [digest for digest in hashes if isinstance(digest, str) and HASH.match(digest)]
+        found = self.cache.get_many(digests, version)
+        with self.lock:
+            self.counters['lookups'] += 1
+            self.counters['hashes'] += len(hashes)
+            self.counters['hits'] += len(found)
+        return {'verdicts': {digest: list(verdict) for digest, verdict in found.items()}}
+
+    def store(self, request):
+        items = request.get('verdicts')
+        if not isinstance(items, list) or len(items) > self.MAX_RECORDS:
+            raise ValueError("expected up to 10000 verdicts")
+        records = [record for record in map(_valid_record, items) if record]
+        stored = self.cache.merge(records) if records else 0
+        with self.lock:
+            self.counters['stored'] += stored
+            self.counters['rejected'] += len(items) - len(records)
+            self._since_evict += stored
+            evict = self._since_evict >= self.EVICT_EVERY
+            if evict:
+                self._since_evict = 0
+        if evict:
+            self.cache.evict()
+        return {'stored': stored, 'rejected': len(items) - len(records)}
+
+    def stats(self):
+        with self.lock:
+            counters = dict(self.counters)
+        return dict(counters, entries=self.cache.stats()['entries'])
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name='verdict-http', daemon=True)
+        self.thread.start()
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        if self.thread:
+            self.server.shutdown()
+        self.server.server_close()
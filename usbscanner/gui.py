@@ -0,0 +1,245 @@
+"""Tk window: device status, scan progress and the log.
+
+Imported only when the scanner runs with a GUI, so headless starts never load tkinter.
+"""
+
+import threading
+import queue
+from datetime import datetime
+
+try:
+    import tkinter as tk
+    from tkinter import ttk, scrolledtext, messagebox
+    GUI_AVAILABLE = True
+except ImportError:
+    GUI_AVAILABLE = False
+
+
+class SimpleGUI:
+    """Simplified GUI with essential features only.
+    
+    Worker threads never touch widgets: log lines are queued and status
+    changes are parked as "latest value" slots, and both are applied in
+    batches on the Tk thread by `_process_queue`.
+    """
+    
+    MAX_LOG_LINES = 5000        # visible lines kept; the full log is on disk
+    TICK_MS = 100
+    
+    def __init__(self, minimize=False):
+        if not GUI_AVAILABLE:
+            raise RuntimeError("GUI not available - tkinter not installed")
+            
+        self.root = tk.Tk()
+        self.root.title("USB Virus Scanner v2.1")
+        self.root.geometry("800x600")
+        self.root.configure(bg='#1a1a1a')
+        
+        if minimize:
+            self.root.withdraw()
+            self.minimized = True
+        else:
+            self.minimized = False
+            
+        self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
+        self.message_queue = queue.Queue()
+        self._pending = {}      # widget update -> latest arguments, applied once per tick
+        self._pending_lock = threading.Lock()
+        
+        self._setup_gui()
+        self._process_queue()
+        
+    def _setup_gui(self):
+        """Setup simplified GUI"""
+        # Main container
+        main_frame = tk.Frame(self.root, bg='#1a1a1a', padx=15, pady=15)
+        main_frame.pack(fill=tk.BOTH, expand=True)
+        
+        # Title
+        title = tk.Label(main_frame, text="🛡️ USB Virus Scanner v2.1", 
+                        font=('Arial', 18, 'bold'), fg='#00ff88', bg='#1a1a1a')
+        title.pack(pady=(0, 20))
+        
+        # Status frame
+        status_frame = tk.LabelFrame(main_frame, text="Status", bg='#2d2d2d', 
+                                   fg='#ffffff', font=('Arial', 12, 'bold'))
+        status_frame.pack(fill=tk.X, pady=(0, 15))
+        
+        status_inner = tk.Frame(status_frame, bg='#2d2d2d', padx=10, pady=10)
+        status_inner.pack(fill=tk.X)
+        
+        self.status_indicator = tk.Label(status_inner, text="●", font=('Arial', 16), 
+                                       fg='#3498db', bg='#2d2d2d')
+        self.status_indicator.pack(side=tk.LEFT, padx=(0, 10))
+        
+        self.status_label = tk.Label(status_inner, text="Initializing...", 
+                                   font=('Arial', 11), fg='#ffffff', bg='#2d2d2d')
+        self.status_label.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        
+        self.progress = ttk.Progressbar(status_inner, mode='indeterminate', length=150)
+        self.progress.pack(side=tk.RIGHT)
+        
+        # Device info
+        self.device_info = tk.Label(main_frame, text="No USB device detected", 
+                                  font=('Arial', 10), fg='#cccccc', bg='#1a1a1a',
+                                  justify=tk.LEFT, anchor=tk.W)
+        self.device_info.pack(fill=tk.X, pady=(0, 5))
+        
+        # Scan progress
+        self.progress_info = tk.Label(main_frame, text="", 
+                                    font=('Arial', 9), fg='#999999', bg='#1a1a1a',
+                                    justify=tk.LEFT, anchor=tk.W)
+        self.progress_info.pack(fill=tk.X, pady=(0, 15))
+        
+        # Log
+        log_frame = tk.LabelFrame(main_frame, text="Activity Log", bg='#2d2d2d', 
+                                fg='#ffffff', font=('Arial', 12, 'bold'))
+        log_frame.pack(fill=tk.BOTH, expand=True, pady=(0, 15))
+        
+        self.log_text = scrolledtext.ScrolledText(
+            log_frame, height=15, bg='#0a0a0a', fg='#00ff88', 
+            font=('Consolas', 9), wrap=tk.WORD)
+        self.log_text.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        
+        # Configure log colors
+        self.log_text.tag_configure('INFO', foreground='#00ff88')
+        self.log_text.tag_configure('WARNING', foreground='#ffaa00')
+        self.log_text.tag_configure('ERROR', foreground='#ff4444')
+        self.log_text.tag_configure('SUCCESS', foreground='#00ffff')
+        
+        # Buttons
+        button_frame = tk.Frame(main_frame, bg='#1a1a1a')
+        button_frame.pack(fill=tk.X)
+        
+        tk.Button(button_frame, text="Clear Log", command=self._clear_log, 
+                 bg='#e74c3c', fg='white', relief=tk.FLAT, padx=15).pack(side=tk.LEFT)
+        
+        tk.Button(button_frame, text="Minimize", command=self.minimize, 
+                 bg='#3498db', fg='white', relief=tk.FLAT, padx=15).pack(side=tk.LEFT, padx=(10, 0))
+        
+        tk.Button(button_frame, text="Exit", command=self.exit_app, 
+                 bg='#c0392b', fg='white', relief=tk.FLAT, padx=15).pack(side=tk.RIGHT)
+    
+    def _process_queue(self):
+        """Apply everything queued since the last tick in one pass"""
+        try:
+            with self._pending_lock:
+                pending, self._pending = self._pending, {}
+            for action, args in pending.values():
+                action(*args)
+            
+            lines = []
+            try:
+                while len(lines) < self.MAX_LOG_LINES * 2:
+                    lines.append(self.message_queue.get_nowait())
+            except queue.Empty:
+                pass
+            if lines:
+                self._render_log(lines)
+        finally:
+            self.root.after(self.TICK_MS, self._process_queue)
+    
+    def _defer(self, action, *args, key=None):
+        """Schedule a widget update; a later call for the same action (or key) replaces it"""
+        with self._pending_lock:
+            self._pending[key or action] = (action, args)
+    
+    def after(self, delay_ms, callback):
+        """Thread-safe root.after()"""
+        self._defer(self.root.after, delay_ms, callback, key=('after', callback))
+    
+    def log(self, message, level='INFO'):
+        """Thread-safe logging"""
+        self.message_queue.put((datetime.now(), message, level))
+    
+    def _render_log(self, lines):
+        """Insert a batch of log lines with one widget call, keeping at most MAX_LOG_LINES"""
+        indicators = {'INFO': '🔵', 'WARNING': '🟡', 'ERROR': '🔴', 'SUCCESS': '🟢'}
+        chunks = []
+        if len(lines) >= self.MAX_LOG_LINES:
+            # The batch alone fills the view: replace it, noting what was left out
+            skipped = len(lines) - self.MAX_LOG_LINES + 1
+            lines = lines[skipped:]
+            self.log_text.delete('1.0', tk.END)
+            chunks += [f"… {skipped:,} messages not shown (see the log file)\n", 'WARNING']
+        
+        # Runs of same-level lines become one (text, tag) pair
+        for timestamp, message, level in lines:
+            text = f"[{timestamp:%H:%M:%S}] {indicators.get(level, '🔵')} {message}\n"
+            if chunks and chunks[-1] == level:
+                chunks[-2] += text
+            else:
+                chunks += [text, level]
+        
+        at_bottom = self.log_text.yview()[1] >= 0.999
+        self.log_text.insert(tk.END, *chunks)
+        
+        excess = int(self.log_text.index('end-1c').split('.')[0]) - 1 - self.MAX_LOG_LINES
+        if excess > 0:
+            self.log_text.delete('1.0', f"{excess + 1}.0")
+        if at_bottom:
+            self.log_text.see(tk.END)
+    
+    def update_status(self, status, color='#3498db'):
+        """Update status"""
+        self._defer(self._set_status, status, color)
+    
+    def _set_status(self, status, color):
+        self.status_label.config(text=status)
+        self.status_indicator.config(fg=color)
+    
+    def update_device_info(self, info):
+        """Update device info"""
+        self._defer(self._set_device_info, info)
+    
+    def _set_device_info(self, info):
+        self.device_info.config(text=info, fg='#2ecc71')
+    
+    def update_progress(self, text):
+        """Update scan progress line"""
+        self._defer(self._set_progress, text)
+    
+    def _set_progress(self, text):
+        self.progress_info.config(text=text)
+    
+    def start_progress(self):
+        self._defer(self._set_spinner, True)
+    
+    def stop_progress(self):
+        self._defer(self._set_spinner, False)
+    
+    def _set_spinner(self, running):
+        if running:
+            self.progress.start(10)
+        else:
+            self.progress.stop()
+    
+    def show(self):
+        """Show window"""
+        self._defer(self._show)
+    
+    def _show(self):
+        if self.minimized:
+            self.root.deiconify()
+            self.root.lift()
+            self.minimized = False
+    
+    def minimize(self):
+        """Minimize window"""
+        self.root.withdraw()
+        self.minimized = True
+    
+    def _clear_log(self):
+        """Clear log"""
+        self.log_text.delete(1.0, tk.END)
+        self.log("Log cleared")
+    
+    def on_closing(self):
+        """Handle close"""
+        if messagebox.askokcancel("Quit", "Exit USB Scanner?"):
+            self.exit_app()
+    
+    def exit_app(self):
+        """Exit application"""
+        self.root.quit()
+        self.root.destroy()
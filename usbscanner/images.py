@@ -0,0 +1,235 @@
+"""Disk images: partition tables, filesystem probing and read-only loop mounts"""
+
+import os
+import re
+import shutil
+import struct
+import subprocess
+import tempfile
+import uuid
+from collections import namedtuple
+
+
+# Partition tables
+
+SECTOR = 512
+EXTENDED_TYPES = (0x05, 0x0F, 0x85)
+GPT_SIGNATURE = b'EFI PART'
+
+# number is 0 for a filesystem that fills the whole image (no partition table)
+Volume = namedtuple('Volume', ['number', 'offset', 'size', 'fs_type', 'uuid', 'label'])
+
+
+def _read_at(f, offset, size):
+    f.seek(offset)
+    return f.read(size)
+
+
+def _mbr_entries(sector):
+    """(type, first LBA, sectors) for the four entries of an MBR or EBR"""
+    entries = []
+    for i in range(4):
+        entry = sector[446 + 16 * i:462 + 16 * i]
+        kind = entry[4]
+        start, count = struct.unpack_from('<LL', entry, 8)
+        entries.append((kind, start, count))
+    return entries
+
+
+def _gpt_partitions(f, sector_size):
+    header = _read_at(f, sector_size, 92)
+    if header[:8] != GPT_SIGNATURE:
+        return None
+    table_lba, count, entry_size = struct.unpack_from('<QLL', header, 72)
+    table = _read_at(f, table_lba * sector_size, count * entry_size)
+    partitions = []
+    for i in range(count):
+        entry = table[i * entry_size:(i + 1) * entry_size]
+        if len(entry) < 48 or not entry[:16].strip(b'\0'):
+            continue
+        first, last = struct.unpack_from('<QQ', entry, 32)
+        partitions.append((i + 1, first * sector_size, (last - first + 1) * sector_size))
+    return partitions
+
+
+def _mbr_partitions(f, sector):
+    partitions = []
+    for number, (kind, start, count) in enumerate(_mbr_entries(sector), 1):
+        if not kind or not count:
+            continue
+        if kind not in EXTENDED_TYPES:
+            partitions.append((number, start * SECTOR, count * SECTOR))
+            continue
+        # Logical partitions: a chain of EBRs, each pointing at the next
+        number, ebr, seen = 4, start, set()
+        while ebr not in seen:
+            seen.add(ebr)
+            entries = _mbr_entries(_read_at(f, ebr * SECTOR, SECTOR).ljust(SECTOR, b'\0'))
+            logical_kind, logical_start, logical_count = entries[0]
+            if logical_kind and logical_count:
+                number += 1
+                partitions.append((number, (ebr + logical_start) * SECTOR, logical_count * SECTOR))
+            next_kind, next_start, _ = entries[1]
+            if next_kind not in EXTENDED_TYPES:
+                break
+            ebr = start + next_start
+    return partitions
+
+
+def partition_table(f):
+    """(number, byte offset, byte size) for each partition of an MBR or GPT image"""
+    sector = _read_at(f, 0, SECTOR)
+    if len(sector) < SECTOR or sector[510:512] != b'\x55\xaa':
+        return []
+    if any(kind == 0xEE for kind, _, _ in _mbr_entries(sector)):
+        for sector_size in (512, 4096):
+            partitions = _gpt_partitions(f, sector_size)
+            if partitions is not None:
+                return partitions
+    return _mbr_partitions(f, sector)
+
+
+# Filesystems
+
+def _text(raw, encoding='ascii'):
+    return raw.decode(encoding, 'replace').strip(' \0') or None
+
+
+def probe_filesystem(f, offset):
+    """(fs_type, uuid, label) of the filesystem starting at offset, in blkid's notation"""
+    boot = _read_at(f, offset, 4096).ljust(4096, b'\0')
+    if boot[3:11] == b'NTFS    ':
+        return 'ntfs', f"{struct.unpack_from('<Q', boot, 0x48)[0]:016X}", None
+    if boot[3:11] == b'EXFAT   ':
+        serial = struct.unpack_from('<L', boot, 0x64)[0]
+        return 'exfat', f"{serial >> 16:04X}-{serial & 0xFFFF:04X}", None
+    if boot[510:512] == b'\x55\xaa':
+        for kind, serial_at, label_at in ((0x52, 0x43, 0x47), (0x36, 0x27, 0x2B)):
+            if boot[kind:kind + 3] == b'FAT':
+                serial = struct.unpack_from('<L', boot, serial_at)[0]
+                label = _text(boot[label_at:label_at + 11])
+                return 'vfat', f"{serial >> 16:04X}-{serial & 0xFFFF:04X}", \
+                    None if label == 'NO NAME' else label
+    if struct.unpack_from('<H', boot, 1024 + 56)[0] == 0xEF53:
+        compat, incompat = struct.unpack_from('<LL', boot, 1024 + 92)
+        fs_type = 'ext4' if incompat & 0x40 else 'ext3' if compat & 0x4 else 'ext2'
+        return fs_type, str(uuid.UUID(bytes=boot[1024 + 104:1024 + 120])), _text(boot[1024 + 120:1024 + 136])
+    iso = _read_at(f, offset + 32768, 72)
+    if iso[1:6] == b'CD001':
+        return 'iso9660', None, _text(iso[40:72])
+    return None, None, None
+
+
+def image_volumes(path):
+    """Volumes of a raw disk image: its partitions, or the image itself if it holds a bare filesystem"""
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        fs_type, fs_uuid, label = probe_filesystem(f, 0)
+        if fs_type:
+            return [Volume(0, 0, size, fs_type, fs_uuid, label)]
+        volumes = []
+        for number, offset, length in partition_table(f):
+            if offset >= size:
+                continue
+            volumes.append(Volume(number, offset, min(length, size - offset), *probe_filesystem(f, offset)))
+        return volumes
+
+
+# Mounting
+
+def _run(args, timeout=60):
+    try:
+        process = subprocess.run(args, capture_output=True, text=True, timeout=timeout)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        raise OSError(f"{args[0]}: {e}")
+    if process.returncode != 0:
+        raise OSError(f"{' '.join(args[:2])}: {(process.stderr or process.stdout).strip()}")
+    return process.stdout
+
+
+class ImageMount:
+    """Read-only mount of one volume of an image file.
+
+    The volume is attached to a read-only loop device, so neither the
+    filesystem driver nor journal recovery can write to the image. Root
+    mounts it directly; other users go through udisks.
+    """
+
+    MOUNT_OPTIONS = 'ro,nosuid,nodev,noexec'
+
+    def __init__(self, image, volume):
+        self.image = image
+        self.volume = volume
+        self.path = None
+        self.loop = None
+        self.directory = None
+
+    def mount(self):
+        """Mount the volume and return the mount point (OSError if it cannot be mounted)"""
+        if os.geteuid() == 0:
+            self._mount_loop()
+        elif shutil.which('udisksctl'):
+            self._mount_udisks()
+        else:
+            raise OSError("mounting images needs root or udisksctl")
+        return self.path
+
+    def _mount_loop(self):
+        options = f"{self.MOUNT_OPTIONS},loop,offset={self.volume.offset},sizelimit={self.volume.size}"
+        if self.volume.fs_type in ('ext3', 'ext4'):
+            options += ',noload'    # never replay the journal
+        self.directory = tempfile.mkdtemp(prefix='usb-scanner-image-')
+        try:
+            _run(['mount', '-t', self.volume.fs_type, '-o', options, self.image, self.directory])
+        except OSError:
+            os.rmdir(self.directory)
+            self.directory = None
+            raise
+        self.path = self.directory
+
+    def _mount_udisks(self):
+        output = _run(['udisksctl', 'loop-setup', '--no-user-interaction', '--read-only',
+                       '--file', self.image, '--offset', str(self.volume.offset),
+                       '--size', str(self.volume.size)])
+        match = re.search(r'(/dev/loop\d+)', output)
+        if not match:
+            raise OSError(f"udisksctl loop-setup: unexpected reply {output.strip()!r}")
+        self.loop = match.group(1)
+        try:
+            output = _run(['udisksctl', 'mount', '--no-user-interaction', '-b', self.loop,
+                           '-t', self.volume.fs_type, '-o', self.MOUNT_OPTIONS])
+        except OSError as e:
+            # udisks may have mounted the new loop device on its own
+            match = re.search(r"already mounted at [`']?(/[^'`]+)", str(e))
+            if not match:
+                self.unmount()
+                raise
+            self.path = match.group(1)
+            return
+        match = re.search(r' at (/.+?)\.?$', output.strip())
+        if not match:
+            self.unmount()
+            raise OSError(f"udisksctl mount: unexpected reply {output.strip()!r}")
+        self.path = match.group(1)
+
+    def unmount(self):
+        """Undo mount(); safe to call more than once"""
+        if self.directory:
+            try:
+                _run(['umount', self.directory])
+                os.rmdir(self.directory)
+            except OSError:
+                return
+            self.directory = None
+        elif self.loop:
+            if self.path:
+                try:
+                    _run(['udisksctl', 'unmount', '--no-user-interaction', '-b', self.loop])
+                except OSError:
+                    return
+            try:
+                _run(['udisksctl', 'loop-delete', '--no-user-interaction', '-b', self.loop])
+            except OSError:
+                pass
+            self.loop = None
+        self.path = None
@@ -0,0 +1,165 @@
+"""Asynchronous log writer: callers only enqueue, a background thread does the I/O"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+from collections import deque
+from pathlib import Path
+
+
+# Log files
+
+LEVELS = {'DEBUG': 10, 'INFO': 20, 'SUCCESS': 25, 'WARNING': 30, 'ERROR': 40}
+
+
+def _timestamp(ts, separator=' '):
+    return time.strftime(f'%Y-%m-%d{separator}%H:%M:%S', time.localtime(ts))
+
+
+class RotatingFile:
+    """Append-only file rotated by size: path -> path.1 -> ... -> path.<backups>"""
+
+    def __init__(self, path, max_bytes=10 * 1024 * 1024, backups=3):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(self.path, 'ab')
+
+    def write(self, data):
+        size = self.file.tell()
+        if self.max_bytes and size and size + len(data) > self.max_bytes:
+            self._rotate()
+        self.file.write(data)
+
+    def _rotate(self):
+        self.file.close()
+        for i in range(self.backups - 1, 0, -1):
+            older = self.path.with_name(f"{self.path.name}.{i}")
+            if older.exists():
+                os.replace(older, self.path.with_name(f"{self.path.name}.{i + 1}"))
+        if self.backups:
+            os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+        else:
+            self.path.unlink()
+        self.file = open(self.path, 'ab')
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+# Writer
+
+class LogWriter:
+    """Non-blocking log pipeline.
+
+    `write()` stamps a record and appends it to an in-memory queue. A
+    background thread takes everything queued at once and writes it as one
+    batch: echoed to the console (headless), appended to the text log in
+    the classic `time - LEVEL - message` format and, optionally, to a JSON
+    lines log, with one flush per batch. Both files rotate by size.
+
+    When more than `capacity` records are waiting, INFO and SUCCESS records
+    are counted instead of queued and one summary line is written once the
+    writer catches up. Warnings and errors are always kept.
+
+    Records that cannot be written (disk full, log directory gone) are
+    counted in `failed`; the first failure and, on close, the total are
+    reported on stderr. Once closed, `write()` refuses new records.
+    """
+
+    def __init__(self, path, json_path=None, console=False, max_bytes=10 * 1024 * 1024, backups=3,
+                 capacity=10000):
+        self.text = RotatingFile(path, max_bytes, backups)
+        self.json = RotatingFile(json_path, max_bytes, backups) if json_path else None
+        self.console = console
+        self.capacity = capacity
+        self.records = deque()
+        self.dropped = {}           # level -> records dropped since the last batch
+        self.dropped_total = 0
+        self.failed = 0             # records lost to write errors
+        self.cond = threading.Condition()
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def write(self, level, message):
+        """Queue one record; never blocks on I/O. False if it was not queued (dropped, or writer closed)"""
+        record = (time.time(), level, message, threading.current_thread().name)
+        with self.cond:
+            if self.closed:
+                return False
+            if len(self.records) >= self.capacity and LEVELS.get(level, 20) < LEVELS['WARNING']:
+                self.dropped[level] = self.dropped.get(level, 0) + 1
+                self.dropped_total += 1
+                return False
+            self.records.append(record)
+            if len(self.records) == 1:
+                self.cond.notify()
+        return True
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.records and not self.closed:
+                    self.cond.wait()
+                batch, self.records = self.records, deque()
+                dropped, self.dropped = self.dropped, {}
+                closed = self.closed
+            if dropped:
+                counts = ', '.join(f"{count:,} {level}" for level, count in sorted(dropped.items()))
+                batch.append((time.time(), 'WARNING', f"Log backlog: {counts} messages dropped", 'log-writer'))
+            if batch:
+                try:
+                    self._write_batch(batch)
+                except (OSError, ValueError) as e:
+                    self._failed(len(batch), e)
+            if closed:
+                return
+
+    def _failed(self, count, error):
+        """Count records lost to a write error; only the first failure is reported"""
+        if not self.failed:
+            sys.stderr.write(f"Cannot write log {self.text.path}: {error} (further failures only counted)\n")
+            sys.stderr.flush()
+        self.failed += count
+
+    def _write_batch(self, batch):
+        if self.console:
+            sys.stdout.write(''.join(f"[{_timestamp(ts)}] {level}: {message}\n"
+                                     for ts, level, message, _ in batch))
+            sys.stdout.flush()
+        # logging's level names in the text log (SUCCESS is an INFO record)
+        self.text.write(''.join(
+            f"{_timestamp(ts)},{int(ts * 1000) % 1000:03d} - "
+            f"{'INFO' if level == 'SUCCESS' else level} - {message}\n"
+            for ts, level, message, _ in batch).encode('utf-8', 'replace'))
+        self.text.flush()
+        if self.json:
+            self.json.write(''.join(
+                json.dumps({'time': f"{_timestamp(ts, 'T')}.{int(ts * 1000) % 1000:03d}", 'ts': round(ts, 6),
+                            'level': level, 'message': message, 'thread': thread}, ensure_ascii=False) + '\n'
+                for ts, level, message, thread in batch).encode('utf-8', 'replace'))
+            self.json.flush()
+
+    def close(self, timeout=5):
+        """Write out everything queued and stop the writer"""
+        with self.cond:
+            if self.closed:
+                return
+            self.closed = True
+            self.cond.notify()
+        self.thread.join(timeout)
+        self.text.close()
+        if self.json:
+            self.json.close()
+        if self.failed:
+            sys.stderr.write(f"{self.failed:,} log records could not be written to {self.text.path}\n")
+            sys.stderr.flush()
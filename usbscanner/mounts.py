@@ -0,0 +1,151 @@
+"""Mount table tracking from the event loop"""
+
+import os
+import re
+import select
+import asyncio
+import threading
+
+
+def _unescape_mountinfo(field):
+    """Decode the octal escapes (\\040 etc.) used in mountinfo fields"""
+    return re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), field)
+
+
+def parse_mountinfo(text):
+    """Parse /proc/self/mountinfo into a list of mount dicts"""
+    mounts = []
+    for line in text.splitlines():
+        fields = line.split()
+        try:
+            separator = fields.index('-', 6)
+        except ValueError:
+            continue
+        if len(fields) < separator + 3:
+            continue
+        mounts.append({
+            'mount_id': fields[0],
+            'dev': fields[2],
+            'root': _unescape_mountinfo(fields[3]),
+            'mount_point': _unescape_mountinfo(fields[4]),
+            'options': fields[5],
+            'fs_type': fields[separator + 1],
+            'source': _unescape_mountinfo(fields[separator + 2]),
+        })
+    return mounts
+
+
+class MountWatcher:
+    """In-memory mount table kept current by watching mountinfo from the event loop.
+
+    The kernel flags /proc/self/mountinfo with POLLPRI whenever the mount
+    table changes, so waiting for a mount costs no polling: the descriptor
+    sits in an epoll set registered for EPOLLPRI, and that epoll fd is
+    watched by the loop (`attach`). Any other file (e.g. a fake mountinfo)
+    is re-read when its mtime changes instead.
+    """
+
+    def __init__(self, path='/proc/self/mountinfo', poll_interval=0.2):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.event_driven = path.startswith('/proc/')
+        self.mounts = []
+        self.lock = threading.RLock()    # lookup() also runs on scan threads
+        self._mtime = None
+        self._loop = None
+        self._epoll = None
+        self._file = None
+        self._timer = None
+        self._waiters = []
+        self.refresh()
+
+    def refresh(self):
+        """Re-read the mount table and wake up waiters"""
+        with open(self.path) as f:
+            self._update(f.read())
+
+    def _update(self, text):
+        mounts = parse_mountinfo(text)
+        with self.lock:
+            self.mounts = mounts
+            waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            self._loop.call_soon_threadsafe(self._wake, waiter)
+
+    @staticmethod
+    def _wake(waiter):
+        if not waiter.done():
+            waiter.set_result(None)
+
+    def _check_mtime(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            if mtime != self._mtime:
+                self._mtime = mtime
+                self.refresh()
+        except OSError:
+            pass
+
+    def attach(self, loop):
+        """Start watching from an asyncio event loop"""
+        self._loop = loop
+        if self.event_driven:
+            self._file = open(self.path)
+            self._epoll = select.epoll()
+            self._epoll.register(self._file.fileno(), select.EPOLLPRI | select.EPOLLERR)
+            loop.add_reader(self._epoll.fileno(), self._on_epoll)
+        else:
+            self._timer = loop.call_later(self.poll_interval, self._on_timer)
+
+    def detach(self):
+        if self._epoll:
+            self._loop.remove_reader(self._epoll.fileno())
+            self._epoll.close()
+            self._file.close()
+            self._epoll = self._file = None
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+    def _on_epoll(self):
+        # Checking readiness already consumed the mountinfo event, so the
+        # inner poll may come back empty: re-read whenever we are woken
+        self._epoll.poll(0)
+        self._file.seek(0)
+        self._update(self._file.read())
+
+    def _on_timer(self):
+        self._check_mtime()
+        self._timer = self._loop.call_later(self.poll_interval, self._on_timer)
+
+    def lookup(self, device_path):
+        """Mount point of a block device, or None"""
+        try:
+            rdev = os.stat(device_path).st_rdev
+            dev = f"{os.major(rdev)}:{os.minor(rdev)}"
+        except OSError:
+            dev = None
+        real_path = os.path.realpath(device_path)
+        with self.lock:
+            mounts = self.mounts
+        matches = [m for m in mounts
+                   if (dev and m['dev'] == dev) or m['source'] in (device_path, real_path)]
+        # Prefer the mount of the filesystem root over bind mounts of subdirectories
+        matches.sort(key=lambda m: m['root'] != '/')
+        return matches[0]['mount_point'] if matches else None
+
+    async def wait_for_async(self, device_path, timeout=30):
+        """Wait until device_path is mounted (requires attach()); returns the mount point or None"""
+        deadline = self._loop.time() + timeout
+        while True:
+            remaining = deadline - self._loop.time()
+            with self.lock:
+                mount_point = self.lookup(device_path)
+                if mount_point or remaining <= 0:
+                    return mount_point
+                waiter = self._loop.create_future()
+                self._waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, remaining)
+            except asyncio.TimeoutError:
+                pass
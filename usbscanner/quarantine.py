@@ -0,0 +1,194 @@
+"""Content-addressed, compressed quarantine store"""
+
+import os
+import threading
+import json
+import sqlite3
+import hashlib
+import lzma
+import zlib
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+
+# Quarantine
+
+class QuarantineStore:
+    """Content-addressed, compressed quarantine with a single SQLite index.
+
+    Each distinct file body is stored once under objects/<sha[:2]>/<sha>
+    (compressed with lzma or zlib); every quarantine event becomes a row in
+    the index pointing at its object. Files are streamed in fixed-size
+    chunks, so memory use does not depend on file size.
+    """
+
+    CHUNK_SIZE = 1024 * 1024
+    CODECS = {'lzma': '.xz', 'zlib': '.zz'}
+
+    def __init__(self, directory, compression='lzma'):
+        self.directory = Path(directory)
+        self.objects = self.directory / 'objects'
+        self.compression = compression if compression in self.CODECS else 'lzma'
+        self.lock = threading.Lock()
+        self.objects.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(self.directory / 'quarantine.db'), check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS objects (
+                sha256 TEXT PRIMARY KEY,
+                codec TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                stored_size INTEGER NOT NULL,
+                created TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS entries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sha256 TEXT NOT NULL REFERENCES objects (sha256),
+                original_path TEXT NOT NULL,
+                detection TEXT,
+                quarantine_time TEXT NOT NULL,
+                device_info TEXT,
+                restored_to TEXT);
+            CREATE INDEX IF NOT EXISTS entries_sha256 ON entries (sha256);
+        """)
+        self.db.commit()
+
+    def _object_path(self, digest, codec):
+        return self.objects / digest[:2] / f"{digest}{self.CODECS[codec]}"
+
+    def _compressor(self, codec):
+        if codec == 'zlib':
+            return zlib.compressobj(6)
+        return lzma.LZMACompressor(preset=1)
+
+    def _decompressor(self, codec):
+        if codec == 'zlib':
+            return zlib.decompressobj()
+        return lzma.LZMADecompressor()
+
+    def add(self, file_path, detection, device_info=None, original_path=None, quarantine_time=None):
+        """Store a file; returns (entry id, sha256, duplicate)"""
+        digest = hashlib.sha256()
+        compressor = self._compressor(self.compression)
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.objects, suffix='.tmp')
+        try:
+            with open(file_path, 'rb') as src, os.fdopen(fd, 'wb') as dst:
+                while True:
+                    chunk = src.read(self.CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    digest.update(chunk)
+                    dst.write(compressor.compress(chunk))
+                dst.write(compressor.flush())
+            sha = digest.hexdigest()
+            stored_size = os.path.getsize(tmp_path)
+
+            with self.lock:
+                known = self.db.execute("SELECT codec FROM objects WHERE sha256 = ?", (sha,)).fetchone()
+                if known and self._object_path(sha, known['codec']).exists():
+                    os.remove(tmp_path)
+                else:
+                    object_path = self._object_path(sha, self.compression)
+                    object_path.parent.mkdir(exist_ok=True)
+                    os.replace(tmp_path, object_path)
+                    self.db.execute("INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?)",
+                                    (sha, self.compression, size, stored_size, datetime.now().isoformat()))
+                entry_id = self.db.execute(
+                    "INSERT INTO entries (sha256, original_path, detection, quarantine_time, device_info) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (sha, original_path or file_path, detection, quarantine_time or datetime.now().isoformat(),
+                     json.dumps(device_info) if device_info else None)).lastrowid
+                self.db.commit()
+            return entry_id, sha, bool(known)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def list(self):
+        with self.lock:
+            rows = self.db.execute("""SELECT e.*, o.size, o.stored_size FROM entries e
+                                      JOIN objects o USING (sha256) ORDER BY e.id""").fetchall()
+        return [dict(row) for row in rows]
+
+    def get(self, entry_id):
+        with self.lock:
+            row = self.db.execute("""SELECT e.*, o.codec FROM entries e
+                                     JOIN objects o USING (sha256) WHERE e.id = ?""", (entry_id,)).fetchone()
+        return dict(row) if row else None
+
+    def restore(self, entry_id, destination=None):
+        """Decompress an entry back to disk; returns the path written"""
+        entry = self.get(entry_id)
+        if not entry:
+            raise KeyError(f"No quarantine entry {entry_id}")
+        target = destination or entry['original_path']
+        if not os.path.isdir(os.path.dirname(target) or '.'):
+            target = os.path.join(os.path.expanduser('~'), 'Desktop', os.path.basename(target))
+        if os.path.exists(target):
+            raise FileExistsError(f"{target} already exists")
+
+        decompressor = self._decompressor(entry['codec'])
+        with open(self._object_path(entry['sha256'], entry['codec']), 'rb') as src, open(target, 'xb') as dst:
+            while True:
+                chunk = src.read(self.CHUNK_SIZE)
+                if not chunk:
+                    break
+                dst.write(decompressor.decompress(chunk))
+            if entry['codec'] == 'zlib':
+                dst.write(decompressor.flush())
+
+        with self.lock:
+            self.db.execute("UPDATE entries SET restored_to = ? WHERE id = ?", (target, entry_id))
+            self.db.commit()
+        return target
+
+    def purge(self, entry_id=None):
+        """Delete one entry (or all) and any objects nobody references; returns entries removed"""
+        with self.lock:
+            if entry_id is None:
+                removed = self.db.execute("DELETE FROM entries").rowcount
+            else:
+                removed = self.db.execute("DELETE FROM entries WHERE id = ?", (entry_id,)).rowcount
+            orphans = self.db.execute("""SELECT sha256, codec FROM objects WHERE sha256 NOT IN
+                                         (SELECT sha256 FROM entries)""").fetchall()
+            for orphan in orphans:
+                try:
+                    os.remove(self._object_path(orphan['sha256'], orphan['codec']))
+                except FileNotFoundError:
+                    pass
+            self.db.executemany("DELETE FROM objects WHERE sha256 = ?", [(o['sha256'],) for o in orphans])
+            self.db.commit()
+        return removed
+
+    def import_legacy(self):
+        """Move flat-file quarantine entries (*.quarantine + .metadata) into the store.
+
+        Files that cannot be read are left where they are for the next
+        attempt. Returns (imported, skipped).
+        """
+        imported = skipped = 0
+        for path in sorted(self.directory.glob('*.quarantine')):
+            metadata_path = Path(f"{path}.metadata")
+            try:
+                with open(metadata_path) as f:
+                    metadata = json.load(f)
+            except (OSError, ValueError):
+                metadata = {}
+            try:
+                quarantine_time = datetime.strptime(metadata['quarantine_time'], "%Y%m%d_%H%M%S").isoformat()
+            except (KeyError, ValueError):
+                quarantine_time = None
+            try:
+                self.add(str(path), metadata.get('detection'), metadata.get('device_info'),
+                         original_path=metadata.get('original_path'), quarantine_time=quarantine_time)
+            except OSError:
+                skipped += 1
+                continue
+            path.unlink()
+            if metadata_path.exists():
+                metadata_path.unlink()
+            imported += 1
+        return imported, skipped
@@ -0,0 +1,313 @@
+"""Scan history and metrics"""
+
+import os
+import threading
+import time
+import json
+import sqlite3
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+from .engine import device_identity, parse_clam_line
+
+
+# Scan history
+
+def parse_since(value, now=None):
+    """Epoch seconds for '7d' / '12h' / '2w' (relative) or an ISO date/time"""
+    units = {'h': 3600, 'd': 86400, 'w': 7 * 86400}
+    value = value.strip()
+    if value[-1:] in units and value[:-1].isdigit():
+        return (now or time.time()) - int(value[:-1]) * units[value[-1]]
+    return datetime.fromisoformat(value).timestamp()
+
+
+def parse_duration(text):
+    """Seconds from a str(timedelta) such as '0:02:15.250000' (None if unparseable)"""
+    try:
+        hours, minutes, seconds = text.split(':')
+        return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    except (AttributeError, ValueError):
+        return None
+
+
+class ScanHistory:
+    """Append-only SQLite record of every scan, queryable by device, time and detection.
+
+    One row per scan (with the full report as JSON) plus one row per
+    detection. Recording a scan is a single small transaction.
+    """
+
+    GROUPINGS = {
+        'device': "COALESCE(s.device_id, s.mount_point)",
+        'day': "date(s.started, 'unixepoch', 'localtime')",
+        'month': "strftime('%Y-%m', s.started, 'unixepoch', 'localtime')",
+    }
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS scans (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                started REAL NOT NULL,
+                mount_point TEXT NOT NULL,
+                device_id TEXT,
+                device TEXT,
+                duration REAL,
+                files INTEGER,
+                bytes INTEGER,
+                threats INTEGER NOT NULL,
+                errors INTEGER,
+                cancelled INTEGER NOT NULL DEFAULT 0,
+                report TEXT NOT NULL,
+                UNIQUE (started, mount_point));
+            CREATE TABLE IF NOT EXISTS detections (
+                scan_id INTEGER NOT NULL REFERENCES scans (id),
+                path TEXT NOT NULL,
+                detection TEXT NOT NULL);
+            CREATE INDEX IF NOT EXISTS scans_started ON scans (started);
+            CREATE INDEX IF NOT EXISTS scans_device ON scans (device_id);
+            CREATE INDEX IF NOT EXISTS detections_scan ON detections (scan_id);
+            CREATE INDEX IF NOT EXISTS detections_name ON detections (detection);
+        """)
+        self.db.commit()
+
+    @staticmethod
+    def _device_label(device_info):
+        parts = [device_info.get(key) for key in ('vendor', 'model', 'label')]
+        return ' '.join(p for p in parts if p and p not in ('Unknown', 'No Label')) or None
+
+    def append(self, report):
+        """Record one scan report; returns its id (None if it was already recorded)"""
+        device_info = report.get('device') or {}
+        started = datetime.fromisoformat(report['timestamp']).timestamp()
+        duration = report.get('duration_seconds')
+        if duration is None:
+            duration = parse_duration(report.get('duration') or report.get('scan_duration'))
+        detections = []
+        for line in report.get('infected_files', []):
+            result = parse_clam_line(line)
+            if result and result.status == 'FOUND':
+                detections.append((result.path, result.detection))
+        with self.lock:
+            cursor = self.db.execute(
+                "INSERT OR IGNORE INTO scans (started, mount_point, device_id, device, duration, files, bytes, "
+                "threats, errors, cancelled, report) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (started, report['mount_point'], device_identity(device_info), self._device_label(device_info),
+                 duration, report.get('files_scanned'), report.get('bytes_scanned'),
+                 report.get('threats_found', len(detections)), report.get('scan_errors'),
+                 int(bool(report.get('cancelled'))), json.dumps(report, separators=(',', ':'))))
+            scan_id = cursor.lastrowid if cursor.rowcount else None
+            if scan_id:
+                self.db.executemany("INSERT INTO detections VALUES (?, ?, ?)",
+                                    [(scan_id, path, name) for path, name in detections])
+            self.db.commit()
+        return scan_id
+
+    def _where(self, device=None, since=None, until=None, detection=None, threats_only=False):
+        clauses, params = [], []
+        if device:
+            clauses.append("(s.device_id LIKE ? OR s.device LIKE ? OR s.mount_point LIKE ?)")
+            params += [f"%{device}%"] * 3
+        if since is not None:
+            clauses.append("s.started >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("s.started < ?")
+            params.append(until)
+        if detection:
+            clauses.append("s.id IN (SELECT scan_id FROM detections WHERE detection LIKE ?)")
+            params.append(f"%{detection}%")
+        if threats_only:
+            clauses.append("s.threats > 0")
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def scans(self, limit=50, **filters):
+        """Most recent scans matching the filters"""
+        where, params = self._where(**filters)
+        with self.lock:
+            return self.db.execute(
+                f"SELECT s.id, s.started, s.mount_point, s.device_id, s.device, s.duration, s.files, s.bytes, "
+                f"s.threats, s.errors, s.cancelled FROM scans s{where} ORDER BY s.started DESC LIMIT ?",
+                params + [limit]).fetchall()
+
+    def get(self, scan_id):
+        """Full report of one scan, or None"""
+        with self.lock:
+            row = self.db.execute("SELECT report FROM scans WHERE id = ?", (scan_id,)).fetchone()
+        return json.loads(row['report']) if row else None
+
+    def aggregate(self, group_by=None, **filters):
+        """Scan counts, threats and average duration, optionally grouped by device, day, month or detection"""
+        where, params = self._where(**filters)
+        if group_by == 'detection':
+            query = (f"SELECT d.detection AS key, COUNT(DISTINCT s.id) AS scans, COUNT(*) AS threats, "
+                     f"COUNT(DISTINCT COALESCE(s.device_id, s.mount_point)) AS devices, "
+                     f"MAX(s.started) AS last_seen FROM detections d JOIN scans s ON s.id = d.scan_id{where} "
+                     f"GROUP BY d.detection ORDER BY threats DESC")
+        else:
+            key = self.GROUPINGS.get(group_by, "'all'")
+            query = (f"SELECT {key} AS key, COUNT(*) AS scans, SUM(s.threats) AS threats, "
+                     f"SUM(s.threats > 0) AS infected_scans, "
+                     f"COUNT(DISTINCT COALESCE(s.device_id, s.mount_point)) AS devices, "
+                     f"AVG(s.duration) AS avg_duration, SUM(s.files) AS files, SUM(s.bytes) AS bytes, "
+                     f"MAX(s.started) AS last_seen, MAX(s.device) AS name FROM scans s{where} GROUP BY key ORDER BY key")
+        with self.lock:
+            return self.db.execute(query, params).fetchall()
+
+    def import_reports(self, paths):
+        """Record scan_report_*.json files written by earlier versions; returns the number added"""
+        added = 0
+        for path in paths:
+            try:
+                with open(path) as f:
+                    report = json.load(f)
+                if self.append(report):
+                    added += 1
+            except (OSError, ValueError, KeyError, TypeError):
+                continue
+        return added
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+# Metrics
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+
+class Metrics:
+    """In-process counters, gauges and histograms rendered in Prometheus text format.
+
+    Collectors registered with `collect_with` are called just before
+    rendering, for values that are cheaper to read than to track (queue
+    depth and the like).
+    """
+
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900, 3600)
+
+    def __init__(self, prefix='usb_scanner'):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self._meta = {}         # name -> (type, help)
+        self._values = {}       # name -> {labels: value or [bucket counts, sum, count]}
+        self._collectors = []
+
+    def describe(self, name, kind, help_text):
+        with self.lock:
+            self._meta[name] = (kind, help_text)
+            self._values.setdefault(name, {})
+
+    def collect_with(self, collector):
+        self._collectors.append(collector)
+
+    def inc(self, name, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self._values[name]
+            series[key] = series.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self._values[name][tuple(sorted(labels.items()))] = value
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self._values[name]
+            state = series.setdefault(key, [[0] * len(self.BUCKETS), 0.0, 0])
+            for i, bound in enumerate(self.BUCKETS):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        for collector in self._collectors:
+            try:
+                collector(self)
+            except Exception:
+                pass
+        lines = []
+        with self.lock:
+            for name, (kind, help_text) in self._meta.items():
+                full = f"{self.prefix}_{name}"
+                lines.append(f"# HELP {full} {help_text}")
+                lines.append(f"# TYPE {full} {kind}")
+                for labels, value in self._values[name].items():
+                    if kind != 'histogram':
+                        lines.append(f"{full}{_format_labels(labels)} {value}")
+                        continue
+                    counts, total, count = value
+                    for bound, bucket in zip(self.BUCKETS, counts):
+                        lines.append(f"{full}_bucket{_format_labels(labels + (('le', bound),))} {bucket}")
+                    lines.append(f"{full}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}")
+                    lines.append(f"{full}_sum{_format_labels(labels)} {total}")
+                    lines.append(f"{full}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path):
+        """Atomically write the metrics for node-exporter's textfile collector"""
+        path = Path(path)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(self.render())
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+
+class MetricsServer:
+    """Serve /metrics on a localhost port from a background thread"""
+
+    def __init__(self, metrics, port, host='127.0.0.1'):
+        # Only stations that serve metrics pay for importing the HTTP stack
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        metrics_ref = metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/metrics', '/'):
+                    self.send_error(404)
+                    return
+                body = metrics_ref.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name='metrics-http', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
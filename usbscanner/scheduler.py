@@ -0,0 +1,211 @@
+"""Per-device scan jobs, their worker pool and shared engine capacity"""
+
+import sys
+import time
+import queue
+import threading
+import traceback
+from contextlib import contextmanager
+
+
+class ScanJob:
+    """A scan of one device, queued or running"""
+
+    _ids = iter(range(1, sys.maxsize))
+
+    def __init__(self, device_path, mount_point, device_info, detected_at=None, mounted_at=None):
+        self.id = next(self._ids)
+        self.device_path = device_path
+        self.mount_point = mount_point
+        self.device_info = device_info
+        self.state = 'queued'    # queued, running, done, failed, cancelled
+        self.detected_at = detected_at      # udev event (None for devices present at startup)
+        self.mounted_at = mounted_at
+        self.queued_at = time.time()
+        self.cancel_event = threading.Event()
+        self.finished = threading.Event()
+        self.progress = None
+        self.report = None                  # what _save_report recorded, once finished
+        self.error = None                   # exception that made the job fail
+        self.priority = {}                  # nice / ionice applied to the worker running it
+        self._callbacks = []
+        self._callback_lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'device': self.device_path,
+            'mount_point': self.mount_point,
+            'label': self.device_info.get('label'),
+            'state': self.state,
+            'queued_at': self.queued_at,
+            'progress': self.progress.as_dict() if self.progress else None,
+            'error': self.error,
+        }
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def add_done_callback(self, callback):
+        """Call callback(job) once the job has finished (immediately if it already has)"""
+        with self._callback_lock:
+            if not self.finished.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def finish(self):
+        with self._callback_lock:
+            self.finished.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+
+class EngineSlots:
+    """Share engine capacity fairly between concurrently running jobs.
+
+    When a slot frees up it goes to the waiting job that currently holds the
+    fewest slots, so one large device cannot starve the others.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = max(1, capacity)
+        self._cond = threading.Condition()
+        self._in_use = 0
+        self._held = {}
+        self._waiting = {}
+
+    def _is_next(self, owner):
+        fewest = min(self._held.get(o, 0) for o in self._waiting)
+        return self._held.get(owner, 0) == fewest
+
+    @contextmanager
+    def slot(self, owner):
+        """Hold one engine slot on behalf of `owner`"""
+        with self._cond:
+            self._waiting[owner] = self._waiting.get(owner, 0) + 1
+            while self._in_use >= self.capacity or not self._is_next(owner):
+                self._cond.wait()
+            self._waiting[owner] -= 1
+            if not self._waiting[owner]:
+                del self._waiting[owner]
+            self._in_use += 1
+            self._held[owner] = self._held.get(owner, 0) + 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._in_use -= 1
+                self._held[owner] -= 1
+                if not self._held[owner]:
+                    del self._held[owner]
+                self._cond.notify_all()
+
+    def usage(self):
+        """(slots in use, slot requests waiting)"""
+        with self._cond:
+            return self._in_use, sum(self._waiting.values())
+
+    def share(self, active_jobs):
+        """Fair number of slots per job with `active_jobs` running"""
+        return max(1, self.capacity // max(1, active_jobs))
+
+
+class ScanScheduler:
+    """Bounded queue of per-device scan jobs served by a fixed worker pool"""
+
+    def __init__(self, run_job, max_concurrent=2, max_queued=32, log=None):
+        self.run_job = run_job
+        self.log = log
+        self.max_concurrent = max(1, max_concurrent)
+        self.queue = queue.Queue(maxsize=max_queued)
+        self.lock = threading.Lock()
+        self.jobs = {}      # device path -> queued or running job
+        self.workers = []
+
+    def start(self):
+        for i in range(self.max_concurrent):
+            worker = threading.Thread(target=self._worker, name=f"scan-worker-{i}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def stop(self):
+        with self.lock:
+            jobs = list(self.jobs.values())
+        for job in jobs:
+            job.cancel()
+            if job.state == 'queued':
+                # Workers may exit before reaching it
+                job.state = 'cancelled'
+                job.finish()
+        # Make room so every worker gets its sentinel
+        while True:
+            try:
+                job = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None:
+                job.state = 'cancelled'
+                with self.lock:
+                    if self.jobs.get(job.device_path) is job:
+                        del self.jobs[job.device_path]
+                job.finish()
+        for _ in self.workers:
+            self.queue.put(None)
+
+    def submit(self, job):
+        """Queue a job; returns False if the device is already queued or the queue is full"""
+        with self.lock:
+            if job.device_path in self.jobs:
+                return False
+            try:
+                self.queue.put_nowait(job)
+            except queue.Full:
+                return False
+            self.jobs[job.device_path] = job
+            return True
+
+    def cancel(self, device_path):
+        with self.lock:
+            job = self.jobs.get(device_path)
+        if job:
+            job.cancel()
+        return job
+
+    def running(self):
+        with self.lock:
+            return [job for job in self.jobs.values() if job.state == 'running']
+
+    def pending(self):
+        with self.lock:
+            return [job for job in self.jobs.values() if job.state == 'queued']
+
+    def _worker(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+            try:
+                if job.cancelled:
+                    job.state = 'cancelled'
+                    continue
+                job.state = 'running'
+                self.run_job(job)
+                if job.state == 'running':
+                    job.state = 'cancelled' if job.cancelled else 'done'
+            except Exception as e:
+                job.state = 'failed'
+                job.error = f"{type(e).__name__}: {e}"
+                if self.log:
+                    self.log(f"❌ Scan of {job.device_path} crashed: {job.error}\n{traceback.format_exc().rstrip()}",
+                             'ERROR')
+            finally:
+                with self.lock:
+                    if self.jobs.get(job.device_path) is job:
+                        del self.jobs[job.device_path]
+                job.finish()